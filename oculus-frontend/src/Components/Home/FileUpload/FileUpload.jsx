@@ -23,8 +23,8 @@ const FileUpload = () => {
     reader.readAsDataURL(file);
   };
 
-  const seeResult = () => {
-    const results = analysisResultService.getAnalysisResults();
+  const seeResult = async () => {
+    const { results } = await analysisResultService.getAnalysisResults();
     if (results.length > 0) {
       const latestResult = results.reduce((latest, current) =>
         new Date(current.timestamp) > new Date(latest.timestamp)
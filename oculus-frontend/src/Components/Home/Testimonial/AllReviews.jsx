@@ -4,15 +4,18 @@ import { reviewService } from '../../../Services/api'; // Adjust path as needed
 
 const AllReviews = () => {
   const [reviews, setReviews] = useState([]);
+  const [nextPage, setNextPage] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState(null);
 
   useEffect(() => {
     const fetchAllReviews = async () => {
       try {
         setLoading(true);
-        const data = await reviewService.getReviews();
-        setReviews(data);
+        const page = await reviewService.getReviews();
+        setReviews(page.results);
+        setNextPage(page.next);
         setLoading(false);
       } catch (err) {
         setError('Failed to load reviews. Please try again later.');
@@ -24,6 +27,19 @@ const AllReviews = () => {
     fetchAllReviews();
   }, []);
 
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const page = await reviewService.getReviews(nextPage);
+      setReviews((current) => [...current, ...page.results]);
+      setNextPage(page.next);
+    } catch (err) {
+      console.error('Error fetching reviews:', err);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   // Format review data for testimonial cards (same as in Testimonials component)
   const formatReviewForTestimonial = (review) => {
     const doctor = review.doctor || {};
@@ -77,6 +93,19 @@ const AllReviews = () => {
             ))}
           </div>
         )}
+
+        {nextPage && (
+          <div className="mt-8 text-center">
+            <button
+              type="button"
+              onClick={loadMore}
+              disabled={loadingMore}
+              className="px-6 py-2 rounded-lg border border-gray-600 text-gray-200 font-inter text-sm hover:bg-gray-800 transition-colors disabled:opacity-50"
+            >
+              {loadingMore ? 'Loading...' : 'Load more'}
+            </button>
+          </div>
+        )}
       </div>
     </div>
   );
@@ -20,8 +20,9 @@ const Testimonial = () => {
     const fetchReviews = async () => {
       try {
         setLoading(true);
-        const data = await reviewService.getReviews();
-        setReviews(data);
+        // The carousel shows the latest page only
+        const page = await reviewService.getReviews();
+        setReviews(page.results);
         setLoading(false);
       } catch (err) {
         setError("Failed to load testimonials. Please try again later.");
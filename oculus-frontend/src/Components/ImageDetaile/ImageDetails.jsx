@@ -88,7 +88,7 @@ const ImageDetails = () => {
         <div className="grid grid-cols-1 md:grid-cols-2 gap-4 sm:gap-8 mb-8 sm:mb-16">
           <div className="flex flex-col items-center">
             <img
-              src={image.image_file}
+              src={image.image_preview || image.image_file}
               alt="Uploaded OCT"
               className="w-full h-48 sm:h-56 md:h-64 lg:h-72 object-cover rounded"
             />
@@ -98,7 +98,7 @@ const ImageDetails = () => {
           {analysisResult ? (
             <div className="flex flex-col items-center">
               <img
-                src={analysisResult.analysis_image}
+                src={analysisResult.analysis_preview || analysisResult.analysis_image}
                 alt="AI Result"
                 className="w-full h-48 sm:h-56 md:h-64 lg:h-72 object-cover rounded"
               />
@@ -6,30 +6,47 @@ import { octImageService } from "../../Services/api";
 const Records = () => {
   const [searchTerm, setSearchTerm] = useState("");
   const [images, setImages] = useState([]);
+  const [nextPage, setNextPage] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState(null);
 
+  // Search runs on the server; debounced so typing does not send a request per keystroke
   useEffect(() => {
-    const fetchImages = async () => {
+    let cancelled = false;
+    const timer = setTimeout(async () => {
       try {
-        const data = await octImageService.getImages();
-        setImages(data);
+        const page = await octImageService.getImages({ search: searchTerm.trim() });
+        if (!cancelled) {
+          setImages(page.results);
+          setNextPage(page.next);
+        }
       } catch (err) {
-        setError('Failed to fetch image records.');
+        if (!cancelled) setError('Failed to fetch image records.');
         console.error(err);
       } finally {
-        setLoading(false);
+        if (!cancelled) setLoading(false);
       }
+    }, searchTerm ? 300 : 0);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
     };
-    fetchImages();
-  }, []);
-
-  // Remove status filter since OCTImage model has no status field
-  const filteredImages = images.filter(
-    (image) =>
-      (image.custom_id?.toLowerCase().includes(searchTerm.toLowerCase()) ||
-        image.id.toLowerCase().includes(searchTerm.toLowerCase()))
-  );
+  }, [searchTerm]);
+
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const page = await octImageService.getImages({ cursor: nextPage });
+      setImages((current) => [...current, ...page.results]);
+      setNextPage(page.next);
+    } catch (err) {
+      setError('Failed to fetch image records.');
+      console.error(err);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
 
   // Animation variants (unchanged)
   const pageVariants = {
@@ -127,7 +144,7 @@ const Records = () => {
                 </thead>
                 <tbody className="divide-y divide-gray-200">
                   <AnimatePresence>
-                    {filteredImages.map((image, i) => (
+                    {images.map((image, i) => (
                       <motion.tr 
                         key={image.id}
                         custom={i}
@@ -160,7 +177,7 @@ const Records = () => {
         {/* Card view for small screens */}
         <AnimatePresence>
           <motion.div variants={containerVariants} className="md:hidden space-y-4">
-            {filteredImages.map((image, i) => (
+            {images.map((image, i) => (
               <motion.div 
                 key={image.id} 
                 custom={i}
@@ -200,8 +217,21 @@ const Records = () => {
           </motion.div>
         </AnimatePresence>
 
+        {nextPage && (
+          <div className="mt-6 text-center">
+            <button
+              type="button"
+              onClick={loadMore}
+              disabled={loadingMore}
+              className="bg-gradient-to-r from-gray-900 to-gray-400 text-white px-6 py-2 rounded-lg text-sm font-medium hover:opacity-90 transition-all duration-300 disabled:opacity-50"
+            >
+              {loadingMore ? 'Loading...' : 'Load more'}
+            </button>
+          </div>
+        )}
+
         <AnimatePresence>
-          {filteredImages.length === 0 && (
+          {images.length === 0 && (
             <motion.div 
               variants={itemVariants}
               initial={{ opacity: 0, y: 20 }}
@@ -354,7 +354,7 @@ const Result = () => {
         <div className="grid grid-cols-1 md:grid-cols-2 gap-8 mb-16">
           <div className="flex flex-col items-center">
             <img
-              src={image.image_file}
+              src={image.image_preview || image.image_file}
               alt="Uploaded OCT"
               className="w-full h-72 object-cover rounded"
             />
@@ -364,7 +364,7 @@ const Result = () => {
           {analysisResult ? (
             <div className="flex flex-col items-center">
               <img
-                src={analysisResult.analysis_image}
+                src={analysisResult.analysis_preview || analysisResult.analysis_image}
                 alt="AI Result"
                 className="w-full h-72 object-cover rounded"
               />
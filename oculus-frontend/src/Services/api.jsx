@@ -49,6 +49,14 @@ api.interceptors.response.use(
     }
 );
 
+// List endpoints are cursor-paginated: { next, previous, results }.
+// Pass a page's `next` URL back in as `cursor` to load the following page.
+// Searching and filtering happen on the server, so pages load on demand.
+const getPage = async (url, cursor = null, params = {}) => {
+    const response = await api.get(cursor || url, cursor ? {} : { params });
+    return response.data;
+};
+
 // Existing authService (unchanged)
 const authService = {
     signup: async (userData) => {
@@ -133,10 +141,10 @@ const octImageService = {
         }
     },
     
-    getImages: async () => {
+    // One page of the doctor's records; `search` matches the custom ID or image ID
+    getImages: async ({ search = '', cursor = null } = {}) => {
         try {
-            const response = await api.get('/oct-images/');
-            return response.data;
+            return await getPage('/oct-images/', cursor, search ? { search } : {});
         } catch (error) {
             console.error('Error fetching images:', error);
             throw error;
@@ -156,10 +164,9 @@ const octImageService = {
 
 // Analysis Result service
 const analysisResultService = {
-    getAnalysisResults: async () => {
+    getAnalysisResults: async (cursor = null) => {
         try {
-            const response = await api.get('/analysis-results/');
-            return response.data;
+            return await getPage('/analysis-results/', cursor);
         } catch (error) {
             console.error('Error fetching analysis results:', error);
             throw error;
@@ -168,8 +175,8 @@ const analysisResultService = {
     
     getAnalysisForImage: async (imageId) => {
         try {
-            const response = await api.get(`/analysis-results/?oct_image=${imageId}`);
-            return response.data;
+            const page = await getPage('/analysis-results/', null, { oct_image: imageId });
+            return page.results;
         } catch (error) {
             console.error(`Error fetching analysis for image ID ${imageId}:`, error);
             return [];  // Return empty array on error to prevent UI crashes
@@ -186,15 +193,14 @@ const reviewService = {
         return response.data;
     },
 
-    getReviews: async (analysisId = null) => {
-        const url = analysisId ? `/reviews/?analysis_result=${analysisId}` : '/reviews/';
-        const response = await api.get(url);
-        return response.data;
+    getReviews: async (cursor = null) => {
+        return getPage('/reviews/', cursor);
     },
 
+    // Reviews of one result fit in a single page
     getReviewsForAnalysis: async (analysisId) => {
-        const response = await api.get(`/reviews/?analysis_result=${analysisId}`);
-        return response.data;
+        const page = await getPage('/reviews/', null, { analysis_result: analysisId, page_size: 200 });
+        return page.results;
     },
 
     updateReview: async (reviewId, reviewData) => {
@@ -208,4 +214,4 @@ const reviewService = {
 
 };
 
-export { api, authService, octImageService, analysisResultService, reviewService, };
\ No newline at end of file
+export { api, getPage, authService, octImageService, analysisResultService, reviewService, };
\ No newline at end of file
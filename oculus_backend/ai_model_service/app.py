@@ -1,70 +1,143 @@
-import tensorflow as tf
 import numpy as np
 import cv2
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 import base64
 import io
 from PIL import Image
 import os
 import logging
+import math
+import threading
+import time
+
+from backends import backend_for_path, load_backend
+from batching import MicroBatcher
+import debug_capture
+import metrics
+from metrics import registry
+from preprocessing import InputBatch, preprocess_image, to_model_input
+from shap_explainer import (
+    AttributionCache, ExpectedGradientsExplainer, attribution_heatmap, fallback_background, image_key, load_background,
+    summarize_regions, summary_text,
+)
+from protocol import (
+    ANALYSIS_CONTENT_TYPE, encode_analysis_frame, read_request_image, read_request_images, wants_binary,
+    wants_explanation, wants_overlay,
+)
 
 app = Flask(__name__)
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-model_path = "../backend/api/models/retinal_model.h5"
-logger.debug(f"Loading model from: {os.path.abspath(model_path)}")
-model = tf.keras.models.load_model(model_path)
+model_path = os.environ.get("MODEL_PATH", "../backend/api/models/retinal_model.h5")
+# keras, tflite or onnx; defaults to the one matching MODEL_PATH's extension (see convert_model.py)
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND") or backend_for_path(model_path)
 
-def find_last_conv_layer(model):
-    for layer in reversed(model.layers):
-        if isinstance(layer, tf.keras.layers.Conv2D):
-            logger.debug(f"Found last Conv2D layer: {layer.name}")
-            return layer.name
-    raise ValueError("No Conv2D layer found in the model.")
+# Concurrent /predict calls are coalesced into one forward/backward pass.
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "10"))
+WARMUP_BATCH_SIZES = sorted({1, BATCH_MAX_SIZE})
+# Upper bound on images per forward pass for /predict_batch
+PREDICT_BATCH_CHUNK = int(os.environ.get("PREDICT_BATCH_CHUNK", "16"))
 
-def grad_cam(model, img_array, layer_name):
-    try:
-        grad_model = tf.keras.models.Model([model.inputs], [model.get_layer(layer_name).output, model.output])
-        with tf.GradientTape() as tape:
-            conv_outputs, predictions = grad_model(img_array)
-            predicted_class = tf.argmax(predictions[0])
-            loss = predictions[:, predicted_class]
-
-        grads = tape.gradient(loss, conv_outputs)
-        if grads is None:
-            raise ValueError("Gradient computation failed: grads is None")
-
-        pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
-        conv_outputs = conv_outputs[0]
-        heatmap = tf.reduce_sum(tf.multiply(pooled_grads, conv_outputs), axis=-1)
-        heatmap = tf.maximum(heatmap, 0)
-        max_val = tf.reduce_max(heatmap)
-        heatmap = heatmap / max_val if max_val > 0 else heatmap
-        heatmap = heatmap.numpy()
-
-        logger.debug(f"Grad-CAM generated successfully")
-        return heatmap, predicted_class.numpy(), predictions.numpy()
-    except Exception as e:
-        logger.error(f"Grad-CAM failed: {str(e)}", exc_info=True)
-        raise
+# /explain/shap: background set from `python shap_explainer.py --samples DIR`, and per-request budgets
+SHAP_BACKGROUND = os.environ.get("SHAP_BACKGROUND") or os.path.join(os.path.dirname(model_path), "shap_background.npz")
+SHAP_SAMPLES = int(os.environ.get("SHAP_SAMPLES", "64"))
+SHAP_MAX_SAMPLES = int(os.environ.get("SHAP_MAX_SAMPLES", "512"))
+SHAP_BUDGET_MS = float(os.environ.get("SHAP_BUDGET_MS", "3000"))
+SHAP_MAX_BUDGET_MS = float(os.environ.get("SHAP_MAX_BUDGET_MS", "30000"))
+SHAP_CHUNK = int(os.environ.get("SHAP_CHUNK", "16"))
+# Estimates running at once; more would starve /predict of the CPU
+SHAP_MAX_CONCURRENT = int(os.environ.get("SHAP_MAX_CONCURRENT", "1"))
+
+# Sampled request/overlay captures, opt-in with DEBUG_CAPTURE_RATE and never in production (see debug_capture.py)
+capture = debug_capture.from_environment()
+
+explainer = None
+batcher = None
+classify_batcher = None
+shap_explainer = None
+shap_cache = AttributionCache(int(os.environ.get("SHAP_CACHE_SIZE", "128")))
+shap_slots = threading.BoundedSemaphore(SHAP_MAX_CONCURRENT)
+# Each batcher has a single worker thread, so each can own one input buffer
+grad_cam_inputs = InputBatch(BATCH_MAX_SIZE)
+classify_inputs = InputBatch(BATCH_MAX_SIZE)
+
+# Histogram families served by /metrics
+STAGE_SECONDS = "oculus_stage_seconds"
+REQUEST_SECONDS = "oculus_request_seconds"
+
+def run_grad_cam_batch(images):
+    inputs = grad_cam_inputs.fill(images)
+    # Forward and backward pass run as one graph, so "gradcam" includes the forward pass
+    with registry.timer(STAGE_SECONDS, "gradcam"):
+        heatmaps, predicted_classes, predictions = explainer(inputs)
+    return [(heatmaps[i], int(predicted_classes[i]), predictions[i]) for i in range(len(images))]
+
+def run_classify_batch(images):
+    inputs = classify_inputs.fill(images)
+    with registry.timer(STAGE_SECONDS, "forward"):
+        predicted_classes, predictions = explainer.classify(inputs)
+    return [(int(predicted_classes[i]), predictions[i]) for i in range(len(images))]
+
+def build_shap_explainer(backend):
+    if not hasattr(backend, "model"):
+        logger.info(f"SHAP needs input gradients, which the {backend.name} backend does not have")
+        return None
+    if os.path.exists(SHAP_BACKGROUND):
+        background = load_background(SHAP_BACKGROUND)
+    else:
+        logger.warning(f"{SHAP_BACKGROUND} not found; SHAP attributions are relative to black and grey images")
+        background = fallback_background()
+    shap = ExpectedGradientsExplainer(backend.model, background, chunk_size=SHAP_CHUNK)
+    shap.warmup()
+    return shap
+
+def init_backend(backend):
+    """Install an inference backend (see backends.py), warm it up and start the batchers."""
+    global explainer, batcher, classify_batcher, shap_explainer
+    # Built and compiled once; warm-up runs before the service reports ready.
+    explainer = backend
+    explainer.warmup(WARMUP_BATCH_SIZES)
+    batcher = MicroBatcher(run_grad_cam_batch, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+    # Classification-only requests (?explain=0) skip the gradient pass, so they batch separately.
+    classify_batcher = MicroBatcher(run_classify_batch, max_batch_size=BATCH_MAX_SIZE,
+                                    max_wait_ms=BATCH_MAX_WAIT_MS, name="classify-batcher")
+    shap_explainer = build_shap_explainer(backend)
+
+# serve.py loads the model itself, after forking its workers
+if not os.environ.get("OCULUS_DEFER_MODEL_LOAD"):
+    logger.debug(f"Loading {INFERENCE_BACKEND} model from: {os.path.abspath(model_path)}")
+    init_backend(load_backend(INFERENCE_BACKEND, model_path))
 
 def overlay_heatmap(img_array, heatmap, alpha=0.4):
-    heatmap = cv2.resize(heatmap, (img_array.shape[2], img_array.shape[1]))
+    heatmap = cv2.resize(heatmap, (img_array.shape[1], img_array.shape[0]))
     heatmap = np.uint8(255 * heatmap)
     heatmap = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
-    img = np.uint8(img_array[0] * 255)
-    img_bgr = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+    img_bgr = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
     overlayed_img = cv2.addWeighted(img_bgr, 1 - alpha, heatmap, alpha, 0)
     overlayed_img = cv2.cvtColor(overlayed_img, cv2.COLOR_BGR2RGB)
     return overlayed_img
 
+def encode_image_to_png(image_array):
+    with registry.timer(STAGE_SECONDS, "png_encode"):
+        pil_img = Image.fromarray(image_array)
+        buffered = io.BytesIO()
+        pil_img.save(buffered, format="PNG")
+        return buffered.getvalue()
+
+def encode_heatmap(heatmap):
+    """Grad-CAM map in [0, 1] -> base64 8-bit grayscale PNG at its native resolution (a few hundred bytes)."""
+    with registry.timer(STAGE_SECONDS, "heatmap_encode"):
+        buffered = io.BytesIO()
+        Image.fromarray(np.uint8(np.round(255 * np.clip(heatmap, 0, 1)))).save(buffered, format="PNG")
+        return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
 def encode_image_to_base64(image_array):
-    pil_img = Image.fromarray(image_array)
-    buffered = io.BytesIO()
-    pil_img.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
+    png = encode_image_to_png(image_array)
+    with registry.timer(STAGE_SECONDS, "base64_encode"):
+        img_str = base64.b64encode(png).decode("utf-8")
     return img_str
 
 # Label mapping
@@ -75,7 +148,7 @@ idx_to_class = {
     3: "Normal"
 }
 
-# Extended explanations for each class
+# Findings prose for JSON clients that still read `text` (the v1 template in backend/api/findings.py)
 extended_explanations = {
     "CNV (Choroidal Neovascularization)": (
         "The AI highlighted abnormal vascular regions, often associated with excessive blood vessel growth. "
@@ -110,50 +183,139 @@ heatmap_explanation = (
     "\nBlue and green areas contribute the least to the decision, implying normal or less concerning regions."
 )
 
+@app.before_request
+def start_request_metrics():
+    registry.increment("requests_started")
+    g.request_start = time.perf_counter()
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    registry.increment("requests_finished")
+    if request.endpoint in ("predict", "predict_batch", "explain_shap") and "request_start" in g:
+        registry.observe(REQUEST_SECONDS, request.endpoint, time.perf_counter() - g.request_start)
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text exposition of this worker's stage latencies and gauges."""
+    totals = registry.snapshot()
+    # Counts this scrape as well
+    in_flight = totals.get("requests_started", [0])[0] - totals.get("requests_finished", [0])[0]
+    lines = []
+    metrics.render_histogram(lines, STAGE_SECONDS, "stage",
+                             "Time per processing stage (gradcam and forward are per batch).", totals)
+    metrics.render_histogram(lines, REQUEST_SECONDS, "endpoint", "End-to-end request time.", totals)
+    metrics.render_gauge(lines, "oculus_inflight_requests", "Requests being handled.", [({}, in_flight)])
+    metrics.render_gauge(lines, "oculus_batcher_queue_depth", "Images waiting for a micro-batch.", [
+        ({"batcher": "gradcam"}, batcher.qsize() if batcher else 0),
+        ({"batcher": "classify"}, classify_batcher.qsize() if classify_batcher else 0),
+    ])
+    metrics.render_gauge(lines, "oculus_process_resident_memory_bytes", "Resident set size of this worker.",
+                         [({}, metrics.rss_bytes())])
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+@app.route('/health', methods=['GET'])
+def health():
+    if explainer is None or not explainer.ready:
+        return jsonify({"status": "warming_up"}), 503
+    return jsonify({"status": "ready", "model": os.path.basename(model_path), "backend": explainer.name})
+
+def build_result(predicted_class_idx, predictions):
+    """Return the response fields for one classified image.
+
+    Only structured fields: the backend renders the findings text from its
+    versioned templates (backend/api/findings.py). JSON responses add it back
+    with ``findings_text`` for clients that still read ``text``.
+    """
+    return {
+        "category": idx_to_class[predicted_class_idx],
+        "confidence": float(np.max(predictions) * 100),
+        "probabilities": {idx_to_class[k]: float(p) for k, p in enumerate(predictions)},
+    }
+
+def findings_text(result):
+    """The v1 findings prose for a classified result, as JSON ``text`` has always carried it."""
+    return (
+        f"Predicted Condition: {result['category']} (Confidence: {result['confidence']:.2f}%)\n\n"
+        f"Explanation:\n{extended_explanations[result['category']]}\n\n"
+        f"Heatmap Interpretation:\n{heatmap_explanation}"
+    )
+
+def peak_region(heatmap):
+    """Grid region ("upper left" ... "lower right") holding most of the map's weight, or None if it is empty."""
+    regions, _ = summarize_regions(heatmap)
+    return regions[0]["region"] if regions[0]["share"] > 0 else None
+
+def build_analysis(img_array, heatmap, predicted_class_idx, predictions, overlay=True):
+    """Return the response fields and the RGB overlay for one explained image.
+
+    The overlay is None when ``overlay`` is false; the raw map is in the
+    result's ``heatmap`` either way.
+    """
+    result = build_result(predicted_class_idx, predictions)
+    result["region"] = peak_region(heatmap)
+    result["heatmap"] = encode_heatmap(heatmap)
+    if not overlay:
+        return result, None
+    with registry.timer(STAGE_SECONDS, "overlay"):
+        overlayed_img = overlay_heatmap(img_array, heatmap, alpha=0.4)
+    return result, overlayed_img
+
 @app.route('/predict', methods=['POST'])
 def predict():
     logger.debug("Received predict request")
-    data = request.get_json()
-    img_data = data.get('image_data')
-    if not img_data:
+    try:
+        with registry.timer(STAGE_SECONDS, "payload_decode"):
+            img_bytes = read_request_image(request)
+    except ValueError as e:
+        logger.error(f"Malformed image payload: {str(e)}")
+        img_bytes = None
+    if not img_bytes:
         logger.error("No image data received")
         return jsonify({"category": "error", "text": "No image data received", "analyzed_image": None}), 400
 
     try:
-        img_bytes = base64.b64decode(img_data)
-        with open("debug_received.jpg", "wb") as f:
-            f.write(img_bytes)
-
-        img = Image.open(io.BytesIO(img_bytes)).convert('RGB')
-        img = img.resize((224, 224), Image.Resampling.LANCZOS)
-        img_array = np.array(img, dtype=np.float32) / 255.0
-        img_array = np.expand_dims(img_array, axis=0)
+        with registry.timer(STAGE_SECONDS, "image_decode"):
+            img_array = preprocess_image(img_bytes)
 
         logger.debug(f"Image shape: {img_array.shape}, dtype: {img_array.dtype}")
 
-        last_conv_layer_name = find_last_conv_layer(model)
-        heatmap, predicted_class_idx, predictions = grad_cam(model, img_array, last_conv_layer_name)
-        predicted_class_name = idx_to_class[predicted_class_idx]
-        confidence_score = float(np.max(predictions) * 100)
+        if not wants_explanation(request):
+            with registry.timer(STAGE_SECONDS, "batcher"):
+                predicted_class_idx, predictions = classify_batcher.run(img_array)
+            result = build_result(predicted_class_idx, predictions)
+            if capture.should_capture():
+                capture.submit(debug_capture.request_id(request), {
+                    "received" + debug_capture.image_extension(img_bytes): img_bytes,
+                    "result.json": dict(result),
+                })
+            if wants_binary(request):
+                return Response(encode_analysis_frame(result, b""), mimetype=ANALYSIS_CONTENT_TYPE)
+            result["text"] = findings_text(result)
+            result["analyzed_image"] = None
+            return jsonify(result)
 
-        overlayed_img = overlay_heatmap(img_array, heatmap, alpha=0.4)
-        cv2.imwrite("debug_gradcam.png", cv2.cvtColor(overlayed_img, cv2.COLOR_RGB2BGR))
-
-        analyzed_img_base64 = encode_image_to_base64(overlayed_img)
-
-        # ✅ Compose full findings text
-        explanation = extended_explanations[predicted_class_name]
-        full_findings = (
-            f"Predicted Condition: {predicted_class_name} (Confidence: {confidence_score:.2f}%)\n\n"
-            f"Explanation:\n{explanation}\n\n"
-            f"Heatmap Interpretation:\n{heatmap_explanation}"
-        )
-
-        result = {
-            "category": predicted_class_name,
-            "text": full_findings,
-            "analyzed_image": analyzed_img_base64
-        }
+        if request.args.get("classes") == "all":
+            return predict_all_classes(img_bytes, img_array, fused=request.args.get("layers") == "fused")
+
+        # Queue wait plus the batch this image ran in
+        with registry.timer(STAGE_SECONDS, "batcher"):
+            heatmap, predicted_class_idx, predictions = batcher.run(img_array)
+        result, overlayed_img = build_analysis(img_array, heatmap, predicted_class_idx, predictions,
+                                               overlay=wants_overlay(request))
+        if capture.should_capture():
+            # Encoded on the capture thread, not here
+            capture.submit(debug_capture.request_id(request), {
+                "received" + debug_capture.image_extension(img_bytes): img_bytes,
+                "gradcam.png": overlayed_img if overlayed_img is not None else overlay_heatmap(img_array, heatmap),
+                "result.json": dict(result),
+            })
+
+        if wants_binary(request):
+            png = encode_image_to_png(overlayed_img) if overlayed_img is not None else b""
+            return Response(encode_analysis_frame(result, png), mimetype=ANALYSIS_CONTENT_TYPE)
+
+        result["text"] = findings_text(result)
+        result["analyzed_image"] = encode_image_to_base64(overlayed_img) if overlayed_img is not None else None
         return jsonify(result)
 
     except Exception as e:
@@ -164,5 +326,189 @@ def predict():
             "analyzed_image": None
         }), 500
 
+def predict_all_classes(img_bytes, img_array, fused=False):
+    """``/predict?classes=all``: the usual result plus a Grad-CAM overlay for every class."""
+    if not hasattr(explainer, "explain_all_classes"):
+        return jsonify({"category": "error", "text": "All-class heatmaps are not available with this inference backend",
+                        "analyzed_image": None}), 501
+    with registry.timer(STAGE_SECONDS, "gradcam_all_classes"):
+        heatmaps, predictions = explainer.explain_all_classes(to_model_input(img_array[np.newaxis]), fused=fused)
+    predicted_class_idx = int(np.argmax(predictions[0]))
+    result = build_result(predicted_class_idx, predictions[0])
+    result["region"] = peak_region(heatmaps[0][predicted_class_idx])
+    with registry.timer(STAGE_SECONDS, "overlay"):
+        overlays = [overlay_heatmap(img_array, heatmap, alpha=0.4) for heatmap in heatmaps[0]]
+    # In class index order, so the predicted class is entry predicted_class_idx
+    result["class_heatmaps"] = [
+        {"category": idx_to_class[k], "probability": float(predictions[0][k])} for k in range(len(overlays))
+    ]
+    if capture.should_capture():
+        capture.submit(debug_capture.request_id(request), {
+            "received" + debug_capture.image_extension(img_bytes): img_bytes,
+            "gradcam.png": overlays[predicted_class_idx],
+            "result.json": dict(result),
+        })
+
+    if wants_binary(request):
+        pngs = [encode_image_to_png(overlay) for overlay in overlays]
+        for entry, png in zip(result["class_heatmaps"], pngs):
+            entry["image_length"] = len(png)
+        return Response(encode_analysis_frame(result, b"".join(pngs)), mimetype=ANALYSIS_CONTENT_TYPE)
+
+    for entry, overlay in zip(result["class_heatmaps"], overlays):
+        entry["analyzed_image"] = encode_image_to_base64(overlay)
+    result["text"] = findings_text(result)
+    result["analyzed_image"] = result["class_heatmaps"][predicted_class_idx]["analyzed_image"]
+    return jsonify(result)
+
+@app.route('/explain/shap', methods=['POST'])
+def explain_shap():
+    """SHAP attribution of one image for its predicted class (Keras backend only).
+
+    ``?samples=`` and ``?budget_ms=`` bound the estimate; the ``shap`` section
+    reports how many samples it has. Answers like ``/predict``, with the
+    attribution map as the overlay and a SHAP paragraph in ``shap.summary``
+    (JSON ``text`` also ends with it).
+    """
+    if shap_explainer is None:
+        return jsonify({"category": "error", "text": "SHAP is not available with this inference backend",
+                        "analyzed_image": None}), 501
+    try:
+        img_bytes = read_request_image(request)
+    except ValueError as e:
+        logger.error(f"Malformed image payload: {str(e)}")
+        img_bytes = None
+    if not img_bytes:
+        logger.error("No image data received")
+        return jsonify({"category": "error", "text": "No image data received", "analyzed_image": None}), 400
+    try:
+        samples = max(1, min(int(request.args.get("samples", SHAP_SAMPLES)), SHAP_MAX_SAMPLES))
+        budget_ms = float(request.args.get("budget_ms", SHAP_BUDGET_MS))
+    except ValueError:
+        return jsonify({"category": "error", "text": "samples and budget_ms must be numbers", "analyzed_image": None}), 400
+    # float() also accepts "nan" and "inf"
+    if not (math.isfinite(budget_ms) and budget_ms > 0):
+        return jsonify({"category": "error", "text": "budget_ms must be a positive number", "analyzed_image": None}), 400
+    budget = min(budget_ms, SHAP_MAX_BUDGET_MS) / 1000
+
+    start = time.perf_counter()
+    try:
+        with registry.timer(STAGE_SECONDS, "image_decode"):
+            img_array = preprocess_image(img_bytes)
+        predicted_class_idx, predictions = classify_batcher.run(img_array)
+
+        key = image_key(img_bytes)
+        state = shap_cache.get(key)
+        cached = state is not None and state["count"] >= samples and state["target"] == predicted_class_idx
+        if not cached:
+            if not shap_slots.acquire(timeout=max(budget - (time.perf_counter() - start), 0)):
+                return jsonify({"category": "error", "text": "SHAP explainer busy, retry later",
+                                "analyzed_image": None}), 503, {"Retry-After": "1"}
+            try:
+                with registry.timer(STAGE_SECONDS, "shap"):
+                    state = shap_explainer.explain(
+                        to_model_input(img_array), predicted_class_idx, state, samples=samples,
+                        budget_seconds=budget - (time.perf_counter() - start), seed=int(key[:16], 16),
+                    )
+            finally:
+                shap_slots.release()
+            shap_cache.set(key, state)
+
+        attribution = state["sum"] / state["count"]
+        regions, against = summarize_regions(attribution)
+        result = build_result(predicted_class_idx, predictions)
+        summary = summary_text(result["category"], regions, against)
+        result["region"] = regions[0]["region"] if regions[0]["share"] > 0 else None
+        result["shap"] = {
+            "summary": summary,
+            "regions": regions,
+            "against_share": against,
+            "samples": state["count"],
+            "budget_exhausted": state["budget_exhausted"] and not cached,
+            "cached": cached,
+            "base_value": float(shap_explainer.expected_value[predicted_class_idx]),
+            # Expected gradients are complete: attributions sum to f(x) - base value, up to sampling error
+            "completeness_gap": float(attribution.sum() - (predictions[predicted_class_idx]
+                                                            - shap_explainer.expected_value[predicted_class_idx])),
+            "elapsed_ms": (time.perf_counter() - start) * 1000,
+        }
+        with registry.timer(STAGE_SECONDS, "overlay"):
+            overlayed_img = overlay_heatmap(img_array, attribution_heatmap(attribution), alpha=0.4)
+
+        if wants_binary(request):
+            return Response(encode_analysis_frame(result, encode_image_to_png(overlayed_img)),
+                            mimetype=ANALYSIS_CONTENT_TYPE)
+        result["text"] = f"{findings_text(result)}\n\nSHAP Interpretation:\n{summary}"
+        result["analyzed_image"] = encode_image_to_base64(overlayed_img)
+        return jsonify(result)
+
+    except Exception as e:
+        logger.error("SHAP explanation failed", exc_info=True)
+        return jsonify({"category": "error", "text": f"Exception during processing: {str(e)}",
+                        "analyzed_image": None}), 500
+
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    """Explain (or with ``?explain=0`` only classify) N images with batched
+    forward passes; failures are reported per item. ``?overlay=0`` returns
+    the raw heatmaps without overlays."""
+    try:
+        with registry.timer(STAGE_SECONDS, "payload_decode"):
+            images = read_request_images(request)
+    except ValueError as e:
+        logger.error(f"Malformed batch payload: {str(e)}")
+        images = []
+    if not images:
+        return jsonify({"category": "error", "text": "No image data received", "results": []}), 400
+    logger.debug(f"Received predict_batch request with {len(images)} images")
+
+    explain = wants_explanation(request)
+    overlay = wants_overlay(request)
+    results = [None] * len(images)
+    overlays = [None] * len(images)
+    decoded = []
+    for i, img_bytes in enumerate(images):
+        try:
+            with registry.timer(STAGE_SECONDS, "image_decode"):
+                decoded.append((i, preprocess_image(img_bytes)))
+        except Exception as e:
+            results[i] = {"category": "error", "text": f"Could not decode image: {str(e)}"}
+
+    inputs = InputBatch(min(len(decoded), PREDICT_BATCH_CHUNK))
+    for start in range(0, len(decoded), PREDICT_BATCH_CHUNK):
+        chunk = decoded[start:start + PREDICT_BATCH_CHUNK]
+        batch = inputs.fill([img for _, img in chunk])
+        try:
+            if explain:
+                with registry.timer(STAGE_SECONDS, "gradcam"):
+                    heatmaps, predicted_classes, predictions = explainer(batch)
+            else:
+                with registry.timer(STAGE_SECONDS, "forward"):
+                    predicted_classes, predictions = explainer.classify(batch)
+        except Exception as e:
+            logger.error("Batch prediction failed", exc_info=True)
+            for i, _ in chunk:
+                results[i] = {"category": "error", "text": f"Exception during processing: {str(e)}"}
+            continue
+        for j, (i, img_array) in enumerate(chunk):
+            if explain:
+                results[i], overlays[i] = build_analysis(img_array, heatmaps[j], int(predicted_classes[j]), predictions[j],
+                                                         overlay=overlay)
+            else:
+                results[i] = build_result(int(predicted_classes[j]), predictions[j])
+
+    if wants_binary(request):
+        frames = [
+            encode_analysis_frame(result, encode_image_to_png(overlay) if overlay is not None else b"")
+            for result, overlay in zip(results, overlays)
+        ]
+        return Response(b"".join(frames), mimetype=ANALYSIS_CONTENT_TYPE)
+
+    for result, overlay in zip(results, overlays):
+        if result["category"] != "error":
+            result["text"] = findings_text(result)
+        result["analyzed_image"] = encode_image_to_base64(overlay) if overlay is not None else None
+    return jsonify({"results": results})
+
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=5000, debug=True)
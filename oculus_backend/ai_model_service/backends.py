@@ -0,0 +1,243 @@
+"""Inference backends for the model service.
+
+Every backend has the ``GradCamExplainer`` contract: called with a float32
+batch of shape ``(N, 224, 224, 3)`` it returns ``(heatmaps, predicted_classes,
+predictions)``, ``classify()`` returns ``(predicted_classes, predictions)``
+without the gradient pass, and ``warmup()`` sets ``ready``. Backends are picked at
+startup from the model file (``.h5``/``.keras``, ``.tflite``, ``.onnx``) or
+from ``INFERENCE_BACKEND``.
+
+TFLite and ONNX models are exported by ``convert_model.py`` from the same
+predict + Grad-CAM graph the Keras backend runs. The export has a fixed batch
+size of 1: with a dynamic batch the gradient needs ``BroadcastGradientArgs``,
+which neither runtime implements, so those backends run one image per call.
+"""
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from gradcam import GradCamExplainer, find_last_conv_layer
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("keras", "tflite", "onnx")
+QUANTIZATION_MODES = ("float32", "float16", "int8", "int8-full")
+
+
+def backend_for_path(model_path):
+    extension = os.path.splitext(model_path)[1].lower()
+    return {".tflite": "tflite", ".onnx": "onnx"}.get(extension, "keras")
+
+
+def load_model_from_bytes(model_bytes):
+    import h5py
+
+    with h5py.File(io.BytesIO(model_bytes), "r") as h5file:
+        try:
+            return tf.keras.models.load_model(h5file, compile=False)
+        except (TypeError, ValueError):
+            # Keras 3 only takes paths in load_model; its HDF5 loader still accepts open files.
+            from keras.src.legacy.saving import legacy_h5_format
+            return legacy_h5_format.load_model_from_hdf5(h5file, compile=False)
+
+
+class KerasBackend(GradCamExplainer):
+    name = "keras"
+
+
+class _SingleImageBackend:
+    """Runs a batch-1 exported graph once per image in the batch."""
+
+    name = None
+
+    def __init__(self, input_shape=(224, 224, 3)):
+        self.input_shape = tuple(input_shape)
+        self.ready = False
+
+    def _run(self, image):
+        raise NotImplementedError
+
+    def __call__(self, img_batch):
+        img_batch = np.asarray(img_batch, dtype=np.float32)
+        heatmaps, predicted_classes, predictions = [], [], []
+        for image in img_batch:
+            outputs = self._run(image[np.newaxis])
+            # Output names differ between converters; tell them apart by dtype and rank.
+            for output in outputs:
+                if np.issubdtype(output.dtype, np.integer):
+                    predicted_classes.append(output[0])
+                elif output.ndim == 3:
+                    heatmaps.append(output[0])
+                else:
+                    predictions.append(output[0])
+        return np.stack(heatmaps), np.asarray(predicted_classes, dtype=np.int64), np.stack(predictions)
+
+    def classify(self, img_batch):
+        # Exports hold only the explain graph; the heatmap is computed and dropped.
+        _, predicted_classes, predictions = self(img_batch)
+        return predicted_classes, predictions
+
+    def warmup(self, batch_sizes=(1,)):
+        # The graph is fixed at batch size 1, so one pass covers every batch size.
+        start = time.perf_counter()
+        self(np.zeros((1,) + self.input_shape, dtype=np.float32))
+        logger.info(f"{self.name} warm-up pass took {(time.perf_counter() - start) * 1000:.1f} ms")
+        self.ready = True
+
+
+class TFLiteBackend(_SingleImageBackend):
+    name = "tflite"
+
+    def __init__(self, model_source, num_threads=None):
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            Interpreter = tf.lite.Interpreter
+        if isinstance(model_source, (bytes, bytearray)):
+            self.interpreter = Interpreter(model_content=bytes(model_source), num_threads=num_threads)
+        else:
+            self.interpreter = Interpreter(model_path=model_source, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._outputs = [detail["index"] for detail in self.interpreter.get_output_details()]
+        # One interpreter holds one set of tensors; /predict_batch and the batcher call in concurrently.
+        self._lock = threading.Lock()
+        super().__init__(tuple(self._input["shape"][1:]))
+
+    def _run(self, image):
+        with self._lock:
+            self.interpreter.set_tensor(self._input["index"], image)
+            self.interpreter.invoke()
+            return [self.interpreter.get_tensor(index) for index in self._outputs]
+
+
+class OnnxBackend(_SingleImageBackend):
+    name = "onnx"
+
+    def __init__(self, model_source, num_threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError("The onnx backend needs onnxruntime (pip install onnxruntime)") from e
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            bytes(model_source) if isinstance(model_source, bytearray) else model_source,
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        model_input = self.session.get_inputs()[0]
+        self._input_name = model_input.name
+        super().__init__(tuple(model_input.shape[1:]))
+
+    def _run(self, image):
+        return self.session.run(None, {self._input_name: image})
+
+
+def load_backend(name, model_source, num_threads=None):
+    """Build backend ``name`` from a model path or the model file's bytes."""
+    if name == "keras":
+        if isinstance(model_source, (bytes, bytearray)):
+            model = load_model_from_bytes(model_source)
+        else:
+            model = tf.keras.models.load_model(model_source)
+        return KerasBackend(model)
+    if name == "tflite":
+        return TFLiteBackend(model_source, num_threads=num_threads)
+    if name == "onnx":
+        return OnnxBackend(model_source, num_threads=num_threads)
+    raise ValueError(f"Unknown inference backend {name!r}, expected one of {', '.join(BACKENDS)}")
+
+
+@tf.custom_gradient
+def _relu(x):
+    # tf.nn.relu's gradient is ReluGrad, which TFLite and ONNX do not implement.
+    def grad(dy):
+        return dy * tf.cast(x > 0, dy.dtype)
+    return tf.nn.relu(x), grad
+
+
+def _with_exportable_relu(layer):
+    config = layer.get_config()
+    if config.get("activation") == "relu":
+        config["activation"] = _relu
+    return layer.__class__.from_config(config)
+
+
+def export_explainer(model, layer_name=None):
+    """Clone ``model`` with an exportable ReLU gradient and wrap it in a ``GradCamExplainer``."""
+    layer_name = layer_name or find_last_conv_layer(model)
+    clone = tf.keras.models.clone_model(model, clone_function=_with_exportable_relu)
+    clone.set_weights(model.get_weights())
+    return GradCamExplainer(clone, layer_name=layer_name)
+
+
+def convert_to_tflite(model, quantization="float32", representative_images=None):
+    """Export the predict + Grad-CAM graph of ``model`` as a TFLite flatbuffer.
+
+    ``float16`` stores float16 weights, ``int8`` int8 weights with float
+    activations (dynamic range), and ``int8-full`` also quantizes activations,
+    calibrated on ``representative_images``.
+    """
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization {quantization!r}, expected one of {', '.join(QUANTIZATION_MODES)}")
+    explainer = export_explainer(model)
+    explain = tf.function(
+        explainer._grad_cam,
+        input_signature=[tf.TensorSpec(shape=(1,) + explainer.input_shape, dtype=tf.float32, name="img_batch")],
+    )
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([explain.get_concrete_function()])
+    if quantization != "float32":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8-full":
+        if representative_images is None or not len(representative_images):
+            raise ValueError("int8-full quantization needs representative images")
+
+        def representative_dataset():
+            for image in representative_images:
+                yield [np.asarray(image, dtype=np.float32)[np.newaxis]]
+
+        converter.representative_dataset = representative_dataset
+    return converter.convert()
+
+
+def convert_to_onnx(model, quantization="float32", opset=17):
+    """Export the predict + Grad-CAM graph of ``model`` as an ONNX model (needs tf2onnx).
+
+    The ONNX graph is translated from the float32 TFLite export, which reuses
+    its builtin-only gradient ops and is far cheaper than converting the
+    TensorFlow graph directly. ``int8`` applies ONNX Runtime's dynamic
+    (weight-only) quantization on top.
+    """
+    if quantization not in ("float32", "int8"):
+        raise ValueError(f"ONNX export supports float32 and int8 quantization, not {quantization!r}")
+    try:
+        import tf2onnx
+    except ImportError as e:
+        raise RuntimeError("ONNX export needs tf2onnx (pip install tf2onnx onnxruntime)") from e
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tflite_path = os.path.join(tmp_dir, "model.tflite")
+        with open(tflite_path, "wb") as f:
+            f.write(convert_to_tflite(model))
+        model_proto, _ = tf2onnx.convert.from_tflite(tflite_path, opset=opset)
+        if quantization == "float32":
+            return model_proto.SerializeToString()
+
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        float_path = os.path.join(tmp_dir, "model.onnx")
+        quantized_path = os.path.join(tmp_dir, "model.int8.onnx")
+        with open(float_path, "wb") as f:
+            f.write(model_proto.SerializeToString())
+        quantize_dynamic(float_path, quantized_path, weight_type=QuantType.QInt8)
+        with open(quantized_path, "rb") as f:
+            return f.read()
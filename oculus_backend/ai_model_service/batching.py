@@ -0,0 +1,98 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Coalesce concurrent single-item calls into batched calls of ``batch_fn``.
+
+    Callers ``submit()`` one item and get a ``Future``. A single worker thread
+    waits for the first pending item, then keeps collecting until either
+    ``max_batch_size`` items are queued or ``max_wait_ms`` has passed since that
+    first item arrived. ``batch_fn`` receives the list of items and must return
+    a list of per-item results in the same order.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=10.0, name="micro-batcher"):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches_run = 0
+        self.items_run = 0
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, item):
+        if self._stopped.is_set():
+            raise RuntimeError("MicroBatcher has been stopped")
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def run(self, item, timeout=None):
+        """Submit ``item`` and block until its result is ready."""
+        return self.submit(item).result(timeout=timeout)
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def stop(self):
+        self._stopped.set()
+        self._queue.put(None)
+        self._worker.join()
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+
+            live = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not live:
+                continue
+            items = [item for item, _ in live]
+            futures = [future for _, future in live]
+
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"batch_fn returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                logger.error(f"Batch of {len(items)} failed: {str(e)}", exc_info=True)
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            self.batches_run += 1
+            self.items_run += len(items)
+            logger.debug(f"Ran batch of {len(items)} (queue depth {self.qsize()})")
+            for future, result in zip(futures, results):
+                future.set_result(result)
@@ -0,0 +1,42 @@
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+DEFAULT_MODEL_PATH = os.environ.get("MODEL_PATH", "../backend/api/models/retinal_model.h5")
+
+
+def load_benchmark_model(model_path=DEFAULT_MODEL_PATH):
+    """Load the service model, or an untrained ResNet-50 stand-in when it is absent.
+
+    The stand-in has the same input size, depth and class count, so timings
+    are representative even on machines without ``retinal_model.h5``.
+    """
+    if os.path.exists(model_path):
+        print(f"Loading model from {os.path.abspath(model_path)}")
+        return tf.keras.models.load_model(model_path)
+
+    print(f"{model_path} not found, using an untrained ResNet-50 stand-in")
+    base = tf.keras.applications.ResNet50(weights=None, include_top=False, input_shape=(224, 224, 3))
+    x = tf.keras.layers.GlobalAveragePooling2D()(base.output)
+    outputs = tf.keras.layers.Dense(4, activation="softmax")(x)
+    return tf.keras.Model(base.input, outputs)
+
+
+def random_images(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.random((count, 224, 224, 3), dtype=np.float32)
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(np.asarray(samples) * 1000.0, q))
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
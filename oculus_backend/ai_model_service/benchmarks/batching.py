@@ -0,0 +1,81 @@
+"""Latency/throughput of the micro-batched Grad-CAM path against max batch size.
+
+Run from ``ai_model_service/``::
+
+    python -m benchmarks.batching --batch-sizes 1,2,4,8,16 --requests 128
+"""
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from batching import MicroBatcher
+from gradcam import GradCamExplainer
+
+from ._common import DEFAULT_MODEL_PATH, load_benchmark_model, percentile_ms, random_images
+
+
+def run_load(batcher, images, concurrency):
+    latencies = []
+    lock = threading.Lock()
+    next_index = [0]
+
+    def client():
+        while True:
+            with lock:
+                i = next_index[0]
+                next_index[0] += 1
+            if i >= len(images):
+                return
+            start = time.perf_counter()
+            batcher.run(images[i])
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    parser.add_argument("--batch-sizes", default="1,2,4,8,16")
+    parser.add_argument("--max-wait-ms", type=float, default=10.0)
+    parser.add_argument("--requests", type=int, default=128)
+    parser.add_argument("--concurrency", type=int, default=0,
+                        help="Concurrent clients (default: the max batch size under test)")
+    args = parser.parse_args()
+
+    model = load_benchmark_model(args.model)
+    explainer = GradCamExplainer(model)
+    images = random_images(args.requests)
+
+    def batch_fn(items):
+        heatmaps, classes, predictions = explainer(np.stack(items))
+        return list(zip(heatmaps, classes, predictions))
+
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+    # The graphs are traced once for any batch size, but each new batch shape still
+    # pays a first-call cost; run every size under test once before timing.
+    explainer.warmup(batch_sizes)
+
+    print(f"{'max_batch':>9} {'clients':>7} {'avg_batch':>9} {'req/s':>8} {'p50_ms':>9} {'p99_ms':>9}")
+    for max_batch in batch_sizes:
+        concurrency = args.concurrency or max_batch
+        batcher = MicroBatcher(batch_fn, max_batch_size=max_batch, max_wait_ms=args.max_wait_ms)
+        latencies, wall = run_load(batcher, images, concurrency)
+        avg_batch = batcher.items_run / max(batcher.batches_run, 1)
+        batcher.stop()
+        print(f"{max_batch:>9} {concurrency:>7} {avg_batch:>9.2f} {len(latencies) / wall:>8.2f} "
+              f"{percentile_ms(latencies, 50):>9.1f} {percentile_ms(latencies, 99):>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Cost of Grad-CAM for every class against one heatmap per request.
+
+Run from ``ai_model_service/``::
+
+    python -m benchmarks.gradcam_all_classes
+    python -m benchmarks.gradcam_all_classes --batch-sizes 1,8 --iterations 20
+
+Compares the predicted-class heatmap (``/predict``), a separate forward and
+backward pass per class (the naive way to get all classes), the batched
+Jacobian behind ``?classes=all``, and the same with ``layers=fused``.
+"""
+import argparse
+
+import numpy as np
+import tensorflow as tf
+
+from gradcam import GradCamExplainer
+
+from ._common import DEFAULT_MODEL_PATH, Timer, load_benchmark_model, percentile_ms, random_images
+
+
+def per_class_grad_cam(explainer):
+    """One tape per class: what all-class Grad-CAM costs without the batched Jacobian."""
+    @tf.function(input_signature=[tf.TensorSpec(shape=(None,) + explainer.input_shape, dtype=tf.float32),
+                                  tf.TensorSpec(shape=(), dtype=tf.int32)])
+    def explain_class(img_batch, class_idx):
+        with tf.GradientTape() as tape:
+            conv_outputs, predictions = explainer.grad_model(img_batch, training=False)
+            loss = tf.reduce_sum(predictions[:, class_idx])
+        pooled_grads = tf.reduce_mean(tape.gradient(loss, conv_outputs), axis=(1, 2))
+        heatmaps = tf.maximum(tf.einsum('nhwc,nc->nhw', conv_outputs, pooled_grads), 0)
+        return tf.math.divide_no_nan(heatmaps, tf.reduce_max(heatmaps, axis=(1, 2), keepdims=True))
+
+    def explain_all(img_batch):
+        return [explain_class(img_batch, k).numpy() for k in range(explainer.model.output.shape[-1])]
+    return explain_all
+
+
+def measure(fn, images, iterations):
+    fn(images)
+    samples = []
+    for _ in range(iterations):
+        with Timer() as t:
+            fn(images)
+        samples.append(t.elapsed)
+    return percentile_ms(samples, 50)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    parser.add_argument("--batch-sizes", default="1,8")
+    parser.add_argument("--iterations", type=int, default=10)
+    args = parser.parse_args()
+
+    explainer = GradCamExplainer(load_benchmark_model(args.model))
+    per_class = per_class_grad_cam(explainer)
+    print(f"Fusion layers: {', '.join(explainer.fusion_layers)}")
+
+    images = random_images(1)
+    heatmaps, _ = explainer.explain_all_classes(images)
+    single, predicted_classes, _ = explainer(images)
+    drift = np.abs(heatmaps[0, predicted_classes[0]] - single[0]).max()
+    print(f"Max difference from the single-class heatmap at the predicted class: {drift:.2e}")
+
+    variants = {
+        "predicted_class": explainer,
+        "per_class_tapes": per_class,
+        "all_classes": explainer.explain_all_classes,
+        "all_fused": lambda batch: explainer.explain_all_classes(batch, fused=True),
+    }
+    print(f"\n{'batch':>6} " + " ".join(f"{name:>16}" for name in variants) + "   (median ms per batch)")
+    for batch_size in (int(size) for size in args.batch_sizes.split(",")):
+        images = random_images(batch_size)
+        timings = [measure(fn, images, args.iterations) for fn in variants.values()]
+        print(f"{batch_size:>6} " + " ".join(f"{ms:>16.1f}" for ms in timings))
+
+
+if __name__ == "__main__":
+    main()
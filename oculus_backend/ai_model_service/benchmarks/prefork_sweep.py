@@ -0,0 +1,151 @@
+"""Sweep serve.py workers x TF threads on this machine and report the best configuration.
+
+Run from ``ai_model_service/``::
+
+    python -m benchmarks.prefork_sweep --workers 1,2,4 --threads 1,2,4 --requests 64
+
+Each configuration gets its own serve.py process, pinned with ``--pin-cpus``.
+Configurations that would put more TF threads than cores on the machine are
+skipped unless ``--allow-oversubscribe`` is given.
+"""
+import argparse
+import io
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import requests
+from PIL import Image
+
+from ._common import DEFAULT_MODEL_PATH, load_benchmark_model, percentile_ms
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def sample_jpeg(seed=0):
+    rng = np.random.default_rng(seed)
+    buffered = io.BytesIO()
+    Image.fromarray((rng.random((496, 512, 3)) * 255).astype(np.uint8)).save(buffered, format="JPEG")
+    return buffered.getvalue()
+
+
+def start_server(model_path, workers, threads, port, timeout=600):
+    cmd = [
+        sys.executable, "serve.py", "--model", model_path, "--port", str(port), "--host", "127.0.0.1",
+        "--workers", str(workers), "--intra-op-threads", str(threads), "--inter-op-threads", "1",
+        "--pin-cpus", "--log-level", "WARNING",
+    ]
+    proc = subprocess.Popen(cmd, cwd=SERVICE_DIR, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    deadline = time.monotonic() + timeout
+    for line in proc.stdout:
+        if "workers ready" in line:
+            return proc
+        if time.monotonic() > deadline:
+            break
+    proc.terminate()
+    raise RuntimeError(f"serve.py did not become ready ({workers} workers x {threads} threads)")
+
+
+def drive(url, body, total, concurrency):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    remaining = [total]
+
+    def client():
+        session = requests.Session()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            start = time.perf_counter()
+            response = session.post(url, data=body, headers={"Content-Type": "application/octet-stream",
+                                                             "Accept": "application/x-oculus-analysis"})
+            elapsed = time.perf_counter() - start
+            with lock:
+                if response.status_code == 200:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--threads", default="1,2,4")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--clients-per-worker", type=int, default=4)
+    parser.add_argument("--allow-oversubscribe", action="store_true")
+    args = parser.parse_args()
+
+    cores = len(os.sched_getaffinity(0))
+    model_path = os.path.abspath(args.model)
+    tmp_dir = None
+    if not os.path.exists(model_path):
+        tmp_dir = tempfile.TemporaryDirectory()
+        model_path = os.path.join(tmp_dir.name, "standin_model.h5")
+        load_benchmark_model(args.model).save(model_path)
+
+    body = sample_jpeg()
+    results = []
+    print(f"{cores} cores available")
+    print(f"{'workers':>7} {'threads':>7} {'clients':>7} {'req/s':>8} {'p50_ms':>9} {'p99_ms':>9} {'errors':>6}")
+    for workers in [int(w) for w in args.workers.split(",")]:
+        for threads in [int(t) for t in args.threads.split(",")]:
+            if workers * threads > cores and not args.allow_oversubscribe:
+                continue
+            port = free_port()
+            proc = start_server(model_path, workers, threads, port)
+            try:
+                url = f"http://127.0.0.1:{port}/predict"
+                clients = workers * args.clients_per_worker
+                drive(url, body, clients, clients)  # settle connections and kernels
+                latencies, errors, wall = drive(url, body, args.requests, clients)
+            finally:
+                proc.terminate()
+                proc.wait()
+            throughput = len(latencies) / wall
+            results.append((throughput, workers, threads))
+            if latencies:
+                p50, p99 = f"{percentile_ms(latencies, 50):>9.1f}", f"{percentile_ms(latencies, 99):>9.1f}"
+            else:
+                # Every request failed
+                p50 = p99 = f"{'-':>9}"
+            print(f"{workers:>7} {threads:>7} {clients:>7} {throughput:>8.2f} {p50} {p99} {errors:>6}")
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+    if not results:
+        print("No configuration fits on this machine; pass --allow-oversubscribe to run anyway.")
+        return
+    throughput, workers, threads = max(results)
+    if not throughput:
+        print("\nNo request succeeded in any configuration (0 req/s); check the model service logs.")
+        return
+    print(f"\nBest: --workers {workers} --intra-op-threads {threads} --inter-op-threads 1 --pin-cpus "
+          f"({throughput:.2f} req/s)")
+
+
+if __name__ == "__main__":
+    main()
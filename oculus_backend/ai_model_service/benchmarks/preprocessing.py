@@ -0,0 +1,116 @@
+"""Time and parity of preprocessing.py against the previous PIL decode + LANCZOS path.
+
+Run from ``ai_model_service/``::
+
+    python -m benchmarks.preprocessing
+    python -m benchmarks.preprocessing --samples /data/oct_samples --with-model
+
+Synthetic B-scans are encoded as JPEG and PNG at typical OCT export sizes.
+Pixel parity is reported in 0-255 units; ``--with-model`` also runs both
+inputs through the model and reports top-1 agreement.
+"""
+import argparse
+import io
+import os
+
+import numpy as np
+from PIL import Image
+
+from preprocessing import InputBatch, preprocess_image, to_model_input
+
+from ._common import DEFAULT_MODEL_PATH, Timer, percentile_ms
+
+# (width, height): Spectralis/Cirrus B-scan exports up to wide-field and stitched scans
+OCT_SIZES = ((512, 496), (768, 496), (1536, 496), (2048, 1536), (4096, 2048))
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+
+
+def legacy_preprocess(img_bytes):
+    """The model service's previous preprocessing, kept for comparison."""
+    img = Image.open(io.BytesIO(img_bytes)).convert('RGB')
+    img = img.resize((224, 224), Image.Resampling.LANCZOS)
+    return np.array(img, dtype=np.float32) / 255.0
+
+
+def synthetic_scan(width, height, seed=0):
+    """A grayscale B-scan look-alike: bright layered bands under speckle noise."""
+    rng = np.random.default_rng(seed)
+    rows = np.linspace(0, 1, height)[:, None]
+    surface = 0.35 + 0.05 * np.sin(np.linspace(0, 3 * np.pi, width))[None, :]
+    layers = sum(
+        np.exp(-((rows - surface - offset) ** 2) / (2 * 0.004)) * weight
+        for offset, weight in ((0.0, 0.9), (0.06, 0.5), (0.12, 0.7), (0.25, 0.4))
+    )
+    speckle = rng.gamma(2.0, 0.5, size=(height, width))
+    return np.clip(layers * speckle * 160 + rng.normal(8, 4, size=(height, width)), 0, 255).astype(np.uint8)
+
+
+def encode(pixels, image_format):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format=image_format, quality=92)
+    return buffer.getvalue()
+
+
+def sample_sets(samples_dir):
+    if samples_dir:
+        names = sorted(n for n in os.listdir(samples_dir) if n.lower().endswith(IMAGE_EXTENSIONS))
+        images = []
+        for name in names:
+            with open(os.path.join(samples_dir, name), "rb") as f:
+                images.append(f.read())
+        yield f"{len(images)} files from {samples_dir}", images
+        return
+    for width, height in OCT_SIZES:
+        scans = [synthetic_scan(width, height, seed) for seed in range(4)]
+        for image_format in ("JPEG", "PNG"):
+            yield f"{width}x{height} {image_format}", [encode(scan, image_format) for scan in scans]
+
+
+def time_per_image(fn, images, repeats):
+    latencies = []
+    for _ in range(repeats):
+        for img_bytes in images:
+            with Timer() as t:
+                fn(img_bytes)
+            latencies.append(t.elapsed)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", help="Directory of real scans to use instead of synthetic ones")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--with-model", action="store_true", help="Also compare model predictions")
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    args = parser.parse_args()
+
+    model = None
+    if args.with_model:
+        from ._common import load_benchmark_model
+        model = load_benchmark_model(args.model)
+
+    batch = InputBatch(16)
+    # The new path includes normalization, which it defers to batch assembly
+    fast = lambda img_bytes: batch.fill([preprocess_image(img_bytes)])
+
+    header = f"{'images':<22} {'legacy_p50':>10} {'fast_p50':>9} {'speedup':>8} {'mean_diff':>9} {'max_diff':>8}"
+    print(header + (f" {'top1_agree':>10} {'max_prob_diff':>13}" if model else ""))
+    for label, images in sample_sets(args.samples):
+        legacy_ms = percentile_ms(time_per_image(legacy_preprocess, images, args.repeats), 50)
+        fast_ms = percentile_ms(time_per_image(fast, images, args.repeats), 50)
+
+        legacy = np.stack([legacy_preprocess(img_bytes) for img_bytes in images])
+        current = to_model_input(np.stack([preprocess_image(img_bytes) for img_bytes in images]))
+        diff = np.abs(legacy - current) * 255
+        line = (f"{label:<22} {legacy_ms:>10.2f} {fast_ms:>9.2f} {legacy_ms / fast_ms:>7.1f}x "
+                f"{diff.mean():>9.2f} {diff.max():>8.0f}")
+        if model is not None:
+            legacy_predictions = model.predict(legacy, verbose=0)
+            predictions = model.predict(current, verbose=0)
+            agreement = np.mean(legacy_predictions.argmax(1) == predictions.argmax(1)) * 100
+            line += f" {agreement:>9.0f}% {np.abs(legacy_predictions - predictions).max():>13.4f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
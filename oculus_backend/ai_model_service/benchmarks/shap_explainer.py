@@ -0,0 +1,59 @@
+"""Cost and convergence of the expected-gradients SHAP estimator.
+
+Run from ``ai_model_service/``::
+
+    python -m benchmarks.shap_explainer
+    python -m benchmarks.shap_explainer --background shap_background.npz --reference-samples 512
+
+Reports the time per sample at several chunk sizes, then how close an
+estimate with N samples gets to one with ``--reference-samples``: the
+correlation of the attribution maps, and whether the top region of the
+region summary agrees.
+"""
+import argparse
+
+import numpy as np
+
+from shap_explainer import ExpectedGradientsExplainer, fallback_background, load_background, summarize_regions
+
+from ._common import DEFAULT_MODEL_PATH, Timer, load_benchmark_model, random_images
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    parser.add_argument("--background", help="Background .npz (default: black and grey references)")
+    parser.add_argument("--chunk-sizes", default="1,4,8,16")
+    parser.add_argument("--sample-counts", default="8,16,32,64,128")
+    parser.add_argument("--reference-samples", type=int, default=256)
+    args = parser.parse_args()
+
+    model = load_benchmark_model(args.model)
+    background = load_background(args.background) if args.background else fallback_background()
+    image = random_images(1)[0]
+    target = int(np.argmax(model.predict(image[np.newaxis], verbose=0)))
+
+    print(f"{'chunk':>6} {'ms/sample':>10}")
+    for chunk_size in (int(size) for size in args.chunk_sizes.split(",")):
+        shap = ExpectedGradientsExplainer(model, background, chunk_size=chunk_size)
+        shap.warmup()
+        with Timer() as t:
+            shap.explain(image, target, samples=chunk_size * 2)
+        print(f"{chunk_size:>6} {t.elapsed / (chunk_size * 2) * 1000:>10.1f}")
+
+    reference_state = shap.explain(image, target, samples=args.reference_samples, seed=1)
+    reference = reference_state["sum"] / reference_state["count"]
+    reference_top = summarize_regions(reference)[0][0]["region"]
+
+    print(f"\n{'samples':>8} {'seconds':>8} {'corr':>6} {'top_region':>10}")
+    for samples in (int(count) for count in args.sample_counts.split(",")):
+        with Timer() as t:
+            state = shap.explain(image, target, samples=samples, seed=2)
+        attribution = state["sum"] / state["count"]
+        corr = np.corrcoef(attribution.ravel(), reference.ravel())[0, 1]
+        agrees = summarize_regions(attribution)[0][0]["region"] == reference_top
+        print(f"{samples:>8} {t.elapsed:>8.2f} {corr:>6.3f} {'same' if agrees else 'differs':>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Export the Keras model to a TFLite or ONNX inference backend and compare it with Keras.
+
+Run from ``ai_model_service/``::
+
+    python convert_model.py --backend tflite --quantization int8
+    python convert_model.py --backend onnx --samples /data/oct_samples
+
+Writes ``retinal_model.<quantization>.tflite`` (or ``.onnx``) next to the
+model, then runs the Keras model and the export on a sample set and reports
+top-1 agreement, heatmap deviation, single-image latency and memory. Serve
+the export with ``MODEL_PATH=<file> python app.py`` or
+``python serve.py --model <file>``.
+"""
+import argparse
+import gc
+import os
+
+import numpy as np
+
+from backends import KerasBackend, QUANTIZATION_MODES, convert_to_onnx, convert_to_tflite, load_backend
+from benchmarks._common import DEFAULT_MODEL_PATH, Timer, load_benchmark_model, percentile_ms, random_images
+from preprocessing import preprocess_image, to_model_input
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+
+
+def load_sample_images(directory, limit):
+    """Preprocess up to ``limit`` images from ``directory`` the way app.py does."""
+    names = sorted(n for n in os.listdir(directory) if n.lower().endswith(IMAGE_EXTENSIONS))[:limit]
+    images = []
+    for name in names:
+        with open(os.path.join(directory, name), "rb") as f:
+            images.append(preprocess_image(f.read()))
+    return to_model_input(np.stack(images))
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def run_all(backend, images):
+    """Explain every image on its own and return the outputs and per-image latencies."""
+    heatmaps, classes, predictions, latencies = [], [], [], []
+    for image in images:
+        with Timer() as t:
+            heatmap, predicted_class, prediction = backend(image[np.newaxis])
+        latencies.append(t.elapsed)
+        heatmaps.append(heatmap[0])
+        classes.append(predicted_class[0])
+        predictions.append(prediction[0])
+    return np.stack(heatmaps), np.asarray(classes), np.stack(predictions), latencies
+
+
+def measure(build, images):
+    before = rss_mb()
+    backend = build()
+    backend.warmup()
+    outputs = run_all(backend, images)
+    return outputs, rss_mb() - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    parser.add_argument("--backend", choices=("tflite", "onnx"), default="tflite")
+    parser.add_argument("--quantization", choices=QUANTIZATION_MODES, default="float32",
+                        help="int8 = int8 weights with float activations; int8-full also quantizes "
+                             "activations, calibrated on the sample set (tflite only)")
+    parser.add_argument("--output", help="Output path (default: next to --model)")
+    parser.add_argument("--samples", help="Directory of OCT images for calibration and comparison "
+                                          "(default: random images)")
+    parser.add_argument("--sample-count", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=None, help="Runtime threads for the exported backend")
+    args = parser.parse_args()
+
+    if args.samples:
+        images = load_sample_images(args.samples, args.sample_count)
+        print(f"Using {len(images)} sample images from {args.samples}")
+    else:
+        images = random_images(args.sample_count)
+        print(f"Using {len(images)} random images (pass --samples for a meaningful agreement figure)")
+
+    # Measure keras before converting, so conversion garbage does not skew its memory figure.
+    reference = {}
+
+    def build_reference():
+        reference["backend"] = KerasBackend(load_benchmark_model(args.model))
+        return reference["backend"]
+
+    (ref_heatmaps, ref_classes, ref_predictions, ref_latencies), ref_rss = measure(build_reference, images)
+
+    output = args.output or f"{os.path.splitext(args.model)[0]}.{args.quantization}.{args.backend}"
+    print(f"Converting to {args.backend} ({args.quantization})")
+    model = reference["backend"].model
+    if args.backend == "tflite":
+        exported = convert_to_tflite(model, args.quantization, representative_images=images)
+    else:
+        exported = convert_to_onnx(model, args.quantization)
+    with open(output, "wb") as f:
+        f.write(exported)
+    print(f"Wrote {output} ({len(exported) / (1024 * 1024):.1f} MB)")
+    del exported
+    gc.collect()
+
+    (heatmaps, classes, predictions, latencies), rss = measure(
+        lambda: load_backend(args.backend, output, num_threads=args.threads), images)
+
+    agreement = float(np.mean(classes == ref_classes))
+    print(f"\nTop-1 agreement with keras: {agreement * 100:.1f}% ({int(np.sum(classes == ref_classes))}/{len(images)})")
+    print(f"Max |probability| difference: {np.abs(predictions - ref_predictions).max():.5f}")
+    print(f"Mean |heatmap| difference:    {np.abs(heatmaps - ref_heatmaps).mean():.5f}")
+    print(f"\n{'backend':>10} {'p50_ms':>9} {'p99_ms':>9} {'+rss_mb':>8}")
+    # The first call per backend already ran in warm-up, so every sample is steady state.
+    for name, samples, memory in (("keras", ref_latencies, ref_rss), (args.backend, latencies, rss)):
+        print(f"{name:>10} {percentile_ms(samples, 50):>9.1f} {percentile_ms(samples, 99):>9.1f} {memory:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Sampled capture of request inputs and outputs for debugging.
+
+A sampled request's received image, overlay and result are written by a
+background thread to ``<DEBUG_CAPTURE_DIR>/<time>-<request id>/``. Only the
+newest ``DEBUG_CAPTURE_MAX_ENTRIES`` captures are kept. Captures contain
+patient scans, so capture is opt-in: it stays off unless
+``DEBUG_CAPTURE_RATE`` is set above 0, and always off when
+``OCULUS_ENV=production`` (which serve.py sets). Requests never wait on the
+disk: when the writer falls behind, captures are dropped.
+"""
+import json
+import logging
+import os
+import queue
+import random
+import shutil
+import threading
+import time
+import uuid
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TMP_PREFIX = ".tmp-"
+IMAGE_SIGNATURES = ((b"\xff\xd8\xff", ".jpg"), (b"\x89PNG", ".png"), (b"BM", ".bmp"), (b"II*\x00", ".tif"),
+                    (b"MM\x00*", ".tif"))
+
+
+def image_extension(img_bytes):
+    for signature, extension in IMAGE_SIGNATURES:
+        if img_bytes.startswith(signature):
+            return extension
+    return ".bin"
+
+
+class DebugCapture:
+    """Writes sampled captures on a daemon thread into a bounded ring of directories."""
+
+    def __init__(self, directory, sample_rate, max_entries=100, queue_size=32):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_entries = max_entries
+        self.captured = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._entries = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0
+
+    def should_capture(self):
+        return self.enabled and random.random() < self.sample_rate
+
+    def submit(self, request_id, files):
+        """Queue ``files`` (name -> bytes, RGB array or JSON-serializable dict) for writing."""
+        self._start()
+        try:
+            self._queue.put_nowait((request_id, files))
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self):
+        return {"sample_rate": self.sample_rate, "captured": self.captured, "dropped": self.dropped,
+                "pending": self._queue.qsize()}
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="debug-capture", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            request_id, files = self._queue.get()
+            try:
+                self._write(request_id, files)
+                self.captured += 1
+            except Exception:
+                logger.exception(f"Debug capture of {request_id} failed")
+
+    def _write(self, request_id, files):
+        os.makedirs(self.directory, exist_ok=True)
+        if self._entries is None:
+            self._entries = []
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if name.startswith(TMP_PREFIX):
+                    # Left behind by a writer that died mid-capture
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.isdir(path):
+                    self._entries.append(path)
+            # Ring order survives restarts: oldest existing captures go first
+            self._entries.sort(key=os.path.getmtime)
+
+        # Written under a temporary name, so a capture directory is always complete
+        tmp_path = os.path.join(self.directory, f"{TMP_PREFIX}{request_id}-{uuid.uuid4().hex[:8]}")
+        os.makedirs(tmp_path)
+        try:
+            for name, content in files.items():
+                if isinstance(content, np.ndarray):
+                    content = cv2.imencode(".png", cv2.cvtColor(content, cv2.COLOR_RGB2BGR))[1].tobytes()
+                elif isinstance(content, dict):
+                    content = json.dumps(content, indent=2, default=float).encode("utf-8")
+                with open(os.path.join(tmp_path, name), "wb") as f:
+                    f.write(content)
+            final_path = os.path.join(self.directory, f"{time.strftime('%Y%m%dT%H%M%S')}-{request_id}")
+            if os.path.exists(final_path):
+                # The same X-Request-ID again within a second
+                final_path = f"{final_path}-{uuid.uuid4().hex[:8]}"
+            os.replace(tmp_path, final_path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        self._entries.append(final_path)
+
+        while len(self._entries) > self.max_entries:
+            shutil.rmtree(self._entries.pop(0), ignore_errors=True)
+
+
+def request_id(request):
+    """The caller's X-Request-ID when it is a safe directory name, otherwise a fresh one."""
+    supplied = request.headers.get("X-Request-ID", "")
+    if supplied and len(supplied) <= 64 and all(c.isalnum() or c in "-_" for c in supplied):
+        return supplied
+    return uuid.uuid4().hex
+
+
+def from_environment():
+    production = os.environ.get("OCULUS_ENV", "").lower() == "production"
+    return DebugCapture(
+        os.environ.get("DEBUG_CAPTURE_DIR", "debug_captures"),
+        sample_rate=0.0 if production else float(os.environ.get("DEBUG_CAPTURE_RATE", "0")),
+        max_entries=int(os.environ.get("DEBUG_CAPTURE_MAX_ENTRIES", "100")),
+    )
@@ -0,0 +1,146 @@
+import logging
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+logger = logging.getLogger(__name__)
+
+
+def find_last_conv_layer(model):
+    for layer in reversed(model.layers):
+        if isinstance(layer, tf.keras.layers.Conv2D):
+            logger.debug(f"Found last Conv2D layer: {layer.name}")
+            return layer.name
+    raise ValueError("No Conv2D layer found in the model.")
+
+
+def find_fusion_layers(model, count=2):
+    """The last Conv2D layer at each of the last ``count`` feature-map resolutions, deepest first."""
+    layers, sizes = [], set()
+    for layer in reversed(model.layers):
+        if isinstance(layer, tf.keras.layers.Conv2D):
+            size = tuple(layer.output.shape[1:3])
+            if size not in sizes:
+                sizes.add(size)
+                layers.append(layer.name)
+                if len(layers) == count:
+                    break
+    return layers
+
+
+class GradCamExplainer:
+    """Predict + Grad-CAM model built once at load time.
+
+    The grad model (last conv activations + predictions) is constructed once
+    and the explanation is compiled as a ``tf.function`` with a fixed input
+    signature, so every batch size reuses the same graph instead of retracing.
+
+    Each image is explained for its own argmax class. Because inference-mode
+    samples do not interact, the gradient of the summed per-sample scores with
+    respect to the conv activations is exactly the per-sample gradient.
+
+    ``explain_all_classes`` returns a heatmap for every class, optionally
+    fused over ``fusion_layers``. It runs one forward pass and takes the
+    batch Jacobian of the class scores with respect to each layer's
+    activations, so the per-class backward passes are vectorized and only run
+    through the layers above the explained ones.
+    """
+
+    def __init__(self, model, layer_name=None, input_shape=(224, 224, 3), fusion_layers=None):
+        self.model = model
+        self.layer_name = layer_name or find_last_conv_layer(model)
+        self.fusion_layers = tuple(fusion_layers or find_fusion_layers(model))
+        self._all_class_fns = {}
+        self._all_class_lock = threading.Lock()
+        self.input_shape = tuple(input_shape)
+        self.grad_model = tf.keras.models.Model(model.inputs, [model.get_layer(self.layer_name).output, model.output])
+        input_signature = [tf.TensorSpec(shape=(None,) + self.input_shape, dtype=tf.float32)]
+        self._explain = tf.function(self._grad_cam, input_signature=input_signature)
+        self._classify = tf.function(self._forward, input_signature=input_signature)
+        self.ready = False
+
+    def _grad_cam(self, img_batch):
+        with tf.GradientTape() as tape:
+            conv_outputs, predictions = self.grad_model(img_batch, training=False)
+            predicted_classes = tf.argmax(predictions, axis=-1)
+            loss = tf.reduce_sum(tf.gather(predictions, predicted_classes, axis=1, batch_dims=1))
+
+        grads = tape.gradient(loss, conv_outputs)
+        pooled_grads = tf.reduce_mean(grads, axis=(1, 2))
+        heatmaps = tf.einsum('nhwc,nc->nhw', conv_outputs, pooled_grads)
+        heatmaps = tf.maximum(heatmaps, 0)
+        max_vals = tf.reduce_max(heatmaps, axis=(1, 2), keepdims=True)
+        heatmaps = tf.math.divide_no_nan(heatmaps, max_vals)
+        return predictions, predicted_classes, heatmaps
+
+    def _all_class_fn(self, layer_names):
+        with self._all_class_lock:
+            fn = self._all_class_fns.get(layer_names)
+            if fn is None:
+                outputs = [self.model.get_layer(name).output for name in layer_names] + [self.model.output]
+                grad_model = tf.keras.models.Model(self.model.inputs, outputs)
+                input_signature = [tf.TensorSpec(shape=(None,) + self.input_shape, dtype=tf.float32)]
+                fn = self._all_class_fns[layer_names] = tf.function(
+                    lambda img_batch: self._all_class_grad_cam(grad_model, img_batch), input_signature=input_signature)
+            return fn
+
+    @staticmethod
+    def _all_class_grad_cam(grad_model, img_batch):
+        with tf.GradientTape(persistent=True) as tape:
+            *conv_outputs, predictions = grad_model(img_batch, training=False)
+        # Fused maps are averaged at the finest resolution among the layers
+        size = max((conv.shape[1], conv.shape[2]) for conv in conv_outputs)
+        fused = 0.0
+        for activations in conv_outputs:
+            # (N, num_classes, h, w, c): every class's gradient, with the backward passes vectorized
+            jacobian = tape.batch_jacobian(predictions, activations)
+            pooled_grads = tf.reduce_mean(jacobian, axis=(2, 3))
+            heatmaps = tf.maximum(tf.einsum('nhwc,nkc->nhwk', activations, pooled_grads), 0)
+            heatmaps = tf.math.divide_no_nan(heatmaps, tf.reduce_max(heatmaps, axis=(1, 2), keepdims=True))
+            fused += tf.image.resize(heatmaps, size)
+        fused = tf.math.divide_no_nan(fused, tf.reduce_max(fused, axis=(1, 2), keepdims=True))
+        return predictions, tf.transpose(fused, (0, 3, 1, 2))
+
+    def explain_all_classes(self, img_batch, fused=False):
+        """Return ``(heatmaps, predictions)``: ``(N, num_classes, h, w)`` Grad-CAMs, each
+        normalized to [0, 1], and ``(N, num_classes)`` probabilities. ``fused`` averages
+        the maps of ``fusion_layers`` instead of using the last conv layer only."""
+        layer_names = self.fusion_layers if fused else (self.layer_name,)
+        predictions, heatmaps = self._all_class_fn(layer_names)(tf.convert_to_tensor(img_batch, dtype=tf.float32))
+        return heatmaps.numpy(), predictions.numpy()
+
+    def _forward(self, img_batch):
+        predictions = self.model(img_batch, training=False)
+        return predictions, tf.argmax(predictions, axis=-1)
+
+    def __call__(self, img_batch):
+        """Return ``(heatmaps, predicted_classes, predictions)`` as numpy arrays
+        of shape ``(N, h, w)``, ``(N,)`` and ``(N, num_classes)``."""
+        try:
+            predictions, predicted_classes, heatmaps = self._explain(tf.convert_to_tensor(img_batch, dtype=tf.float32))
+            logger.debug(f"Grad-CAM generated successfully for batch of {heatmaps.shape[0]}")
+            return heatmaps.numpy(), predicted_classes.numpy(), predictions.numpy()
+        except Exception as e:
+            logger.error(f"Grad-CAM failed: {str(e)}", exc_info=True)
+            raise
+
+    def classify(self, img_batch):
+        """Forward pass only; return ``(predicted_classes, predictions)``."""
+        predictions, predicted_classes = self._classify(tf.convert_to_tensor(img_batch, dtype=tf.float32))
+        return predicted_classes.numpy(), predictions.numpy()
+
+    def warmup(self, batch_sizes=(1,)):
+        """Trace the graphs and run them once per batch size before serving."""
+        for batch_size in batch_sizes:
+            start = time.perf_counter()
+            zeros = np.zeros((batch_size,) + self.input_shape, dtype=np.float32)
+            self(zeros)
+            self.classify(zeros)
+            logger.info(f"Warm-up pass for batch size {batch_size} took {(time.perf_counter() - start) * 1000:.1f} ms")
+        # All-class requests are explained one image at a time
+        zeros = np.zeros((1,) + self.input_shape, dtype=np.float32)
+        self.explain_all_classes(zeros)
+        self.explain_all_classes(zeros, fused=True)
+        self.ready = True
@@ -0,0 +1,128 @@
+"""Per-stage latency histograms and process gauges in Prometheus text format.
+
+Observations go into a shard owned by the calling thread, so the hot path
+takes no lock. A scrape sums the shards, and folds the shards of finished
+threads into a running total (Werkzeug starts a thread per request). Every
+serve.py worker keeps its own metrics, so a scrape reports the worker that
+happened to answer.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; image decode and overlay sit at the low end, a Grad-CAM batch at the high end
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Shards of finished threads are folded once this many are registered
+_FOLD_AFTER = 64
+
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        resident_pages = int(f.read().split()[1])
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def _merge(into, shard):
+    for key, values in shard.items():
+        total = into.get(key)
+        if total is None:
+            into[key] = list(values)
+        else:
+            for i, value in enumerate(values):
+                total[i] += value
+
+
+class Metrics:
+    """Histograms keyed by ``(family, label value)`` and plain counters, sharded per thread."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def observe(self, family, label, seconds):
+        shard = self._shard()
+        key = (family, label)
+        values = shard.get(key)
+        if values is None:
+            # One count per bucket (the last is +Inf), then the sum
+            values = shard[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+        values[bisect.bisect_left(BUCKETS, seconds)] += 1
+        values[-1] += seconds
+
+    def increment(self, name):
+        shard = self._shard()
+        values = shard.get(name)
+        if values is None:
+            values = shard[name] = [0]
+        values[0] += 1
+
+    @contextmanager
+    def timer(self, family, label):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(family, label, time.perf_counter() - start)
+
+    def snapshot(self):
+        """Totals across threads: ``{(family, label): [bucket counts..., sum], name: [count]}``."""
+        with self._lock:
+            self._fold_finished()
+            totals = {key: list(values) for key, values in self._retired.items()}
+            for _, shard in self._shards:
+                # A live thread may add to its shard meanwhile; that only makes the copy a little stale.
+                _merge(totals, dict(shard))
+        return totals
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                if len(self._shards) >= _FOLD_AFTER:
+                    self._fold_finished()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _fold_finished(self):
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                _merge(self._retired, shard)
+        self._shards = live
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+
+def render_histogram(lines, family, label_name, description, totals):
+    lines.append(f"# HELP {family} {description}")
+    lines.append(f"# TYPE {family} histogram")
+    for (name, label), values in sorted((k, v) for k, v in totals.items() if isinstance(k, tuple)):
+        if name != family:
+            continue
+        cumulative = 0
+        for bound, count in zip((*BUCKETS, "+Inf"), values[:-1]):
+            cumulative += count
+            lines.append(f"{family}_bucket{_labels(**{label_name: label, 'le': bound})} {cumulative}")
+        lines.append(f"{family}_sum{_labels(**{label_name: label})} {values[-1]:.6f}")
+        lines.append(f"{family}_count{_labels(**{label_name: label})} {cumulative}")
+
+
+def render_gauge(lines, name, description, samples):
+    """``samples`` is a list of ``(labels dict, value)``."""
+    lines.append(f"# HELP {name} {description}")
+    lines.append(f"# TYPE {name} gauge")
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(**labels) if labels else ''} {value}")
+
+
+registry = Metrics()
@@ -0,0 +1,94 @@
+"""Decode and resize uploaded scans into model input.
+
+Images stay uint8 RGB (224, 224, 3) until a batch is assembled; ``InputBatch``
+then normalizes the whole batch into a preallocated float32 buffer. JPEGs
+are decoded at the smallest DCT scale (1/2, 1/4 or 1/8) that still covers
+the input size, so a large OCT export never gets decoded at full resolution.
+"""
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+INPUT_SIZE = 224
+
+# Largest reduction first; chosen only when both reduced sides still cover INPUT_SIZE
+REDUCED_JPEG_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+# EXIF orientation is ignored, as it always was with PIL
+IGNORE_ORIENTATION = cv2.IMREAD_IGNORE_ORIENTATION
+
+
+def decode_image(img_bytes, size=INPUT_SIZE):
+    """Decode to an RGB uint8 array, reduced at decode time where the format allows."""
+    with Image.open(io.BytesIO(img_bytes)) as probe:  # reads the header only
+        width, height = probe.size
+        image_format = probe.format
+
+    flags = cv2.IMREAD_COLOR
+    if image_format == "JPEG":
+        for factor, reduced in REDUCED_JPEG_FLAGS:
+            if width // factor >= size and height // factor >= size:
+                flags = reduced
+                break
+
+    img = cv2.imdecode(np.frombuffer(img_bytes, dtype=np.uint8), flags | IGNORE_ORIENTATION)
+    if img is None:
+        # Formats OpenCV cannot read (GIF, some TIFF variants)
+        with Image.open(io.BytesIO(img_bytes)) as pil_img:
+            return np.asarray(pil_img.convert("RGB"))
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def resize_image(img, size=INPUT_SIZE, out=None):
+    """Resize an RGB uint8 array to ``size`` x ``size``, into ``out`` when given."""
+    if img.shape[0] == size and img.shape[1] == size:
+        if out is None:
+            return img
+        out[...] = img
+        return out
+    # Area averaging is the antialiased filter for shrinking; Lanczos when enlarging
+    shrinking = img.shape[0] >= size and img.shape[1] >= size
+    interpolation = cv2.INTER_AREA if shrinking else cv2.INTER_LANCZOS4
+    if out is None:
+        return cv2.resize(img, (size, size), interpolation=interpolation)
+    cv2.resize(img, (size, size), dst=out, interpolation=interpolation)
+    return out
+
+
+def preprocess_image(img_bytes, out=None):
+    """Encoded image bytes -> (224, 224, 3) uint8 RGB model input."""
+    return resize_image(decode_image(img_bytes), out=out)
+
+
+class InputBatch:
+    """A reusable float32 input buffer for up to ``capacity`` images.
+
+    ``fill`` normalizes uint8 images into it with one vectorized multiply and
+    returns a view of the filled rows. The view is overwritten by the next
+    ``fill``, so an ``InputBatch`` belongs to one thread (a batcher worker, or
+    one request).
+    """
+
+    def __init__(self, capacity, size=INPUT_SIZE):
+        self.capacity = capacity
+        self._pixels = np.empty((capacity, size, size, 3), dtype=np.uint8)
+        self._inputs = np.empty((capacity, size, size, 3), dtype=np.float32)
+
+    def fill(self, images):
+        count = len(images)
+        if count > self.capacity:
+            # Rare oversized batch; not worth keeping a bigger buffer around
+            return to_model_input(np.stack(images))
+        for i, img in enumerate(images):
+            self._pixels[i] = img
+        return to_model_input(self._pixels[:count], out=self._inputs[:count])
+
+
+def to_model_input(pixels, out=None):
+    """uint8 RGB pixels (any leading shape) -> float32 in [0, 1]."""
+    return np.multiply(pixels, np.float32(1.0 / 255.0), out=out, dtype=np.float32)
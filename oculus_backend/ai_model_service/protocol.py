@@ -0,0 +1,100 @@
+"""Wire formats accepted and produced by the model service.
+
+Requests may carry the image as
+  * a raw body (``image/*`` or ``application/octet-stream``),
+  * a multipart upload in the ``image`` field, or
+  * the legacy JSON body ``{"image_data": "<base64>"}``.
+
+``/predict_batch`` takes several images as repeated multipart ``images``
+fields or as JSON ``{"images": ["<base64>", ...]}``.
+
+Clients that send ``Accept: application/x-oculus-analysis`` get a binary frame
+back instead of JSON with a base64 overlay::
+
+    [4-byte big-endian header length][UTF-8 JSON header][overlay PNG bytes]
+
+Batch responses are the per-image frames concatenated in request order.
+
+``?explain=0`` on ``/predict`` and ``/predict_batch`` skips Grad-CAM: only the
+forward pass runs and the frames carry no overlay (``image_length`` 0, JSON
+``analyzed_image`` null).
+
+Results are structured: ``category``, ``confidence`` (percent) and the class
+``probabilities``, plus ``region``, the grid region ("upper left" ... "lower
+right") where the explanation map peaks. Binary frame headers carry no
+findings prose; the backend renders it from its versioned templates. JSON
+responses keep the legacy ``text`` (the version-1 findings) until every
+client reads the structured fields. Errors carry ``category`` "error" and a
+``text`` message. Explained results also carry
+``heatmap``: the raw low-resolution Grad-CAM map, quantized to an 8-bit
+grayscale PNG and base64-encoded, from which clients render overlays
+themselves. ``?overlay=0`` then skips the server-side overlay (``image_length``
+0, JSON ``analyzed_image`` null).
+
+``/predict?classes=all`` (Keras backend) adds ``class_heatmaps``, one entry
+per class in index order, with ``layers=fused`` averaging several conv
+layers. In JSON each entry has its own ``analyzed_image``. In a binary frame
+the image is every class overlay back to back, split by each entry's
+``image_length``.
+"""
+import base64
+import json
+import struct
+
+ANALYSIS_CONTENT_TYPE = "application/x-oculus-analysis"
+
+_HEADER_LENGTH = struct.Struct(">I")
+
+
+def read_request_image(request):
+    """Return the uploaded image bytes, or ``None`` if the request has none."""
+    if request.mimetype.startswith("image/") or request.mimetype == "application/octet-stream":
+        return request.get_data() or None
+    if "image" in request.files:
+        return request.files["image"].read() or None
+
+    data = request.get_json(silent=True) or {}
+    img_data = data.get("image_data")
+    if not img_data:
+        return None
+    return base64.b64decode(img_data)
+
+
+def read_request_images(request):
+    """Return the list of uploaded image bytes for a batch request."""
+    files = request.files.getlist("images")
+    if files:
+        return [f.read() for f in files]
+
+    data = request.get_json(silent=True) or {}
+    return [base64.b64decode(img_data) for img_data in data.get("images") or []]
+
+
+def wants_explanation(request):
+    return request.args.get("explain", "1").lower() not in ("0", "false", "no")
+
+
+def wants_overlay(request):
+    return request.args.get("overlay", "1").lower() not in ("0", "false", "no")
+
+
+def wants_binary(request):
+    # JSON is listed first so wildcard and missing Accept headers keep the legacy contract.
+    best = request.accept_mimetypes.best_match(["application/json", ANALYSIS_CONTENT_TYPE])
+    return best == ANALYSIS_CONTENT_TYPE
+
+
+def encode_analysis_frame(header, image_bytes):
+    header = dict(header, image_length=len(image_bytes))
+    header_bytes = json.dumps(header).encode("utf-8")
+    return _HEADER_LENGTH.pack(len(header_bytes)) + header_bytes + image_bytes
+
+
+def decode_analysis_frame(frame, offset=0):
+    """Inverse of ``encode_analysis_frame``; returns ``(header, image_bytes, end_offset)``."""
+    (header_length,) = _HEADER_LENGTH.unpack_from(frame, offset)
+    start = offset + _HEADER_LENGTH.size
+    header = json.loads(frame[start:start + header_length].decode("utf-8"))
+    image_start = start + header_length
+    image_end = image_start + header["image_length"]
+    return header, frame[image_start:image_end], image_end
@@ -0,0 +1,169 @@
+"""Production launcher for the model service: one listening socket, N pre-forked workers.
+
+    python serve.py --workers 4 --intra-op-threads 2 --inter-op-threads 1 --pin-cpus
+
+The parent reads the model file (``retinal_model.h5``, or a ``.tflite`` /
+``.onnx`` export from ``convert_model.py``) into memory once, binds the
+socket and forks the workers, which share those raw bytes copy-on-write.
+TensorFlow's runtime is not fork-safe (its thread pools do not survive
+``fork()``), so the parent never imports TensorFlow. Each worker applies its thread counts
+and CPU affinity first, then builds its inference backend from the shared
+bytes, warms up and starts accepting on the inherited socket.
+
+Only the file bytes are shared. Each worker parses its own copy of the
+model, so the weights, graphs and runtime buffers are per worker: N workers
+hold N copies of the parsed model. Size ``--workers`` by memory as well as
+cores.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+logger = logging.getLogger("serve")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-forking multi-worker model server")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "5000")))
+    parser.add_argument("--model", default=os.environ.get("MODEL_PATH", "../backend/api/models/retinal_model.h5"))
+    parser.add_argument("--backend", choices=("keras", "tflite", "onnx"), default=os.environ.get("INFERENCE_BACKEND"),
+                        help="Inference backend (default: inferred from the model file extension)")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WORKERS", "1")))
+    parser.add_argument("--intra-op-threads", type=int, default=int(os.environ.get("TF_INTRA_OP_THREADS", "0")),
+                        help="TensorFlow intra-op threads per worker (0 = TensorFlow default)")
+    parser.add_argument("--inter-op-threads", type=int, default=int(os.environ.get("TF_INTER_OP_THREADS", "0")),
+                        help="TensorFlow inter-op threads per worker (0 = TensorFlow default)")
+    parser.add_argument("--pin-cpus", action="store_true",
+                        help="Pin each worker to its own slice of CPUs, sized by --intra-op-threads")
+    parser.add_argument("--log-level", default=os.environ.get("LOG_LEVEL", "INFO"))
+    return parser.parse_args(argv)
+
+
+def cpu_slice(worker_index, cpus_per_worker):
+    """CPUs for ``worker_index`` when each worker owns ``cpus_per_worker`` cores."""
+    cpus = sorted(os.sched_getaffinity(0))
+    size = max(1, min(cpus_per_worker, len(cpus)))
+    start = (worker_index * size) % len(cpus)
+    return {cpus[(start + i) % len(cpus)] for i in range(size)}
+
+
+def run_worker(index, args, sock, model_bytes, ready_fd):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    if args.pin_cpus:
+        cpus = cpu_slice(index, args.intra_op_threads or 1)
+        os.sched_setaffinity(0, cpus)
+        logger.info(f"Worker {index} pinned to CPUs {sorted(cpus)}")
+    if args.intra_op_threads:
+        # oneDNN/OpenMP kernels size their pools from this, not from the TF setting.
+        os.environ["OMP_NUM_THREADS"] = str(args.intra_op_threads)
+
+    import tensorflow as tf
+    if args.intra_op_threads:
+        tf.config.threading.set_intra_op_parallelism_threads(args.intra_op_threads)
+    if args.inter_op_threads:
+        tf.config.threading.set_inter_op_parallelism_threads(args.inter_op_threads)
+
+    os.environ["OCULUS_DEFER_MODEL_LOAD"] = "1"
+    import app as service
+    from backends import backend_for_path, load_backend
+    logging.getLogger().setLevel(args.log_level)
+    service.model_path = args.model
+    backend = args.backend or backend_for_path(args.model)
+    service.init_backend(load_backend(backend, model_bytes, num_threads=args.intra_op_threads or None))
+
+    from werkzeug.serving import make_server
+    server = make_server(args.host, args.port, service.app, threaded=True, fd=sock.fileno())
+    if ready_fd is not None:
+        os.write(ready_fd, b"1")
+        os.close(ready_fd)
+    logger.info(f"Worker {index} (pid {os.getpid()}) serving")
+    server.serve_forever()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    os.environ["OCULUS_ENV"] = "production"
+
+    logger.info(f"Reading model from {os.path.abspath(args.model)}")
+    with open(args.model, "rb") as f:
+        model_bytes = f.read()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    ready_r, ready_w = os.pipe()
+    workers = {}
+
+    def spawn(index, ready_fd=None):
+        pid = os.fork()
+        if pid == 0:
+            if ready_fd is not None:
+                os.close(ready_r)
+            code = 0
+            try:
+                run_worker(index, args, sock, model_bytes, ready_fd)
+            except BaseException:
+                logger.exception(f"Worker {index} crashed")
+                code = 1
+            finally:
+                os._exit(code)
+        workers[pid] = index
+
+    stopping = []
+
+    def shutdown(signum, frame):
+        stopping.append(signum)
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for index in range(args.workers):
+        spawn(index, ready_w)
+    os.close(ready_w)
+    # Report ready only once every worker has warmed up.
+    ready = 0
+    while ready < args.workers and not stopping:
+        chunk = os.read(ready_r, args.workers - ready)
+        if not chunk:
+            break
+        ready += len(chunk)
+    os.close(ready_r)
+    if ready == args.workers:
+        print(f"All {args.workers} workers ready on {args.host}:{args.port}", flush=True)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = workers.pop(pid, None)
+        if index is None or stopping:
+            continue
+        logger.warning(f"Worker {index} (pid {pid}) exited with status {status}, restarting")
+        time.sleep(1)
+        spawn(index)
+
+    logger.info("All workers stopped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,406 @@
+"""Model service tests, run from this directory with ``python -m unittest tests``.
+
+The service is imported with ``OCULUS_DEFER_MODEL_LOAD`` set and driven with a
+fake inference backend, so no model file is needed.
+"""
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import cv2
+import numpy as np
+from PIL import Image
+
+os.environ["OCULUS_DEFER_MODEL_LOAD"] = "1"
+import app as service  # noqa: E402
+from batching import MicroBatcher  # noqa: E402
+import debug_capture  # noqa: E402
+import metrics  # noqa: E402
+import preprocessing  # noqa: E402
+from protocol import decode_analysis_frame, encode_analysis_frame  # noqa: E402
+
+
+def encoded(image, image_format):
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def png_bytes(size=(300, 300), mode="RGB", color=(90, 90, 90)):
+    return encoded(Image.new(mode, size, color), "PNG")
+
+
+class FakeBackend:
+    """The ``GradCamExplainer`` contract with fixed outputs: every image is DME at 80%."""
+
+    name = "fake"
+
+    def __init__(self):
+        self.ready = False
+
+    def warmup(self, batch_sizes=(1,)):
+        self.ready = True
+
+    def classify(self, img_batch):
+        predictions = np.tile(np.array([0.1, 0.8, 0.05, 0.05], dtype=np.float32), (len(img_batch), 1))
+        return np.argmax(predictions, axis=1), predictions
+
+    def __call__(self, img_batch):
+        predicted_classes, predictions = self.classify(img_batch)
+        heatmaps = np.zeros((len(img_batch), 7, 7), dtype=np.float32)
+        heatmaps[:, 1, 1] = 1.0
+        return heatmaps, predicted_classes, predictions
+
+
+class MicroBatcherTests(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+        self.release = threading.Event()
+
+    def start(self, batch_fn=None, **kwargs):
+        batcher = MicroBatcher(batch_fn or self.double, **kwargs)
+        self.addCleanup(batcher.stop)
+        return batcher
+
+    def double(self, items):
+        self.batches.append(list(items))
+        # The first batch holds the worker until released, so later submits queue up behind it
+        if len(self.batches) == 1:
+            self.release.wait(5)
+        return [2 * item for item in items]
+
+    def test_concurrent_submits_coalesce_up_to_max_batch_size(self):
+        batcher = self.start(max_batch_size=4, max_wait_ms=50)
+        futures = [batcher.submit(0)]
+        while not self.batches:
+            time.sleep(0.001)
+        futures += [batcher.submit(i) for i in range(1, 11)]
+        self.release.set()
+        self.assertEqual([future.result(timeout=5) for future in futures], [2 * i for i in range(11)])
+        self.assertEqual([len(batch) for batch in self.batches], [1, 4, 4, 2])
+        self.assertEqual((batcher.batches_run, batcher.items_run), (4, 11))
+
+    def test_partial_batch_flushes_after_max_wait(self):
+        self.release.set()
+        batcher = self.start(max_batch_size=8, max_wait_ms=50)
+        start = time.perf_counter()
+        self.assertEqual(batcher.run(21, timeout=5), 42)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.045)
+        self.assertEqual(self.batches, [[21]])
+
+    def test_batch_failure_reaches_every_caller(self):
+        def fail(items):
+            self.batches.append(list(items))
+            if len(self.batches) == 1:
+                self.release.wait(5)
+                return [0] * len(items)
+            raise ZeroDivisionError("model failed")
+
+        batcher = self.start(fail, max_batch_size=4, max_wait_ms=50)
+        first = batcher.submit(0)
+        while not self.batches:
+            time.sleep(0.001)
+        failing = [batcher.submit(i) for i in range(1, 4)]
+        self.release.set()
+        self.assertEqual(first.result(timeout=5), 0)
+        for future in failing:
+            with self.assertRaises(ZeroDivisionError):
+                future.result(timeout=5)
+        self.assertEqual(len(self.batches), 2)
+
+    def test_result_count_mismatch_fails_the_batch(self):
+        batcher = self.start(lambda items: items[:1], max_batch_size=2, max_wait_ms=1000)
+        futures = [batcher.submit(1), batcher.submit(2)]
+        for future in futures:
+            with self.assertRaisesRegex(RuntimeError, "returned 1 results for 2 items"):
+                future.result(timeout=5)
+        # The worker survives and serves the next batch
+        self.assertEqual(batcher.run(3, timeout=5), 3)
+
+
+class DebugCaptureTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def captures(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_capture_is_opt_in_and_off_in_production(self):
+        for env, rate in (({}, 0.0), ({"DEBUG_CAPTURE_RATE": "0.5"}, 0.5),
+                          ({"DEBUG_CAPTURE_RATE": "0.5", "OCULUS_ENV": "production"}, 0.0)):
+            with self.subTest(env=env), mock.patch.dict(os.environ, env, clear=True):
+                capture = debug_capture.from_environment()
+                self.assertEqual(capture.sample_rate, rate)
+                self.assertEqual(capture.enabled, rate > 0)
+        self.assertFalse(debug_capture.DebugCapture(self.directory, 0.0).should_capture())
+
+    def test_requests_are_sampled_at_the_rate(self):
+        capture = debug_capture.DebugCapture(self.directory, 0.25)
+        with mock.patch.object(debug_capture.random, "random", side_effect=[0.1, 0.24, 0.25, 0.9]):
+            self.assertEqual([capture.should_capture() for _ in range(4)], [True, True, False, False])
+
+    def test_submitted_capture_is_written_in_the_background(self):
+        capture = debug_capture.DebugCapture(self.directory, 1.0)
+        capture.submit("req-1", {"received.png": png_bytes((4, 4)), "result.json": {"confidence": 80.0},
+                                 "gradcam.png": np.zeros((4, 4, 3), dtype=np.uint8)})
+        deadline = time.monotonic() + 5
+        while capture.captured == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        (entry,) = self.captures()
+        self.assertTrue(entry.endswith("-req-1"))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.directory, entry))),
+                         ["gradcam.png", "received.png", "result.json"])
+
+    def test_ring_keeps_the_newest_entries(self):
+        stray = os.path.join(self.directory, debug_capture.TMP_PREFIX + "crashed")
+        os.makedirs(stray)
+        capture = debug_capture.DebugCapture(self.directory, 1.0, max_entries=3)
+        for i in range(5):
+            capture._write(f"req-{i}", {"result.json": {"i": i}})
+        self.assertEqual([name.rsplit("-", 1)[1] for name in self.captures()], ["2", "3", "4"])
+        # A restarted service evicts the oldest of the captures already on disk first
+        restarted = debug_capture.DebugCapture(self.directory, 1.0, max_entries=3)
+        restarted._write("req-5", {"result.json": {"i": 5}})
+        self.assertEqual([name.rsplit("-", 1)[1] for name in self.captures()], ["3", "4", "5"])
+
+    def test_colliding_captures_are_both_kept(self):
+        capture = debug_capture.DebugCapture(self.directory, 1.0)
+        with mock.patch.object(debug_capture.time, "strftime", return_value="20260101T000000"):
+            capture._write("same-id", {"result.json": {"n": 1}})
+            capture._write("same-id", {"result.json": {"n": 2}})
+        entries = self.captures()
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0], "20260101T000000-same-id")
+        contents = [open(os.path.join(self.directory, entry, "result.json")).read() for entry in entries]
+        self.assertEqual(sorted(json.loads(content)["n"] for content in contents), [1, 2])
+
+    def test_failed_write_leaves_no_temporary_directory(self):
+        capture = debug_capture.DebugCapture(self.directory, 1.0)
+        with self.assertRaises(TypeError):
+            capture._write("broken", {"result.json": {"ok": True}, "bad.bin": 42})
+        self.assertEqual(self.captures(), [])
+
+
+class PreprocessingTests(unittest.TestCase):
+    def test_large_jpeg_is_decoded_at_a_reduced_scale(self):
+        jpeg = encoded(Image.new("RGB", (2000, 1000), (10, 120, 240)), "JPEG")
+        with mock.patch.object(preprocessing.cv2, "imdecode", wraps=cv2.imdecode) as imdecode:
+            img = preprocessing.decode_image(jpeg)
+        # 1/8 would leave the short side at 125 < 224, so 1/4 is the smallest that still covers the input
+        self.assertEqual(imdecode.call_args.args[1], cv2.IMREAD_REDUCED_COLOR_4 | cv2.IMREAD_IGNORE_ORIENTATION)
+        self.assertEqual(img.shape, (250, 500, 3))
+        np.testing.assert_allclose(img[125, 250], (10, 120, 240), atol=3)
+
+    def test_small_jpeg_is_decoded_at_full_size(self):
+        jpeg = encoded(Image.new("RGB", (300, 230), (10, 120, 240)), "JPEG")
+        self.assertEqual(preprocessing.decode_image(jpeg).shape, (230, 300, 3))
+
+    def test_16_bit_png_keeps_its_high_byte(self):
+        png = encoded(Image.fromarray(np.full((300, 260), 0x80FF, dtype=np.uint16)), "PNG")
+        img = preprocessing.decode_image(png)
+        self.assertEqual((img.shape, img.dtype), ((300, 260, 3), np.uint8))
+        self.assertTrue((img == 0x80).all())
+
+    def test_gif_is_decoded_to_rgb(self):
+        gif = encoded(Image.new("RGB", (300, 200), (200, 30, 30)), "GIF")
+        decoded = [preprocessing.decode_image(gif)]
+        # OpenCV builds without GIF support return None and fall back to PIL
+        with mock.patch.object(preprocessing.cv2, "imdecode", return_value=None):
+            decoded.append(preprocessing.decode_image(gif))
+        for img in decoded:
+            self.assertEqual(img.shape, (200, 300, 3))
+            self.assertEqual(tuple(img[0, 0]), (200, 30, 30))
+
+    def test_undecodable_input_raises(self):
+        truncated_png = encoded(Image.new("RGB", (300, 300)), "PNG")[:60]
+        for data in (b"not an image", truncated_png):
+            with self.subTest(data=data[:12]), self.assertRaises(OSError):
+                preprocessing.preprocess_image(data)
+
+    def test_preprocess_resizes_into_the_given_buffer(self):
+        out = np.empty((224, 224, 3), dtype=np.uint8)
+        img = preprocessing.preprocess_image(encoded(Image.new("L", (600, 400), 90), "PNG"), out=out)
+        self.assertIs(img, out)
+        self.assertTrue((out == 90).all())
+
+    def test_input_batch_normalizes_into_its_buffer(self):
+        batch = preprocessing.InputBatch(2)
+        images = [np.full((224, 224, 3), value, dtype=np.uint8) for value in (0, 255)]
+        inputs = batch.fill(images)
+        self.assertEqual((inputs.shape, inputs.dtype), ((2, 224, 224, 3), np.float32))
+        self.assertEqual((inputs[0].max(), inputs[1].min()), (0.0, 1.0))
+        # More images than the buffer holds still works, without the buffer
+        self.assertEqual(batch.fill(images * 2).shape, (4, 224, 224, 3))
+
+
+class MetricsTests(unittest.TestCase):
+    def test_shards_of_all_threads_are_summed(self):
+        registry = metrics.Metrics()
+
+        def work():
+            registry.observe("stage_seconds", "decode", 0.003)
+            registry.increment("requests")
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        work()
+        totals = registry.snapshot()
+        # The finished threads' shards were folded into the running total
+        self.assertEqual(len(registry._shards), 1)
+        self.assertEqual(totals["requests"], [5])
+        self.assertEqual(sum(totals[("stage_seconds", "decode")][:-1]), 5)
+        self.assertAlmostEqual(totals[("stage_seconds", "decode")][-1], 0.015)
+        self.assertEqual(registry.snapshot(), totals)
+
+    def test_histogram_renders_cumulative_buckets(self):
+        registry = metrics.Metrics()
+        for seconds in (0.003, 0.005, 0.2, 20.0):
+            registry.observe("stage_seconds", "decode", seconds)
+        registry.observe("other_seconds", "decode", 1.0)
+        lines = []
+        metrics.render_histogram(lines, "stage_seconds", "stage", "Time per stage.", registry.snapshot())
+        self.assertEqual(lines[:2], ["# HELP stage_seconds Time per stage.", "# TYPE stage_seconds histogram"])
+        self.assertIn('stage_seconds_bucket{stage="decode",le="0.0025"} 0', lines)
+        # Bucket bounds are inclusive
+        self.assertIn('stage_seconds_bucket{stage="decode",le="0.005"} 2', lines)
+        self.assertIn('stage_seconds_bucket{stage="decode",le="0.25"} 3', lines)
+        self.assertIn('stage_seconds_bucket{stage="decode",le="10.0"} 3', lines)
+        self.assertIn('stage_seconds_bucket{stage="decode",le="+Inf"} 4', lines)
+        self.assertEqual(lines[-2:], ['stage_seconds_sum{stage="decode"} 20.208000',
+                                      'stage_seconds_count{stage="decode"} 4'])
+        self.assertEqual(len(lines), 2 + len(metrics.BUCKETS) + 3)
+
+    def test_gauge_rendering(self):
+        lines = []
+        metrics.render_gauge(lines, "queue_depth", "Waiting images.", [({"batcher": "gradcam"}, 3), ({}, 1)])
+        self.assertEqual(lines, ["# HELP queue_depth Waiting images.", "# TYPE queue_depth gauge",
+                                 'queue_depth{batcher="gradcam"} 3', "queue_depth 1"])
+
+
+class ServiceTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        service.init_backend(FakeBackend())
+
+    @classmethod
+    def tearDownClass(cls):
+        service.batcher.stop()
+        service.classify_batcher.stop()
+
+    def setUp(self):
+        self.client = service.app.test_client()
+
+
+class LegacyJsonTests(ServiceTestCase):
+    """JSON responses keep the v1 ``text`` older backends read; binary frames drop it."""
+
+    def test_json_predict_includes_findings_text(self):
+        for query in ("", "?explain=0"):
+            with self.subTest(query=query):
+                response = self.client.post("/predict" + query, data=png_bytes(), content_type="image/png")
+                self.assertEqual(response.status_code, 200)
+                result = response.get_json()
+                self.assertEqual(result["category"], "DME (Diabetic Macular Edema)")
+                self.assertTrue(result["text"].startswith(
+                    "Predicted Condition: DME (Diabetic Macular Edema) (Confidence: 80.00%)\n\nExplanation:\n"))
+                self.assertIn("Heatmap Interpretation:\n", result["text"])
+                self.assertIn("analyzed_image", result)
+
+    def test_json_batch_includes_findings_text(self):
+        response = self.client.post("/predict_batch", data={
+            "images": [(io.BytesIO(png_bytes()), "a.png"), (io.BytesIO(b"not an image"), "b.png")],
+        })
+        results = response.get_json()["results"]
+        self.assertIn("Predicted Condition: DME", results[0]["text"])
+        self.assertTrue(results[1]["text"].startswith("Could not decode image"))
+
+    def test_binary_frame_header_has_no_text(self):
+        response = self.client.post("/predict", data=png_bytes(), content_type="image/png",
+                                    headers={"Accept": service.ANALYSIS_CONTENT_TYPE})
+        header, _, _ = decode_analysis_frame(response.data)
+        self.assertEqual(header["category"], "DME (Diabetic Macular Edema)")
+        self.assertEqual(header["region"], "upper left")
+        self.assertNotIn("text", header)
+
+
+
+class FrameProtocolTests(ServiceTestCase):
+    def test_single_frame_round_trip(self):
+        overlay = png_bytes((8, 6))
+        header = {"category": "Drusen", "confidence": 91.2, "region": "upper left"}
+        frame = encode_analysis_frame(header, overlay)
+        decoded, image, end = decode_analysis_frame(frame)
+        self.assertEqual(decoded, dict(header, image_length=len(overlay)))
+        self.assertEqual(image, overlay)
+        self.assertEqual(end, len(frame))
+
+    def test_batch_round_trip(self):
+        items = [
+            ({"category": "Drusen", "confidence": 91.2}, png_bytes((8, 6))),
+            ({"category": "error", "text": "Could not decode image"}, b""),
+            ({"category": "Normal", "confidence": 60.0}, png_bytes((5, 5), mode="L", color=7)),
+        ]
+        body = b"".join(encode_analysis_frame(header, image) for header, image in items)
+        offset = 0
+        for header, image in items:
+            decoded, decoded_image, offset = decode_analysis_frame(body, offset)
+            self.assertEqual(decoded, dict(header, image_length=len(image)))
+            self.assertEqual(decoded_image, image)
+        self.assertEqual(offset, len(body))
+
+    def test_predict_batch_answers_in_frames(self):
+        response = self.client.post("/predict_batch", headers={"Accept": service.ANALYSIS_CONTENT_TYPE}, data={
+            "images": [(io.BytesIO(png_bytes()), "a.png"), (io.BytesIO(b"not an image"), "b.png")],
+        })
+        self.assertEqual(response.mimetype, service.ANALYSIS_CONTENT_TYPE)
+        first, overlay, offset = decode_analysis_frame(response.data)
+        second, empty, end = decode_analysis_frame(response.data, offset)
+        self.assertEqual(first["category"], "DME (Diabetic Macular Edema)")
+        self.assertTrue(overlay.startswith(b"\x89PNG"))
+        self.assertEqual(Image.open(io.BytesIO(overlay)).size, (224, 224))
+        self.assertEqual((second["category"], empty, end), ("error", b"", len(response.data)))
+
+
+class MetricsEndpointTests(ServiceTestCase):
+    def test_scrape_reports_stages_and_gauges(self):
+        self.client.post("/predict", data=png_bytes(), content_type="image/png")
+        response = self.client.get("/metrics")
+        self.assertEqual(response.mimetype, "text/plain")
+        text = response.get_data(as_text=True)
+        self.assertRegex(text, r'oculus_stage_seconds_count\{stage="image_decode"\} [1-9]')
+        self.assertRegex(text, r'oculus_request_seconds_count\{endpoint="predict"\} [1-9]')
+        # The scrape counts itself as in flight
+        self.assertIn("oculus_inflight_requests 1\n", text)
+        self.assertIn('oculus_batcher_queue_depth{batcher="gradcam"} 0', text)
+
+
+class ShapRequestTests(ServiceTestCase):
+    def test_budget_must_be_finite_and_positive(self):
+        with mock.patch.object(service, "shap_explainer", mock.Mock()) as explainer:
+            for budget in ("nan", "inf", "-inf", "0", "-5", "soon"):
+                with self.subTest(budget_ms=budget):
+                    response = self.client.post(f"/explain/shap?budget_ms={budget}", data=png_bytes(),
+                                                content_type="image/png")
+                    self.assertEqual(response.status_code, 400)
+                    self.assertEqual(response.get_json()["category"], "error")
+        explainer.explain.assert_not_called()
+
+    def test_malformed_image_payload(self):
+        with mock.patch.object(service, "shap_explainer", mock.Mock()):
+            response = self.client.post("/explain/shap", json={"image_data": "not base64!"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["text"], "No image data received")
+
+
+if __name__ == "__main__":
+    unittest.main()
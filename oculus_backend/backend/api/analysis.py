@@ -0,0 +1,306 @@
+import base64
+import json
+import logging
+import os
+import struct
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from .derivatives import ensure_derivatives
+from .findings import compact_findings
+from .model_client import get_model_client
+from .models import AnalysisResult
+from .result_cache import get_analysis_cache
+
+logger = logging.getLogger(__name__)
+
+# Binary response frame: [4-byte big-endian header length][JSON header][overlay PNG].
+# Batch responses are frames concatenated in request order.
+ANALYSIS_CONTENT_TYPE = "application/x-oculus-analysis"
+ACCEPT_HEADER = f'{ANALYSIS_CONTENT_TYPE}, application/json;q=0.5'
+
+
+def decode_analysis_frame(frame, offset=0):
+    (header_length,) = struct.unpack_from(">I", frame, offset)
+    start = offset + 4
+    header = json.loads(frame[start:start + header_length].decode("utf-8"))
+    overlay_end = start + header_length + header["image_length"]
+    return header, frame[start + header_length:overlay_end], overlay_end
+
+
+def decode_analysis_frames(body):
+    frames = []
+    offset = 0
+    while offset < len(body):
+        header, overlay, offset = decode_analysis_frame(body, offset)
+        frames.append((header, overlay))
+    return frames
+
+
+def explain_on_upload():
+    return getattr(settings, 'ANALYSIS_EXPLAIN_ON_UPLOAD', True)
+
+
+def _request_params(explain):
+    # The raw heatmap is stored and overlays are rendered on request (api/overlays.py)
+    return {'overlay': '0'} if explain else {'explain': '0'}
+
+
+def _ai_result(result, overlay, explain=True):
+    heatmap = base64.b64decode(result['heatmap']) if result.get('heatmap') else None
+    if result.get('category') == 'error' or (explain and not overlay and not heatmap):
+        logger.warning(f"Model service returned no analysis: {result.get('text')}")
+        return {
+            'category': 'error',
+            'text': result.get('text', 'No analyzed image returned'),
+            'overlay': None
+        }
+
+    return {
+        'category': result["category"],
+        'confidence': result.get("confidence"),
+        'text': result.get("text"),
+        'overlay': overlay or None,
+        'heatmap': heatmap,
+        'probabilities': result.get("probabilities"),
+    }
+
+
+def has_explanation(ai_result):
+    """Whether a result carries Grad-CAM, as a raw heatmap or (from older model services) an overlay."""
+    return bool(ai_result.get('heatmap') or ai_result.get('overlay'))
+
+
+def run_ai_analysis(image_path, explain=True):
+    """Send the scan to the model service as raw bytes and return its result.
+
+    The returned dict has ``category``, ``confidence``, ``text``,
+    ``probabilities``, ``heatmap`` (the raw Grad-CAM map as an 8-bit
+    grayscale PNG) and ``overlay``. ``text`` is the error message of a failed
+    analysis; successful results only have it from model services that still
+    send findings prose, since the text is otherwise rendered from
+    ``api/findings.py``. Both images are None when the analysis
+    failed or ``explain`` is false, which skips Grad-CAM on the model
+    service; ``overlay`` is only set by model services that predate raw
+    heatmaps. The legacy base64 JSON response is still understood while
+    model services migrate.
+    """
+    try:
+        # Read into memory so a hedged duplicate can replay the body
+        with open(image_path, "rb") as img_file:
+            img_data = img_file.read()
+        response = get_model_client().post(
+            '/predict',
+            data=img_data,
+            params=_request_params(explain),
+            headers={'Content-Type': 'application/octet-stream', 'Accept': ACCEPT_HEADER},
+        )
+
+        if response.status_code == 200:
+            if response.headers.get('Content-Type', '').startswith(ANALYSIS_CONTENT_TYPE):
+                result, overlay, _ = decode_analysis_frame(response.content)
+            else:
+                result = response.json()
+                overlay = base64.b64decode(result["analyzed_image"]) if result.get("analyzed_image") else None
+            return _ai_result(result, overlay, explain)
+
+        logger.error(f"API failed: {response.status_code}, {response.text}")
+        return {
+            'category': 'error',
+            'text': f'API returned error {response.status_code}: {response.text}',
+            'overlay': None
+        }
+
+    except Exception as e:
+        logger.exception(f"Exception in run_ai_analysis: {str(e)}")
+        return {
+            'category': 'error',
+            'text': f'Exception: {str(e)}',
+            'overlay': None
+        }
+
+
+def run_ai_analysis_batch(image_paths, explain=True):
+    """Analyse several scans with one ``/predict_batch`` call.
+
+    Returns one result dict per path, in order, shaped like ``run_ai_analysis``.
+    """
+    files = []
+    try:
+        for path in image_paths:
+            files.append(('images', (os.path.basename(path), open(path, 'rb'), 'application/octet-stream')))
+        # Batches are too expensive to hedge, and file bodies cannot be replayed
+        client = get_model_client()
+        response = client.post(
+            '/predict_batch',
+            files=files,
+            params=_request_params(explain),
+            headers={'Accept': ACCEPT_HEADER},
+            hedge=False,
+            timeout=(client.timeout[0], settings.AI_MODEL_SERVICE.get('BATCH_READ_TIMEOUT', 300.0)),
+        )
+
+        if response.status_code == 200:
+            if response.headers.get('Content-Type', '').startswith(ANALYSIS_CONTENT_TYPE):
+                frames = decode_analysis_frames(response.content)
+            else:
+                frames = [
+                    (result, base64.b64decode(result["analyzed_image"]) if result.get("analyzed_image") else None)
+                    for result in response.json()["results"]
+                ]
+            if len(frames) != len(image_paths):
+                raise ValueError(f"Expected {len(image_paths)} results, got {len(frames)}")
+            return [_ai_result(result, overlay, explain) for result, overlay in frames]
+
+        logger.error(f"Batch API failed: {response.status_code}, {response.text}")
+        error = f'API returned error {response.status_code}: {response.text}'
+
+    except Exception as e:
+        logger.exception(f"Exception in run_ai_analysis_batch: {str(e)}")
+        error = f'Exception: {str(e)}'
+    finally:
+        for _, (_, f, _) in files:
+            f.close()
+
+    return [{'category': 'error', 'text': error, 'overlay': None} for _ in image_paths]
+
+
+def _attach_analysis_image(analysis_result, oct_image, ai_result, save):
+    if ai_result.get('heatmap'):
+        analysis_result.heatmap = ai_result['heatmap']
+        analysis_result.analysis_image = None
+        if save:
+            analysis_result.save(update_fields=['heatmap', 'analysis_image'])
+    elif ai_result['overlay']:
+        # Written straight from memory into storage, no temp file round trip
+        analysis_result.analysis_image.save(
+            f"processed_{oct_image.id}.png",
+            ContentFile(ai_result['overlay']),
+            save=save
+        )
+        ensure_derivatives(analysis_result.analysis_image, source=ai_result['overlay'])
+    elif ai_result['category'] != 'error':
+        # Classification only; ensure_explanation fills this in on first view
+        analysis_result.analysis_image = None
+        if save:
+            analysis_result.save(update_fields=['analysis_image'])
+    else:
+        # Failed analyses keep showing the original scan
+        analysis_result.analysis_image.name = oct_image.image_file.name
+        if save:
+            analysis_result.save(update_fields=['analysis_image'])
+
+
+def _result_fields(ai_result):
+    findings, findings_version = compact_findings(ai_result['category'], ai_result.get('confidence'), ai_result.get('text'))
+    return {
+        'classification': ai_result['category'],
+        'confidence': ai_result.get('confidence'),
+        'probabilities': ai_result.get('probabilities'),
+        'findings': findings,
+        'findings_version': findings_version,
+    }
+
+
+def needs_explanation(analysis_result):
+    return (analysis_result.classification != 'error' and not analysis_result.heatmap
+            and not analysis_result.analysis_image)
+
+
+def analyze_oct_image(oct_image, store_errors=True, explain=None):
+    """Run (or reuse a cached) AI analysis for ``oct_image`` and store its result.
+
+    Returns ``(analysis_result, ai_result)``. Safe to call again for the same
+    image: the existing ``AnalysisResult`` is updated in place. With
+    ``store_errors=False`` a failed analysis is not persisted and
+    ``analysis_result`` is None, so a retry can still produce the real result.
+    ``explain`` defaults to ``settings.ANALYSIS_EXPLAIN_ON_UPLOAD``; without
+    it only the classification is stored.
+    """
+    if explain is None:
+        explain = explain_on_upload()
+
+    # Re-uploads of an already analysed scan skip the model service entirely
+    cache = get_analysis_cache()
+    cache_key = cache.key_for_image(oct_image.image_file.path)
+    ai_result = cache.get(cache_key)
+
+    if ai_result is None or (explain and not has_explanation(ai_result)):
+        # Call AI model for analysis
+        ai_result = run_ai_analysis(oct_image.image_file.path, explain=explain)
+        if ai_result['category'] != 'error':
+            cache.set(cache_key, ai_result)
+        elif not store_errors:
+            return None, ai_result
+
+    analysis_result, _ = AnalysisResult.objects.update_or_create(
+        oct_image=oct_image,
+        defaults=_result_fields(ai_result),
+    )
+
+    _attach_analysis_image(analysis_result, oct_image, ai_result, save=True)
+    ensure_derivatives(oct_image.image_file)
+    return analysis_result, ai_result
+
+
+def ensure_explanation(analysis_result):
+    """Generate and persist the Grad-CAM heatmap of a classification-only result.
+
+    A no-op for results that already have one (or failed). If the model
+    service cannot explain the scan right now, the result is returned
+    unchanged and the next view tries again.
+    """
+    if not needs_explanation(analysis_result):
+        return analysis_result
+
+    oct_image = analysis_result.oct_image
+    cache = get_analysis_cache()
+    cache_key = cache.key_for_image(oct_image.image_file.path)
+    ai_result = cache.get(cache_key)
+    if ai_result is None or not has_explanation(ai_result):
+        ai_result = run_ai_analysis(oct_image.image_file.path, explain=True)
+        if ai_result['category'] == 'error':
+            logger.warning(f"Could not explain analysis {analysis_result.id}: {ai_result['text']}")
+            return analysis_result
+        cache.set(cache_key, ai_result)
+
+    _attach_analysis_image(analysis_result, oct_image, ai_result, save=False)
+    analysis_result.save(update_fields=['heatmap', 'analysis_image'])
+    return analysis_result
+
+
+def analyze_oct_images(oct_images, explain=None):
+    """Batched ``analyze_oct_image`` for freshly created images.
+
+    Cache misses go to the model service in a single batch request and the
+    ``AnalysisResult`` rows are bulk-created. Returns ``(analysis_result,
+    ai_result)`` pairs in input order.
+    """
+    if explain is None:
+        explain = explain_on_upload()
+
+    cache = get_analysis_cache()
+    keys = [cache.key_for_image(oct_image.image_file.path) for oct_image in oct_images]
+    ai_results = [cache.get(key) for key in keys]
+
+    misses = [
+        i for i, ai_result in enumerate(ai_results)
+        if ai_result is None or (explain and not has_explanation(ai_result))
+    ]
+    if misses:
+        fresh = run_ai_analysis_batch([oct_images[i].image_file.path for i in misses], explain=explain)
+        for i, ai_result in zip(misses, fresh):
+            ai_results[i] = ai_result
+            if ai_result['category'] != 'error':
+                cache.set(keys[i], ai_result)
+
+    analysis_results = []
+    for oct_image, ai_result in zip(oct_images, ai_results):
+        analysis_result = AnalysisResult(oct_image=oct_image, **_result_fields(ai_result))
+        _attach_analysis_image(analysis_result, oct_image, ai_result, save=False)
+        ensure_derivatives(oct_image.image_file)
+        analysis_results.append(analysis_result)
+    AnalysisResult.objects.bulk_create(analysis_results)
+
+    return list(zip(analysis_results, ai_results))
@@ -0,0 +1,183 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import Doctor
+
+# Token claim written by CustomTokenObtainPairSerializer.get_token
+PROFILE_CLAIM = 'profile'
+USER_CLAIM_FIELDS = ('username', 'email', 'first_name', 'last_name', 'is_staff', 'is_superuser')
+DOCTOR_CLAIM_FIELDS = ('id', 'hospital', 'specialty', 'role', 'license_number', 'profile_picture', 'phone_number')
+
+
+def profile_claim(user, doctor):
+    """The ``profile`` claim: enough of ``user`` and ``doctor`` to rebuild both without the database."""
+    claim = {
+        'at': int(time.time()),
+        'user': {field: getattr(user, field) for field in USER_CLAIM_FIELDS},
+        'doctor': None,
+    }
+    if doctor is not None:
+        claim['doctor'] = {field: getattr(doctor, field) for field in DOCTOR_CLAIM_FIELDS}
+        claim['doctor']['profile_picture'] = doctor.profile_picture.name or None
+    return claim
+
+
+def _refuse_writes(instance):
+    """Make a claim-built instance read-only, like ``AnonymousUser``.
+
+    It has no password hash and only the claimed fields, so saving it would
+    overwrite the stored row; load the row from the database to change it.
+    """
+    def refuse(*args, **kwargs):
+        raise NotImplementedError(f"{type(instance).__name__} built from token claims cannot be saved or deleted; "
+                                  f"load it from the database first")
+    instance.save = instance.delete = refuse
+    instance.from_claims = True
+    return instance
+
+
+def _user_from_claim(user_id, claim):
+    user = _refuse_writes(User(id=user_id, is_active=True, **claim['user']))
+    if claim['doctor'] is not None:
+        # Populates the reverse one-to-one cache, so user.doctor needs no query
+        user.doctor = _refuse_writes(Doctor(user=user, **claim['doctor']))
+    return user
+
+
+def _copy_user(user):
+    """Fresh ``User``/``Doctor`` instances per request, so one request cannot mutate another's."""
+    copy = User(**{field.attname: getattr(user, field.attname) for field in User._meta.concrete_fields})
+    doctor = user._state.fields_cache.get('doctor')
+    if doctor is not None:
+        copy.doctor = Doctor(**{field.attname: getattr(doctor, field.attname) for field in Doctor._meta.concrete_fields})
+    if getattr(user, 'from_claims', False):
+        _refuse_writes(copy)
+        if doctor is not None:
+            _refuse_writes(copy.doctor)
+    return copy
+
+
+class ProfileCache:
+    """Process-local TTL cache of resolved users (with their doctor) keyed by user id.
+
+    ``invalidate`` drops the entry and records when, so profile claims minted
+    before that moment are no longer trusted by this process.
+    """
+
+    def __init__(self, ttl=60.0):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._invalidated_at = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return _copy_user(entry[1])
+            self._entries.pop(user_id, None)
+            self.misses += 1
+            return None
+
+    def set(self, user_id, user):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, _copy_user(user))
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._invalidated_at[user_id] = time.time()
+
+    def invalidated_at(self, user_id):
+        with self._lock:
+            return self._invalidated_at.get(user_id, 0)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._invalidated_at.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+def auth_settings():
+    return {'CACHE_TTL': 60.0, 'CLAIMS_MAX_AGE': 300, **getattr(settings, 'AUTH_PROFILE_CACHE', {})}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_profile_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ProfileCache(ttl=auth_settings()['CACHE_TTL'])
+    return _cache
+
+
+class DoctorJWTAuthentication(JWTAuthentication):
+    """JWT authentication that resolves ``request.user`` and ``request.user.doctor`` once per request.
+
+    In order of preference the pair comes from the profile cache, from the
+    token's ``profile`` claim (no query), or from a single joined query.
+    Profile claims are trusted for ``CLAIMS_MAX_AGE`` seconds after the token
+    was issued and not past a profile update seen by this process; the cache
+    keeps a resolved pair for ``CACHE_TTL`` seconds. Both bound how long a
+    profile change made through another process can go unseen. That includes
+    ``is_staff`` and ``is_superuser``: deactivating a user or revoking staff
+    rights takes effect for tokens already issued only after
+    ``CLAIMS_MAX_AGE`` (plus ``CACHE_TTL``) seconds.
+
+    Users and doctors built from the claim refuse ``save()`` and ``delete()``.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = int(validated_token[api_settings.USER_ID_CLAIM])
+        except (KeyError, TypeError, ValueError):
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        cache = get_profile_cache()
+        user = cache.get(user_id)
+        if user is not None:
+            return user
+
+        claim = validated_token.get(PROFILE_CLAIM)
+        if claim and self._claim_is_fresh(user_id, claim):
+            user = _user_from_claim(user_id, claim)
+        else:
+            user = self._load_user(user_id)
+        cache.set(user_id, user)
+        return user
+
+    def _claim_is_fresh(self, user_id, claim):
+        at = claim.get('at', 0)
+        return time.time() - at <= auth_settings()['CLAIMS_MAX_AGE'] and at > get_profile_cache().invalidated_at(user_id)
+
+    def _load_user(self, user_id):
+        try:
+            doctor = Doctor.objects.select_related('user').get(user_id=user_id)
+            user = doctor.user
+            user.doctor = doctor
+        except Doctor.DoesNotExist:
+            try:
+                user = User.objects.get(id=user_id)
+            except User.DoesNotExist:
+                raise AuthenticationFailed("User not found", code="user_not_found")
+        if not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        return user
@@ -0,0 +1,143 @@
+"""Downscaled variants (thumbnail, preview) of uploaded scans and analysis overlays.
+
+A variant of ``oct_images/scan_1.png`` is stored next to it as
+``oct_images/scan_1.thumb.webp``. Variants are written when a scan is
+analysed and when its overlay is saved. Listings never generate them: a
+missing variant falls back to the original's URL until
+``python manage.py backfill_derivatives`` writes it, and variants known to
+exist are remembered per process, so a listing makes no storage calls once
+warm.
+"""
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image
+
+from .timing import timed
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'FORMAT': 'WEBP',                           # or 'JPEG'
+    'QUALITY': 80,
+    'SIZES': {'thumb': 160, 'preview': 640},    # longest side in pixels
+}
+EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+
+def derivative_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'IMAGE_DERIVATIVES', {})}
+
+
+def derivative_name(name, variant):
+    config = derivative_settings()
+    return f"{os.path.splitext(name)[0]}.{variant}.{EXTENSIONS[config['FORMAT']]}"
+
+
+def to_8bit(img):
+    """``img`` as 8-bit ``L`` or ``RGB``. 16- and 32-bit grayscale is scaled down rather than clipped."""
+    if img.mode in ('I;16', 'I;16B', 'I;16L', 'I'):
+        # Divide by 256, as OpenCV does when the model service decodes 16-bit scans
+        return img.convert('I').point(lambda value: value / 256).convert('L')
+    return img.convert('L' if img.mode == 'L' else 'RGB')
+
+
+def _encode(img, size, config):
+    variant = img.copy()
+    variant.thumbnail((size, size), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    variant.save(buffer, format=config['FORMAT'], quality=config['QUALITY'])
+    return buffer.getvalue()
+
+
+def generate_derivatives(field_file, source=None, force=False):
+    """Write every variant of ``field_file``; returns the number written.
+
+    ``source`` is the image's bytes when the caller has them in memory
+    already (a fresh overlay), which saves reading them back from storage.
+    Existing variants are kept unless ``force``.
+    """
+    if not field_file:
+        return 0
+    config = derivative_settings()
+    storage = field_file.storage
+    pending = {
+        variant: size for variant, size in config['SIZES'].items()
+        if force or not storage.exists(derivative_name(field_file.name, variant))
+    }
+    if not pending:
+        return 0
+
+    source_file = io.BytesIO(source) if source is not None else storage.open(field_file.name)
+    with source_file, Image.open(source_file) as img:
+        # JPEG sources decode straight at a reduced scale
+        img.draft(img.mode, (max(pending.values()),) * 2)
+        img = to_8bit(img)
+        for variant, size in pending.items():
+            name = derivative_name(field_file.name, variant)
+            if force and storage.exists(name):
+                storage.delete(name)
+            storage.save(name, ContentFile(_encode(img, size, config)))
+            known_derivatives.add(name)
+    return len(pending)
+
+
+def ensure_derivatives(field_file, source=None):
+    """``generate_derivatives`` for the upload and analysis paths: failures are logged, not raised."""
+    try:
+        with timed('derivatives'):
+            generate_derivatives(field_file, source=source)
+    except Exception:
+        logger.exception(f"Could not generate derivatives of {field_file.name}")
+
+
+class KnownNames:
+    """Bounded, process-local set of derivative names known to be in storage."""
+
+    def __init__(self, max_entries=100_000):
+        self.max_entries = max_entries
+        self._names = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        with self._lock:
+            if name not in self._names:
+                return False
+            self._names.move_to_end(name)
+            return True
+
+    def add(self, name):
+        with self._lock:
+            self._names[name] = None
+            self._names.move_to_end(name)
+            while len(self._names) > self.max_entries:
+                self._names.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._names.clear()
+
+
+known_derivatives = KnownNames()
+
+
+def derivative_url(field_file, variant):
+    """Storage URL of a variant, or of the original while the variant is missing; None when there is no image.
+
+    Only checks storage; never generates the variant, since this runs per row of a listing.
+    """
+    if not field_file:
+        return None
+    storage = field_file.storage
+    name = derivative_name(field_file.name, variant)
+    if name in known_derivatives:
+        return storage.url(name)
+    if storage.exists(name):
+        known_derivatives.add(name)
+        return storage.url(name)
+    return field_file.url
@@ -0,0 +1,189 @@
+"""Streaming export of a doctor's records: CSV, NDJSON, or a ZIP with the images.
+
+Rows come from a single ``.values().iterator()`` query over the records and
+their analysis results, and each format is a generator behind a
+``StreamingHttpResponse``. CSV and NDJSON collect nothing per record, so
+their memory stays flat however long the history is, and bytes flow from the
+first row on, so large exports do not sit silent behind a proxy timeout.
+
+A ZIP holds ``records.csv`` (every row), then ``images/<record_id><ext>`` with
+the uploaded scans and ``overlays/<record_id>.<ext>`` with the Grad-CAM
+overlays: rendered at the ``ANALYSIS_OVERLAYS`` defaults from the stored
+heatmap, or the stored overlay file for older results. The scans are already
+compressed, so they are stored as they are rather than deflated again.
+
+A ZIP is not quite constant in memory: ``zipfile`` keeps a ``ZipInfo`` (a few
+hundred bytes) per member until it writes the central directory at the end,
+and there are up to two members per record. Files missing from storage are
+counted, but only the first ``MAX_MISSING_LISTED`` names go into
+``missing_files.txt``.
+"""
+import csv
+import io
+import json
+import logging
+import os
+import zipfile
+
+from .findings import render_findings
+from .models import OCTImage
+from .overlays import encode_overlay, overlay_options, render_overlay
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'zip': 'application/zip',
+}
+COLUMNS = ('record_id', 'custom_id', 'upload_date', 'image_file', 'analysis_id', 'classification', 'confidence',
+           'probabilities', 'findings', 'analysis_date')
+# Rows per database round trip, and per chunk of CSV/NDJSON handed to the server
+CHUNK_SIZE = 2000
+ROWS_PER_WRITE = 500
+COPY_BUFFER_BYTES = 1024 * 1024
+MAX_MISSING_LISTED = 1000
+
+_RECORD_FIELDS = ('id', 'custom_id', 'upload_date', 'image_file')
+_ANALYSIS_FIELDS = ('id', 'classification', 'confidence', 'probabilities', 'findings', 'findings_version',
+                    'analysis_date')
+
+
+def _records(doctor, *extra):
+    fields = _RECORD_FIELDS + tuple(f'analysis_result__{name}' for name in _ANALYSIS_FIELDS + extra)
+    return (OCTImage.objects.filter(doctor=doctor).order_by('upload_date', 'id')
+            .values(*fields).iterator(chunk_size=CHUNK_SIZE))
+
+
+def export_rows(doctor):
+    """One dict per record, keyed by ``COLUMNS``; analysis columns are None for unanalysed scans."""
+    for record in _records(doctor):
+        version = record['analysis_result__findings_version']
+        findings = record['analysis_result__findings']
+        if version is not None:
+            findings = render_findings(record['analysis_result__classification'],
+                                       record['analysis_result__confidence'], version)
+        analysis_date = record['analysis_result__analysis_date']
+        yield {
+            'record_id': str(record['id']),
+            'custom_id': record['custom_id'],
+            'upload_date': record['upload_date'].isoformat(),
+            'image_file': record['image_file'],
+            'analysis_id': str(record['analysis_result__id']) if record['analysis_result__id'] else None,
+            'classification': record['analysis_result__classification'],
+            'confidence': record['analysis_result__confidence'],
+            'probabilities': record['analysis_result__probabilities'],
+            'findings': findings,
+            'analysis_date': analysis_date.isoformat() if analysis_date else None,
+        }
+
+
+def stream_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow([
+            json.dumps(row[column]) if column == 'probabilities' and row[column] is not None else row[column]
+            for column in COLUMNS
+        ])
+        if count % ROWS_PER_WRITE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_ndjson(rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row))
+        if len(lines) == ROWS_PER_WRITE:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+class _ZipBuffer:
+    """Write-only file object for ``ZipFile``: collects the archive bytes until the generator drains them."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _copy_member(archive, buffer, source, name, date_time):
+    """Copy an open file into the archive, yielding the output as it is produced."""
+    info = zipfile.ZipInfo(name, date_time=date_time)
+    info.compress_type = zipfile.ZIP_STORED
+    with archive.open(info, 'w', force_zip64=True) as member:
+        while chunk := source.read(COPY_BUFFER_BYTES):
+            member.write(chunk)
+            yield buffer.drain()
+
+
+def stream_zip(doctor, storage, include_overlays=True):
+    """Yield the ZIP archive in pieces. ``storage`` is where the scans and overlays live."""
+    buffer = _ZipBuffer()
+    options = overlay_options({})
+    missing = []
+    missing_count = 0
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open('records.csv', 'w', force_zip64=True) as member:
+            for text in stream_csv(export_rows(doctor)):
+                member.write(text.encode('utf-8'))
+                yield buffer.drain()
+
+        for record in _records(doctor, 'heatmap', 'analysis_image'):
+            record_id = str(record['id'])
+            date_time = record['upload_date'].timetuple()[:6]
+            scan_name = record['image_file']
+            try:
+                with storage.open(scan_name) as source:
+                    yield from _copy_member(archive, buffer, source,
+                                            f"images/{record_id}{os.path.splitext(scan_name)[1]}", date_time)
+            except OSError:
+                missing_count += 1
+                if len(missing) < MAX_MISSING_LISTED:
+                    missing.append(scan_name)
+                continue
+            if not include_overlays:
+                continue
+
+            heatmap = record['analysis_result__heatmap']
+            overlay_name = record['analysis_result__analysis_image']
+            try:
+                if heatmap:
+                    image = render_overlay(storage, scan_name, bytes(heatmap), options['alpha'],
+                                           options['colormap'], options['size'])
+                    data, _ = encode_overlay(image, options['image_format'], options['quality'])
+                    yield from _copy_member(archive, buffer, io.BytesIO(data),
+                                            f"overlays/{record_id}.{options['image_format']}", date_time)
+                elif overlay_name and overlay_name != scan_name:
+                    # Failed analyses point analysis_image at the scan itself
+                    with storage.open(overlay_name) as source:
+                        yield from _copy_member(archive, buffer, source,
+                                                f"overlays/{record_id}{os.path.splitext(overlay_name)[1]}", date_time)
+            except OSError:
+                missing_count += 1
+                if len(missing) < MAX_MISSING_LISTED:
+                    missing.append(overlay_name or scan_name)
+
+        if missing_count:
+            logger.warning(f"Export for doctor {doctor.pk} skipped {missing_count} missing files")
+            if missing_count > len(missing):
+                missing.append(f"... and {missing_count - len(missing)} more")
+            archive.writestr('missing_files.txt', '\n'.join(missing) + '\n')
+    yield buffer.drain()
@@ -0,0 +1,115 @@
+"""Findings text rendered from versioned templates instead of stored per result.
+
+Every successful analysis used to store the same ~1 KB of explanation text.
+``AnalysisResult`` now keeps the classification, ``confidence`` and
+``probabilities`` as columns plus the ``findings_version`` of the template its
+text matched; the text is rendered when the result is serialized. Results
+whose text matches no template (errors, edited findings) keep it in
+``findings`` with ``findings_version`` null.
+
+The model service sends only the classification, confidence and
+probabilities; this module holds the only copy of the wording. A released
+template version never changes, since stored rows refer to it (migration 0008
+keeps its own frozen copy of version 1 to backfill against). New wording goes
+into a new version, and ``CURRENT_VERSION`` moves to it.
+"""
+import re
+
+TEMPLATES = {
+    # The model service's wording as of the move to templates
+    1: {
+        'explanations': {
+            "CNV (Choroidal Neovascularization)": (
+                "The AI highlighted abnormal vascular regions, often associated with excessive blood vessel growth. "
+                "These regions may indicate leakage or neovascularization, commonly seen in wet AMD. "
+                "The heatmap shows the AI's focus on irregular patterns in the retina, which aligns with CNV "
+                "characteristics."
+                "\n\nNext Step: Confirm with Fluorescein Angiography or OCT Angiography to assess neovascularization."
+            ),
+            "DME (Diabetic Macular Edema)": (
+                "The AI detected fluid accumulation in the macula, emphasizing regions with potential swelling. "
+                "The highlighted areas suggest changes in retinal thickness, which are key indicators of macular "
+                "edema. "
+                "The intensity of the heatmap in the central macular zone supports this diagnosis."
+                "\n\nNext Step: Confirm with Fundus Photography or Additional OCT scans to evaluate macular thickness."
+            ),
+            "Drusen": (
+                "The AI focused on bright, distinct deposits beneath the retina, which are characteristic of Drusen. "
+                "These deposits, often found near the macula, can contribute to vision impairment if they grow "
+                "larger. "
+                "The heatmap highlights these abnormal deposits, reinforcing the likelihood of this condition."
+                "\n\nNext Step: Regular OCT scans are advised to monitor Drusen size and density."
+            ),
+            "Normal": (
+                "The AI did not find significant abnormalities in the retinal structure, leading to a normal "
+                "classification. "
+                "The absence of heatmap intensity in critical regions suggests no concerning signs of disease. "
+                "A well-defined and evenly structured retina supports this assessment."
+                "\n\nNext Step: Routine eye exams are still recommended for continued eye health."
+            ),
+        },
+        'heatmap': (
+            "\nRed areas indicate the most critical regions influencing the AI's decision, suggesting high "
+            "abnormality. "
+            "\nOrange and yellow areas represent moderate attention, possibly indicating early signs of disease. "
+            "\nBlue and green areas contribute the least to the decision, implying normal or less concerning regions."
+        ),
+    },
+}
+CURRENT_VERSION = 1
+
+HEADLINE = re.compile(r"Predicted Condition: (?P<classification>.+?) \(Confidence: (?P<confidence>\d+(?:\.\d+)?)%\)")
+
+
+def render_findings(classification, confidence, version=CURRENT_VERSION):
+    template = TEMPLATES[version]
+    return (
+        f"Predicted Condition: {classification} (Confidence: {confidence:.2f}%)\n\n"
+        f"Explanation:\n{template['explanations'][classification]}\n\n"
+        f"Heatmap Interpretation:\n{template['heatmap']}"
+    )
+
+
+def template_version(classification, confidence, text):
+    """The newest template version that renders exactly ``text``, or None."""
+    if confidence is None:
+        return None
+    for version in sorted(TEMPLATES, reverse=True):
+        if (classification in TEMPLATES[version]['explanations']
+                and render_findings(classification, confidence, version) == text):
+            return version
+    return None
+
+
+def compact_findings(classification, confidence, text=None):
+    """``(findings, findings_version)`` to store: no text when a template reproduces it.
+
+    Model services send only the structured fields, so ``text`` is None and
+    the current template applies; text from older services is matched.
+    """
+    if text is None:
+        if confidence is not None and classification in TEMPLATES[CURRENT_VERSION]['explanations']:
+            return '', CURRENT_VERSION
+        return '', None
+    version = template_version(classification, confidence, text)
+    return ('', version) if version is not None else (text, None)
+
+
+def parse_findings(text):
+    """``(classification, confidence, findings_version)`` recovered from stored text.
+
+    The first two are None when the text has no "Predicted Condition" line;
+    the version is None unless a template reproduces the text exactly.
+    """
+    match = HEADLINE.match(text or '')
+    if match is None:
+        return None, None, None
+    classification, confidence = match['classification'], float(match['confidence'])
+    return classification, confidence, template_version(classification, confidence, text)
+
+
+def findings_text(analysis_result):
+    if analysis_result.findings_version is None:
+        return analysis_result.findings
+    return render_findings(analysis_result.classification, analysis_result.confidence,
+                           analysis_result.findings_version)
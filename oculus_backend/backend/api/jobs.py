@@ -0,0 +1,175 @@
+"""DB-backed queue for asynchronous OCT analysis.
+
+Jobs live in the ``AnalysisJob`` table, so no external broker is needed.
+Workers claim a job with a conditional UPDATE, which is atomic on every
+database Django supports. A claimed job stays invisible to other workers for
+``VISIBILITY_TIMEOUT`` seconds; if its worker dies, the job becomes claimable
+again once that timeout has passed. While the analysis runs, a heartbeat
+thread pushes the timeout forward every third of it, so a slow analysis is
+not claimed and run a second time by another worker.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .analysis import analyze_oct_image
+from .models import AnalysisJob, AnalysisResult
+
+logger = logging.getLogger(__name__)
+
+
+def job_settings():
+    config = {
+        'ASYNC': True,
+        'MAX_ATTEMPTS': 3,
+        'VISIBILITY_TIMEOUT': 120,
+        'RETRY_BACKOFF': 5,
+        'POLL_INTERVAL': 0.5,
+    }
+    config.update(getattr(settings, 'ANALYSIS_JOBS', {}))
+    return config
+
+
+def enqueue_analysis(oct_image):
+    return AnalysisJob.objects.create(oct_image=oct_image, max_attempts=job_settings()['MAX_ATTEMPTS'])
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_next_job(worker_id, visibility_timeout=None):
+    """Atomically claim the oldest available job, or return None."""
+    if visibility_timeout is None:
+        visibility_timeout = job_settings()['VISIBILITY_TIMEOUT']
+
+    claimable = Q(status=AnalysisJob.STATUS_QUEUED) | Q(status=AnalysisJob.STATUS_RUNNING)
+    while True:
+        now = timezone.now()
+        candidate = (
+            AnalysisJob.objects.filter(claimable, available_at__lte=now)
+            .order_by('available_at')
+            .values_list('id', flat=True)
+            .first()
+        )
+        if candidate is None:
+            return None
+
+        claimed = AnalysisJob.objects.filter(claimable, id=candidate, available_at__lte=now).update(
+            status=AnalysisJob.STATUS_RUNNING,
+            attempts=F('attempts') + 1,
+            available_at=now + timedelta(seconds=visibility_timeout),
+            locked_by=worker_id,
+            updated_at=now,
+        )
+        if claimed:
+            return AnalysisJob.objects.select_related('oct_image').get(id=candidate)
+        # Another worker won the race for this job; try the next one.
+
+
+def extend_lease(job, visibility_timeout=None):
+    """Keep a running job hidden for another visibility timeout; False once another worker holds it."""
+    if visibility_timeout is None:
+        visibility_timeout = job_settings()['VISIBILITY_TIMEOUT']
+    now = timezone.now()
+    return bool(AnalysisJob.objects.filter(
+        id=job.id, locked_by=job.locked_by, status=AnalysisJob.STATUS_RUNNING,
+    ).update(available_at=now + timedelta(seconds=visibility_timeout), updated_at=now))
+
+
+@contextmanager
+def lease_heartbeat(job, visibility_timeout=None):
+    """Extend the job's lease from a background thread for as long as the block runs."""
+    if visibility_timeout is None:
+        visibility_timeout = job_settings()['VISIBILITY_TIMEOUT']
+    stopped = threading.Event()
+
+    def beat():
+        try:
+            while not stopped.wait(visibility_timeout / 3):
+                if not extend_lease(job, visibility_timeout):
+                    logger.warning(f"Analysis job {job.id} was taken over by another worker")
+                    return
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f'analysis-job-heartbeat-{job.id}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def _finish(job, **fields):
+    fields['updated_at'] = timezone.now()
+    # Only the current lock holder may settle the job.
+    return AnalysisJob.objects.filter(id=job.id, locked_by=job.locked_by).update(**fields)
+
+
+def _fail(job, error):
+    # Persist the failure so the records UI stops waiting for a result.
+    AnalysisResult.objects.update_or_create(
+        oct_image=job.oct_image,
+        defaults={'classification': 'error', 'findings': error, 'findings_version': None, 'confidence': None,
+                  'probabilities': None},
+    )
+    _finish(job, status=AnalysisJob.STATUS_FAILED, error=error)
+    logger.error(f"Analysis job {job.id} failed permanently: {error}")
+
+
+def run_job(job):
+    if job.attempts > job.max_attempts:
+        _fail(job, job.error or 'Worker lost the job too many times (visibility timeout exceeded)')
+        return
+
+    final_attempt = job.attempts >= job.max_attempts
+    try:
+        with lease_heartbeat(job):
+            _, ai_result = analyze_oct_image(job.oct_image, store_errors=final_attempt)
+    except Exception as e:
+        logger.error(f"Analysis job {job.id} raised", exc_info=True)
+        error = f'Exception: {str(e)}'
+    else:
+        if ai_result['category'] != 'error':
+            _finish(job, status=AnalysisJob.STATUS_DONE, error='')
+            return
+        error = ai_result['text']
+
+    if not final_attempt:
+        backoff = job_settings()['RETRY_BACKOFF'] * 2 ** (job.attempts - 1)
+        _finish(
+            job,
+            status=AnalysisJob.STATUS_QUEUED,
+            available_at=timezone.now() + timedelta(seconds=backoff),
+            error=error,
+        )
+        logger.warning(f"Analysis job {job.id} failed (attempt {job.attempts}), retrying in {backoff}s: {error}")
+    else:
+        _fail(job, error)
+
+
+def work(worker_id=None, stop_event=None, poll_interval=None):
+    """Claim and run jobs until ``stop_event`` is set."""
+    worker_id = worker_id or default_worker_id()
+    if poll_interval is None:
+        poll_interval = job_settings()['POLL_INTERVAL']
+
+    while stop_event is None or not stop_event.is_set():
+        close_old_connections()
+        job = claim_next_job(worker_id)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        logger.info(f"{worker_id} running analysis job {job.id} (attempt {job.attempts})")
+        run_job(job)
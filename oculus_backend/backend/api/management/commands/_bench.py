@@ -0,0 +1,58 @@
+"""Shared helpers for the ``bench_*`` management commands.
+
+Benchmarks run against a throwaway test database, never the configured one.
+"""
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+@contextmanager
+def test_database():
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def run(fn, iterations, warmup=10):
+    """Call ``fn`` ``iterations`` times and return per-call latencies (seconds) and queries per call."""
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    queries = 0
+
+    def count(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    # Counted with a wrapper rather than connection.queries, which keeps only the last 9000
+    with connection.execute_wrapper(count):
+        for _ in range(iterations):
+            start = time.perf_counter()
+            fn()
+            latencies.append(time.perf_counter() - start)
+    return latencies, queries / iterations
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def report(stdout, rows, unit='us'):
+    """Print ``(name, latencies, queries_per_call)`` rows as a table."""
+    scale = {'us': 1e6, 'ms': 1e3}[unit]
+    stdout.write(f"{'':<24} {'queries':>8} {'mean_' + unit:>10} {'p50_' + unit:>10} {'p99_' + unit:>10}")
+    for name, latencies, queries in rows:
+        stdout.write(
+            f"{name:<24} {queries:>8.1f} {statistics.mean(latencies) * scale:>10.1f} "
+            f"{percentile(latencies, 50) * scale:>10.1f} {percentile(latencies, 99) * scale:>10.1f}"
+        )
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from api.derivatives import derivative_name, derivative_settings, generate_derivatives
+from api.models import AnalysisResult, OCTImage
+
+
+class Command(BaseCommand):
+    help = "Generate the thumbnail and preview variants of existing OCT images and analysis overlays."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Regenerate variants that already exist")
+
+    def handle(self, *args, **options):
+        sizes = {variant: 0 for variant in derivative_settings()['SIZES']}
+        sizes['original'] = 0
+        written = failed = 0
+        files = [
+            *(o.image_file for o in OCTImage.objects.only('image_file').iterator()),
+            *(a.analysis_image for a in AnalysisResult.objects.exclude(analysis_image='').exclude(
+                analysis_image__isnull=True).only('analysis_image').iterator()),
+        ]
+        for field_file in files:
+            try:
+                written += generate_derivatives(field_file, force=options['force'])
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"{field_file.name}: {e}")
+                continue
+            storage = field_file.storage
+            sizes['original'] += storage.size(field_file.name)
+            for variant in sizes.keys() - {'original'}:
+                sizes[variant] += storage.size(derivative_name(field_file.name, variant))
+
+        self.stdout.write(f"{len(files)} images, {written} variants written, {failed} failed")
+        # What a listing that shows every image downloads, per variant
+        original = sizes.pop('original')
+        self.stdout.write(f"{'original':>10}: {original / (1024 * 1024):8.1f} MB")
+        for variant, total in sizes.items():
+            ratio = original / total if total else 0
+            self.stdout.write(f"{variant:>10}: {total / (1024 * 1024):8.1f} MB ({ratio:.1f}x smaller)")
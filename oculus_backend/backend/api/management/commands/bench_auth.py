@@ -0,0 +1,55 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.authentication import DoctorJWTAuthentication, get_profile_cache
+from api.models import Doctor
+from api.serializers import CustomTokenObtainPairSerializer
+
+from ._bench import report, run, test_database
+
+
+class Command(BaseCommand):
+    help = "Measure the latency of resolving request.user and request.user.doctor from a JWT."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        with test_database():
+            self.bench(options['iterations'])
+
+    def bench(self, iterations):
+        user = User.objects.create_user('bench', password='bench', first_name='Bench', last_name='Mark')
+        Doctor.objects.create(user=user, hospital='General', specialty='Retina')
+        factory = APIRequestFactory()
+        plain = factory.get('/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        with_claims = factory.get(
+            '/', HTTP_AUTHORIZATION=f'Bearer {CustomTokenObtainPairSerializer.get_token(user).access_token}'
+        )
+        cache = get_profile_cache()
+
+        def resolve(authentication, request, clear_cache=False):
+            def call():
+                if clear_cache:
+                    cache.clear()
+                authenticated_user, _ = authentication.authenticate(request)
+                authenticated_user.doctor
+            return call
+
+        def previous():
+            # What the views did before: simplejwt's user lookup, then Doctor.objects.get per view
+            authenticated_user, _ = JWTAuthentication().authenticate(plain)
+            Doctor.objects.get(user=authenticated_user)
+
+        authentication = DoctorJWTAuthentication()
+        rows = [
+            ('jwt + Doctor.get', *run(previous, iterations)),
+            ('database (no claims)', *run(resolve(authentication, plain, clear_cache=True), iterations)),
+            ('token claims', *run(resolve(authentication, with_claims, clear_cache=True), iterations)),
+            ('profile cache', *run(resolve(authentication, plain), iterations)),
+        ]
+        self.stdout.write(f"Resolving user and doctor, {iterations} requests per path (SQLite test database)")
+        report(self.stdout, rows)
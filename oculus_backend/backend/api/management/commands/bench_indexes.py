@@ -0,0 +1,96 @@
+import random
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.models import AnalysisResult, Doctor, OCTImage, Review
+
+from ._bench import report, run, test_database
+
+CLASSES = ('CNV', 'DME', 'Drusen', 'Normal')
+BATCH_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = ("Seed a test database with OCT records, then EXPLAIN and time the listing queries "
+            "without and with the indexes declared in api/models.py.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help="OCT images (each with an analysis result)")
+        parser.add_argument('--doctors', type=int, default=100)
+        parser.add_argument('--reviews-per-result', type=int, default=20,
+                            help="Reviews on each of the first rows / 200 analysis results")
+        parser.add_argument('--iterations', type=int, default=50)
+
+    def handle(self, *args, **options):
+        with test_database():
+            self.seed(options['rows'], options['doctors'], options['reviews_per_result'])
+            queries = self.queries()
+            indexes = [(model, index) for model in (OCTImage, AnalysisResult, Review) for index in model._meta.indexes]
+
+            with connection.schema_editor() as editor:
+                for model, index in indexes:
+                    editor.remove_index(model, index)
+            self.measure("without indexes", queries, options['iterations'])
+
+            with connection.schema_editor() as editor:
+                for model, index in indexes:
+                    editor.add_index(model, index)
+            self.measure("with indexes", queries, options['iterations'])
+
+    def seed(self, rows, doctors, reviews_per_result):
+        self.stdout.write(f"Seeding {rows} OCT images and analysis results for {doctors} doctors")
+        rng = random.Random(0)
+        self.doctors = [
+            Doctor.objects.create(user=User.objects.create_user(f'doctor{i}')) for i in range(doctors)
+        ]
+        reviewed = []
+        for start in range(0, rows, BATCH_SIZE):
+            oct_images = [
+                OCTImage(doctor=rng.choice(self.doctors), image_file=f'oct_images/scan_{i}.png', custom_id=f'P{i}')
+                for i in range(start, min(start + BATCH_SIZE, rows))
+            ]
+            OCTImage.objects.bulk_create(oct_images)
+            analysis_results = AnalysisResult.objects.bulk_create([
+                AnalysisResult(oct_image=oct_image, classification=rng.choice(CLASSES), findings='')
+                for oct_image in oct_images
+            ])
+            if len(reviewed) < rows // 200:
+                reviewed.extend(analysis_results[:rows // 200 - len(reviewed)])
+        Review.objects.bulk_create([
+            Review(analysis_result=analysis_result, doctor=rng.choice(self.doctors), rating=rng.randint(1, 5), comments='')
+            for analysis_result in reviewed
+            for _ in range(reviews_per_result)
+        ], batch_size=BATCH_SIZE)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def queries(self):
+        # The querysets the paginated listings run for one page (page_size 50, plus one to detect "next")
+        doctor = self.doctors[0]
+        images = OCTImage.objects.filter(doctor=doctor).order_by('-upload_date')
+        deep_cursor = images.values_list('upload_date', flat=True)[images.count() // 2]
+        results = AnalysisResult.objects.filter(oct_image__doctor=doctor).order_by('-analysis_date')
+        reviewed = Review.objects.values_list('analysis_result', flat=True).first()
+        reviews = Review.objects.filter(analysis_result=reviewed)
+        return [
+            ('oct images', images[:51]),
+            ('oct images, deep page', images.filter(upload_date__lt=deep_cursor)[:51]),
+            ('analysis results', results[:51]),
+            ('analysis results search', results.filter(classification__icontains='drusen')[:51]),
+            ('reviews of a result', reviews.order_by('-review_date')[:51]),
+            ('reviews by rating', reviews.order_by('-rating')[:51]),
+            ('all reviews', Review.objects.order_by('-review_date')[:51]),
+        ]
+
+    def measure(self, label, queries, iterations):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.stdout.write(f"\n== {label} ==")
+        rows = []
+        for name, queryset in queries:
+            self.stdout.write(f"{name}:\n    " + queryset.explain().replace('\n', '\n    '))
+            rows.append((name, *run(lambda: list(queryset.all()), iterations, warmup=3)))
+        self.stdout.write("")
+        report(self.stdout, rows, unit='ms')
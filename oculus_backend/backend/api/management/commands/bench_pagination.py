@@ -0,0 +1,69 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+
+from api.models import AnalysisResult, Doctor, OCTImage
+from api.serializers import OCTImageSerializer
+
+from ._bench import report, run, test_database
+
+REPORTED_PAGES = (1, 10, 100, 1000)
+
+
+class Command(BaseCommand):
+    help = "Walk the paginated record listings page by page and report response time by depth."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=1000)
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--iterations', type=int, default=20, help="Requests timed per reported page")
+
+    def handle(self, *args, **options):
+        with test_database():
+            self.bench(options['pages'], options['page_size'], options['iterations'])
+
+    def bench(self, pages, page_size, iterations):
+        rows = pages * page_size
+        user = User.objects.create_user('bench')
+        doctor = Doctor.objects.create(user=user)
+        self.stdout.write(f"Creating {rows} records")
+        oct_images = OCTImage.objects.bulk_create(
+            [OCTImage(doctor=doctor, image_file=f'oct_images/scan_{i}.png', custom_id=f'P{i}') for i in range(rows)],
+            batch_size=1000,
+        )
+        AnalysisResult.objects.bulk_create(
+            [AnalysisResult(oct_image=o, classification='Normal', findings='') for o in oct_images],
+            batch_size=1000,
+        )
+
+        client = APIClient()
+        client.force_authenticate(user)
+        reported = [page for page in REPORTED_PAGES if page <= pages]
+        for listing in ('oct-images', 'analysis-results'):
+            # Cursors are opaque, so reaching page N means following N - 1 next links
+            urls = {}
+            url, page = f'/api/{listing}/?page_size={page_size}', 1
+            while url and page <= reported[-1]:
+                if page in reported:
+                    urls[page] = url
+                url = client.get(url).json()['next']
+                page += 1
+
+            results = []
+            for page in reported:
+                results.append((f'cursor page {page}', *run(lambda: client.get(urls[page]), iterations, warmup=2)))
+            self.stdout.write(f"\nGET /api/{listing}/ ({page_size} rows per page, {rows} rows)")
+            report(self.stdout, results, unit='ms')
+
+        # The same depths with OFFSET, which is what page-number pagination would run
+        queryset = OCTImage.objects.filter(doctor__user=user).order_by('-upload_date')
+        results = []
+        for page in reported:
+            offset = (page - 1) * page_size
+            results.append((
+                f'offset page {page}',
+                *run(lambda: OCTImageSerializer(queryset[offset:offset + page_size], many=True).data,
+                     iterations, warmup=2),
+            ))
+        self.stdout.write("\nOFFSET/LIMIT on oct images, for comparison (query + serialization)")
+        report(self.stdout, results, unit='ms')
@@ -0,0 +1,62 @@
+import multiprocessing
+import os
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api import jobs
+
+
+def _worker_main(index, stop_event, poll_interval):
+    # Let the parent handle Ctrl+C; workers stop through stop_event.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_id = f"{jobs.default_worker_id()}/{index}"
+    jobs.work(worker_id=worker_id, stop_event=stop_event, poll_interval=poll_interval)
+
+
+class Command(BaseCommand):
+    help = "Run a pool of worker processes that process queued OCT analysis jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help="Seconds to sleep when the queue is empty (default: ANALYSIS_JOBS['POLL_INTERVAL']).")
+
+    def handle(self, *args, **options):
+        stop_event = multiprocessing.Event()
+        processes = {}
+
+        def spawn(index):
+            # Forked children must not share the parent's DB connections.
+            connections.close_all()
+            process = multiprocessing.Process(
+                target=_worker_main,
+                args=(index, stop_event, options['poll_interval']),
+                name=f"analysis-worker-{index}",
+                daemon=True,
+            )
+            process.start()
+            processes[index] = process
+
+        def shutdown(signum, frame):
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        for index in range(options['workers']):
+            spawn(index)
+        self.stdout.write(f"Started {options['workers']} analysis workers")
+
+        while not stop_event.is_set():
+            for index, process in list(processes.items()):
+                if not process.is_alive():
+                    self.stderr.write(f"Worker {index} exited with {process.exitcode}, restarting")
+                    spawn(index)
+            time.sleep(1)
+
+        for process in processes.values():
+            process.join(timeout=30)
+        self.stdout.write("Analysis workers stopped")
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_analysisjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='octimage',
+            index=models.Index(fields=['doctor', '-upload_date', 'id'], name='api_octimag_doctor__e38fb3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['analysis_result', '-review_date'], name='api_review_analysi_5a7665_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['analysis_result', '-rating'], name='api_review_analysi_aa1ffb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['-review_date'], name='api_review_review__308da5_idx'),
+        ),
+    ]
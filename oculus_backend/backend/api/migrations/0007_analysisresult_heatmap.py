@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 09:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_record_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisresult',
+            name='heatmap',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analysisresult',
+            name='probabilities',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,126 @@
+# Generated by Django 5.1.7 on 2026-10-18 09:15
+
+import re
+
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+# Version 1 of api/findings.py, frozen here so later template changes cannot
+# alter what this migration matches or restores.
+EXPLANATIONS_V1 = {
+    "CNV (Choroidal Neovascularization)": (
+        "The AI highlighted abnormal vascular regions, often associated with excessive blood vessel growth. "
+        "These regions may indicate leakage or neovascularization, commonly seen in wet AMD. "
+        "The heatmap shows the AI's focus on irregular patterns in the retina, which aligns with CNV "
+        "characteristics."
+        "\n\nNext Step: Confirm with Fluorescein Angiography or OCT Angiography to assess neovascularization."
+    ),
+    "DME (Diabetic Macular Edema)": (
+        "The AI detected fluid accumulation in the macula, emphasizing regions with potential swelling. "
+        "The highlighted areas suggest changes in retinal thickness, which are key indicators of macular "
+        "edema. "
+        "The intensity of the heatmap in the central macular zone supports this diagnosis."
+        "\n\nNext Step: Confirm with Fundus Photography or Additional OCT scans to evaluate macular thickness."
+    ),
+    "Drusen": (
+        "The AI focused on bright, distinct deposits beneath the retina, which are characteristic of Drusen. "
+        "These deposits, often found near the macula, can contribute to vision impairment if they grow "
+        "larger. "
+        "The heatmap highlights these abnormal deposits, reinforcing the likelihood of this condition."
+        "\n\nNext Step: Regular OCT scans are advised to monitor Drusen size and density."
+    ),
+    "Normal": (
+        "The AI did not find significant abnormalities in the retinal structure, leading to a normal "
+        "classification. "
+        "The absence of heatmap intensity in critical regions suggests no concerning signs of disease. "
+        "A well-defined and evenly structured retina supports this assessment."
+        "\n\nNext Step: Routine eye exams are still recommended for continued eye health."
+    ),
+}
+HEATMAP_V1 = (
+    "\nRed areas indicate the most critical regions influencing the AI's decision, suggesting high "
+    "abnormality. "
+    "\nOrange and yellow areas represent moderate attention, possibly indicating early signs of disease. "
+    "\nBlue and green areas contribute the least to the decision, implying normal or less concerning regions."
+)
+HEADLINE = re.compile(r"Predicted Condition: (?P<classification>.+?) \(Confidence: (?P<confidence>\d+(?:\.\d+)?)%\)")
+
+
+def render_v1(classification, confidence):
+    return (
+        f"Predicted Condition: {classification} (Confidence: {confidence:.2f}%)\n\n"
+        f"Explanation:\n{EXPLANATIONS_V1[classification]}\n\n"
+        f"Heatmap Interpretation:\n{HEATMAP_V1}"
+    )
+
+
+def parse_findings(text):
+    """``(classification, confidence, findings_version)`` as of version 1."""
+    match = HEADLINE.match(text or '')
+    if match is None:
+        return None, None, None
+    classification, confidence = match['classification'], float(match['confidence'])
+    templated = classification in EXPLANATIONS_V1 and render_v1(classification, confidence) == text
+    return classification, confidence, 1 if templated else None
+
+
+def backfill_structured_findings(apps, schema_editor):
+    """Parse the classification and confidence out of stored findings; drop text a template reproduces."""
+    AnalysisResult = apps.get_model('api', 'AnalysisResult')
+    rows = AnalysisResult.objects.filter(findings_version__isnull=True).exclude(classification='error').only(
+        'id', 'classification', 'findings', 'confidence', 'findings_version')
+    batch = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        classification, confidence, version = parse_findings(row.findings)
+        if classification != row.classification:
+            continue
+        row.confidence = confidence
+        if version is not None:
+            row.findings, row.findings_version = '', version
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            AnalysisResult.objects.bulk_update(batch, ['confidence', 'findings', 'findings_version'])
+            batch = []
+    AnalysisResult.objects.bulk_update(batch, ['confidence', 'findings', 'findings_version'])
+
+
+def restore_findings_text(apps, schema_editor):
+    AnalysisResult = apps.get_model('api', 'AnalysisResult')
+    # Only version 1 exists at this migration; later versions come with later migrations, reversed first
+    rows = AnalysisResult.objects.filter(findings_version=1).only(
+        'id', 'classification', 'findings', 'confidence', 'findings_version')
+    batch = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        row.findings, row.findings_version = render_v1(row.classification, row.confidence), None
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            AnalysisResult.objects.bulk_update(batch, ['findings', 'findings_version'])
+            batch = []
+    AnalysisResult.objects.bulk_update(batch, ['findings', 'findings_version'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_analysisresult_heatmap'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisresult',
+            name='confidence',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analysisresult',
+            name='findings_version',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='analysisresult',
+            name='findings',
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(backfill_structured_findings, restore_findings_text),
+    ]
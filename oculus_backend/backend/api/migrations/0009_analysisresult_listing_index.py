@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-18 09:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_structured_findings'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='analysisresult',
+            index=models.Index(fields=['-analysis_date', '-id'], name='api_analysi_analysi_6d1deb_idx'),
+        ),
+    ]
@@ -0,0 +1,293 @@
+"""Client for the Flask model service tier.
+
+Requests go through one pooled keep-alive ``requests.Session`` and are spread
+over the configured replicas by least outstanding requests. Replicas are
+ejected after repeated failures or a failing ``/health`` probe and come back
+once they pass it again. Slow requests are hedged to a second replica, and a
+circuit breaker makes callers fail fast while the whole tier is down instead
+of tying up Django workers on timeouts.
+"""
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .timing import timed
+
+logger = logging.getLogger(__name__)
+
+# Upstream statuses that mean "this replica cannot serve right now", as
+# opposed to an error about the request itself.
+REPLICA_FAILURE_STATUSES = {502, 503, 504}
+
+
+class ModelServiceUnavailable(Exception):
+    pass
+
+
+class ReplicaError(Exception):
+    pass
+
+
+class Replica:
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    def available(self, now):
+        return self.healthy and now >= self.ejected_until
+
+    def __repr__(self):
+        return f"Replica({self.url}, outstanding={self.outstanding}, healthy={self.healthy})"
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                # Let exactly one trial request through.
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("Model service circuit breaker opened")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+
+class ModelServiceClient:
+    def __init__(self, urls, connect_timeout=2.0, read_timeout=60.0, pool_size=10,
+                 health_check_interval=5.0, eject_after_failures=3, eject_seconds=30.0,
+                 hedge_after=5.0, max_hedges=1, breaker_failure_threshold=5, breaker_reset_timeout=30.0):
+        if not urls:
+            raise ValueError("At least one model service URL is required")
+        self.replicas = [Replica(url) for url in urls]
+        self.timeout = (connect_timeout, read_timeout)
+        self.health_check_interval = health_check_interval
+        self.eject_after_failures = eject_after_failures
+        self.eject_seconds = eject_seconds
+        self.hedge_after = hedge_after
+        self.max_hedges = max_hedges
+        self.breaker = CircuitBreaker(breaker_failure_threshold, breaker_reset_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.replicas), pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=pool_size * (1 + max_hedges), thread_name_prefix='model-client')
+        self._stopped = threading.Event()
+        if health_check_interval:
+            threading.Thread(target=self._health_loop, name='model-client-health', daemon=True).start()
+
+    def post(self, path, **kwargs):
+        with timed('model'):
+            return self.request('POST', path, **kwargs)
+
+    def request(self, method, path, hedge=True, **kwargs):
+        """Send a request to the least loaded healthy replica.
+
+        Connection failures and 502/503/504 answers are retried on another
+        replica. If ``hedge`` is true and no answer has arrived after
+        ``hedge_after`` seconds, a duplicate goes to another replica and the
+        first answer wins, so the request body must be replayable (bytes, not
+        a file object). Raises ``ModelServiceUnavailable`` when the circuit
+        is open or every attempt failed.
+        """
+        if not self.breaker.allow():
+            raise ModelServiceUnavailable("Model service circuit breaker is open")
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            response = self._send(method, path, hedge, kwargs)
+        except BaseException:
+            # Whatever went wrong, the breaker hears about it; otherwise a
+            # half-open trial that raised would leave it waiting forever.
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return response
+
+    def _send(self, method, path, hedge, kwargs):
+        tried = set()
+        pending = set()
+        hedges_left = self.max_hedges if hedge else 0
+        last_error = None
+
+        first = self._submit(method, path, tried, kwargs)
+        if first is None:
+            raise ModelServiceUnavailable("No model service replicas configured")
+        pending.add(first)
+
+        while pending:
+            timeout = self.hedge_after if hedges_left > 0 else None
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedges_left -= 1
+                hedged = self._submit(method, path, tried, kwargs)
+                if hedged is not None:
+                    logger.info(f"Hedging {method} {path} after {self.hedge_after}s")
+                    pending.add(hedged)
+                continue
+
+            for future in done:
+                try:
+                    response = future.result()
+                except ReplicaError as e:
+                    last_error = e
+                    continue
+                return response
+
+            if not pending:
+                retry = self._submit(method, path, tried, kwargs)
+                if retry is not None:
+                    pending.add(retry)
+
+        raise ModelServiceUnavailable(f"All model service replicas failed: {last_error}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'circuit': self.breaker.state,
+                'replicas': [
+                    {
+                        'url': r.url,
+                        'healthy': r.healthy,
+                        'ejected': time.monotonic() < r.ejected_until,
+                        'outstanding': r.outstanding,
+                        'consecutive_failures': r.consecutive_failures,
+                    }
+                    for r in self.replicas
+                ],
+            }
+
+    def close(self):
+        self._stopped.set()
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+    def _pick(self, exclude):
+        now = time.monotonic()
+        with self._lock:
+            candidates = [r for r in self.replicas if r not in exclude]
+            available = [r for r in candidates if r.available(now)]
+            # With every replica ejected, still try one rather than failing outright.
+            pool = available or candidates
+            if not pool:
+                return None
+            least = min(r.outstanding for r in pool)
+            replica = random.choice([r for r in pool if r.outstanding == least])
+            replica.outstanding += 1
+            return replica
+
+    def _submit(self, method, path, tried, kwargs):
+        replica = self._pick(tried)
+        if replica is None:
+            return None
+        tried.add(replica)
+        return self._executor.submit(self._call, replica, method, path, kwargs)
+
+    def _call(self, replica, method, path, kwargs):
+        try:
+            response = self.session.request(method, f"{replica.url}{path}", **kwargs)
+        except requests.RequestException as e:
+            self._record_failure(replica)
+            raise ReplicaError(f"{replica.url}: {e}") from e
+        finally:
+            with self._lock:
+                replica.outstanding -= 1
+
+        if response.status_code in REPLICA_FAILURE_STATUSES:
+            self._record_failure(replica)
+            raise ReplicaError(f"{replica.url}: HTTP {response.status_code}")
+        with self._lock:
+            replica.consecutive_failures = 0
+        return response
+
+    def _record_failure(self, replica):
+        with self._lock:
+            replica.consecutive_failures += 1
+            if replica.consecutive_failures >= self.eject_after_failures:
+                replica.ejected_until = time.monotonic() + self.eject_seconds
+                logger.warning(f"Ejecting model service replica {replica.url} for {self.eject_seconds}s")
+
+    def _health_loop(self):
+        while not self._stopped.wait(self.health_check_interval):
+            for replica in self.replicas:
+                try:
+                    healthy = self.session.get(f"{replica.url}/health", timeout=self.timeout[0]).status_code == 200
+                except requests.RequestException:
+                    healthy = False
+                with self._lock:
+                    if healthy and not replica.healthy:
+                        logger.info(f"Model service replica {replica.url} is healthy again")
+                    elif not healthy and replica.healthy:
+                        logger.warning(f"Model service replica {replica.url} failed its health check")
+                    replica.healthy = healthy
+                    if healthy:
+                        replica.consecutive_failures = 0
+                        replica.ejected_until = 0.0
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_model_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                config = settings.AI_MODEL_SERVICE
+                _client = ModelServiceClient(
+                    config['URLS'],
+                    connect_timeout=config.get('CONNECT_TIMEOUT', 2.0),
+                    read_timeout=config.get('READ_TIMEOUT', 60.0),
+                    pool_size=config.get('POOL_SIZE', 10),
+                    health_check_interval=config.get('HEALTH_CHECK_INTERVAL', 5.0),
+                    eject_after_failures=config.get('EJECT_AFTER_FAILURES', 3),
+                    eject_seconds=config.get('EJECT_SECONDS', 30.0),
+                    hedge_after=config.get('HEDGE_AFTER', 5.0),
+                    max_hedges=config.get('MAX_HEDGES', 1),
+                    breaker_failure_threshold=config.get('BREAKER_FAILURE_THRESHOLD', 5),
+                    breaker_reset_timeout=config.get('BREAKER_RESET_TIMEOUT', 30.0),
+                )
+    return _client
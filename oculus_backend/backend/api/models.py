@@ -1,7 +1,10 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 import uuid
 
+from .findings import findings_text
+
 class Doctor(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     hospital = models.CharField(max_length=100, blank=True, null=True)
@@ -20,6 +23,11 @@ class OCTImage(models.Model):
     image_file = models.ImageField(upload_to='oct_images/')
     upload_date = models.DateTimeField(auto_now_add=True)
     custom_id = models.CharField(max_length=50, blank=True, null=True)
+
+    class Meta:
+        # A doctor's records, newest first (the cursor-paginated listing). The
+        # trailing id covers the join from a doctor's analysis results.
+        indexes = [models.Index(fields=['doctor', '-upload_date', 'id'])]
     
     def __str__(self):
         return f"OCT Image {self.custom_id or self.id} by Dr. {self.doctor.user.last_name}"
@@ -28,13 +36,62 @@ class AnalysisResult(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     oct_image = models.OneToOneField(OCTImage, on_delete=models.CASCADE, related_name='analysis_result')
     classification = models.CharField(max_length=100)
-    findings = models.TextField()
+    confidence = models.FloatField(blank=True, null=True)     # percent, as reported by the model service
+    # Rendered from api/findings.py templates at serialization time when
+    # findings_version is set; otherwise findings holds the literal text.
+    findings = models.TextField(blank=True)
+    findings_version = models.PositiveSmallIntegerField(blank=True, null=True)
     analysis_image = models.ImageField(upload_to='analysis_images/', blank=True, null=True)
+    # Raw Grad-CAM map as an 8-bit grayscale PNG of a few hundred bytes; overlays
+    # are rendered from it on request (api/overlays.py). Older results only have
+    # the burnt-in analysis_image.
+    heatmap = models.BinaryField(blank=True, null=True, editable=False)
+    probabilities = models.JSONField(blank=True, null=True)
     analysis_date = models.DateTimeField(auto_now_add=True)
-    
+
+    class Meta:
+        # The cursor-paginated listing, newest first with id breaking ties. The
+        # doctor filter joins through OCTImage's (doctor, -upload_date, id) index.
+        indexes = [models.Index(fields=['-analysis_date', '-id'])]
+
+    @property
+    def findings_text(self):
+        return findings_text(self)
+
     def __str__(self):
         return f"Analysis for {self.oct_image.custom_id or self.oct_image.id} - {self.classification}"
 
+class AnalysisJob(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    oct_image = models.ForeignKey(OCTImage, on_delete=models.CASCADE, related_name='analysis_jobs')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    # Earliest time a worker may (re)claim the job: the retry backoff while
+    # queued, the visibility timeout while running.
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=64, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'available_at'])]
+
+    def __str__(self):
+        return f"Analysis job {self.id} for {self.oct_image_id} - {self.status}"
+
 
 
 class Review(models.Model):
@@ -51,5 +108,12 @@ class Review(models.Model):
     comments = models.TextField()
     review_date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['analysis_result', '-review_date']),
+            models.Index(fields=['analysis_result', '-rating']),
+            models.Index(fields=['-review_date']),  # unfiltered public listing
+        ]
+
     def __str__(self):
         return f"Review by Dr. {self.doctor.user.last_name} on {self.analysis_result}"
\ No newline at end of file
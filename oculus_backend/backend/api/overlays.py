@@ -0,0 +1,254 @@
+"""Grad-CAM overlays rendered on request from the stored raw heatmap.
+
+The model service returns its low-resolution Grad-CAM map as an 8-bit
+grayscale PNG (``AnalysisResult.heatmap``, a few hundred bytes) instead of a
+burnt-in overlay. ``GET /api/analysis-results/<id>/overlay/`` colours it with
+any colormap, blends it over the scan at any alpha and encodes PNG, WebP or
+JPEG (``image_format``, since DRF reserves ``format``). Rendered variants are
+kept in an in-memory LRU.
+
+The serializers hand out overlay URLs signed with the result id, so ``<img>``
+tags (which send no bearer token) can load them like media files. Signatures
+are timestamped and expire after ``URL_MAX_AGE`` seconds. The timestamp is
+rounded down to a sixth of that, so a result's URL, and the browser's cached
+copy, stays the same for a while rather than changing on every listing.
+"""
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+from PIL import Image
+
+from .derivatives import derivative_settings, to_8bit
+from .timing import timed
+
+DEFAULT_SETTINGS = {
+    'ALPHA': 0.4,
+    'COLORMAP': 'jet',
+    'FORMAT': 'png',
+    'QUALITY': 85,                      # WebP and JPEG only
+    'SIZE': 1024,                       # longest side in pixels; smaller scans keep their size
+    'MAX_SIZE': 2048,
+    'CACHE_MAX_BYTES': 64 * 1024 * 1024,
+    'URL_MAX_AGE': 3600,                # seconds a signed overlay URL stays valid
+}
+
+FORMATS = {
+    'png': ('PNG', 'image/png'),
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'jpg': ('JPEG', 'image/jpeg'),
+}
+
+# Colour stops at evenly spaced positions from 0 to 1, interpolated linearly.
+# jet matches the model service's cv2.COLORMAP_JET overlay.
+COLORMAPS = {
+    'jet': ('000080', '0000ff', '0080ff', '00ffff', '80ff80', 'ffff00', 'ff8000', 'ff0000', '800000'),
+    'hot': ('000000', '800000', 'ff0000', 'ff8000', 'ffff00', 'ffff80', 'ffffff'),
+    'viridis': ('440154', '482878', '3e4989', '31688e', '26828e', '1f9e89', '35b779', '6ece58', 'b5de2b',
+                'fde725'),
+    'inferno': ('000004', '1b0c41', '4a0c6b', '781c6d', 'a52c60', 'cf4446', 'ed6925', 'fb9b06', 'f7d13d',
+                'fcffa4'),
+    'gray': ('000000', 'ffffff'),
+}
+
+SIGNATURE_SALT = 'api.overlays'
+
+
+def overlay_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'ANALYSIS_OVERLAYS', {})}
+
+
+@lru_cache(maxsize=None)
+def colormap_palette(name):
+    """256-entry RGB palette (a flat list of 768 ints) for ``Image.putpalette``."""
+    stops = [tuple(int(stop[i:i + 2], 16) for i in (0, 2, 4)) for stop in COLORMAPS[name]]
+    palette = []
+    for value in range(256):
+        position = value / 255 * (len(stops) - 1)
+        low = min(int(position), len(stops) - 2)
+        fraction = position - low
+        palette.extend(round(a + (b - a) * fraction) for a, b in zip(stops[low], stops[low + 1]))
+    return palette
+
+
+def overlay_options(params):
+    """Validated render options from query parameters, defaults filled in; raises ``ValueError``."""
+    config = overlay_settings()
+    try:
+        alpha = float(params.get('alpha', config['ALPHA']))
+        quality = int(params.get('quality', config['QUALITY']))
+        size = int(params.get('size', config['SIZE']))
+    except ValueError:
+        raise ValueError("alpha must be a number; quality and size must be integers")
+    colormap = params.get('colormap', config['COLORMAP']).lower()
+    image_format = params.get('image_format', config['FORMAT']).lower()
+    if not 0 <= alpha <= 1:
+        raise ValueError("alpha must be between 0 and 1")
+    if colormap not in COLORMAPS:
+        raise ValueError(f"Unknown colormap {colormap!r}; expected one of {', '.join(COLORMAPS)}")
+    if image_format not in FORMATS:
+        raise ValueError(f"Unknown format {image_format!r}; expected one of png, webp, jpeg")
+    if not 1 <= quality <= 100:
+        raise ValueError("quality must be between 1 and 100")
+    if not 16 <= size <= config['MAX_SIZE']:
+        raise ValueError(f"size must be between 16 and {config['MAX_SIZE']}")
+    return {'alpha': alpha, 'colormap': colormap, 'image_format': image_format, 'quality': quality, 'size': size}
+
+
+def render_overlay(storage, scan_name, heatmap, alpha, colormap, size):
+    """Blend the coloured heatmap over the scan, downscaled to ``size`` on its longest side; an RGB image."""
+    with Image.open(io.BytesIO(heatmap)) as heat:
+        heat = heat.convert('L')
+    with storage.open(scan_name) as f, Image.open(f) as scan:
+        # JPEG scans decode straight at a reduced scale
+        scan.draft('RGB', (size, size))
+        scan = to_8bit(scan).convert('RGB')
+    scan.thumbnail((size, size), Image.Resampling.LANCZOS)
+    # The map covers the whole scan, which the model saw squashed to a square
+    heat = heat.resize(scan.size, Image.Resampling.BILINEAR)
+    heat.putpalette(colormap_palette(colormap))
+    return Image.blend(scan, heat.convert('RGB'), alpha)
+
+
+def encode_overlay(image, image_format, quality):
+    pil_format, content_type = FORMATS[image_format]
+    buffer = io.BytesIO()
+    image.save(buffer, format=pil_format, **({} if pil_format == 'PNG' else {'quality': quality}))
+    return buffer.getvalue(), content_type
+
+
+def overlay_key(analysis_result, options):
+    # The heatmap digest keeps re-analysed results from serving a stale render
+    heatmap_digest = hashlib.sha256(bytes(analysis_result.heatmap)).hexdigest()[:16]
+    return ':'.join([str(analysis_result.pk), heatmap_digest, *(str(options[name]) for name in sorted(options))])
+
+
+def get_rendered_overlay(analysis_result, options):
+    """Return ``(data, content_type, etag)``, rendering on a cache miss."""
+    key = overlay_key(analysis_result, options)
+    cache = get_overlay_cache()
+    cached = cache.get(key)
+    if cached is None:
+        with timed('derivatives'):
+            scan_file = analysis_result.oct_image.image_file
+            image = render_overlay(scan_file.storage, scan_file.name, bytes(analysis_result.heatmap),
+                                   options['alpha'], options['colormap'], options['size'])
+            cached = encode_overlay(image, options['image_format'], options['quality'])
+        cache.set(key, cached)
+    data, content_type = cached
+    return data, content_type, f'"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+
+
+class OverlaySigner(signing.TimestampSigner):
+    def __init__(self, max_age):
+        super().__init__(salt=SIGNATURE_SALT)
+        self.window = max(1, max_age // 6)
+
+    def timestamp(self):
+        return signing.b62_encode(int(time.time()) // self.window * self.window)
+
+
+def overlay_signature(analysis_result_id):
+    """``<timestamp>:<signature>`` for the ``sig`` query parameter."""
+    signer = OverlaySigner(overlay_settings()['URL_MAX_AGE'])
+    return signer.sign(str(analysis_result_id)).split(signer.sep, 1)[1]
+
+
+def has_valid_signature(analysis_result_id, signature):
+    """Whether ``signature`` was issued for this result less than ``URL_MAX_AGE`` seconds ago."""
+    max_age = overlay_settings()['URL_MAX_AGE']
+    signer = OverlaySigner(max_age)
+    value = str(analysis_result_id)
+    try:
+        signed = signer.unsign(f"{value}{signer.sep}{signature}", max_age=max_age)
+    except signing.BadSignature:
+        return False
+    return constant_time_compare(signed, value)
+
+
+def overlay_url(analysis_result, variant=None):
+    """Signed overlay path in the default style; ``variant`` ('thumb', 'preview') sizes it like the derivatives."""
+    params = {}
+    if variant is not None:
+        config = derivative_settings()
+        params = {'size': config['SIZES'][variant], 'image_format': config['FORMAT'].lower(),
+                  'quality': config['QUALITY']}
+    params['sig'] = overlay_signature(analysis_result.pk)
+    return f"{reverse('analysisresult-overlay', args=[analysis_result.pk])}?{urlencode(params)}"
+
+
+class OverlayCache:
+    """In-memory LRU of rendered overlays, bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, entry):
+        data, _ = entry
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous[0])
+            self._entries[key] = entry
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_overlay_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = OverlayCache(overlay_settings()['CACHE_MAX_BYTES'])
+    return _cache
@@ -0,0 +1,17 @@
+from rest_framework.pagination import CursorPagination
+
+
+class RecordCursorPagination(CursorPagination):
+    """Keyset pagination for the record listings.
+
+    Each page is a ``WHERE <ordering field> < <cursor> ... LIMIT`` range
+    query, so page 1000 costs the same as page 1. The order comes from the
+    view's ``OrderingFilter`` (its ``ordering`` attribute by default, or a
+    whitelisted ``?ordering=``); the field should be close to unique, since
+    rows sharing a value are stepped through with an offset. Search filters
+    apply before paging as usual.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = '-pk'
@@ -0,0 +1,216 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+def image_content_hash(image_path):
+    """Hash the decoded pixels of an image rather than its file bytes.
+
+    Re-uploads of the same scan usually come with a different file name and
+    sometimes a different encoder, so the key is built from mode, size and raw
+    pixel data.
+    """
+    with Image.open(image_path) as img:
+        img.load()
+        digest = hashlib.sha256()
+        digest.update(f"{img.mode}:{img.size[0]}x{img.size[1]}:".encode())
+        digest.update(img.tobytes())
+    return digest.hexdigest()
+
+
+class AnalysisResultCache:
+    """Two-tier (memory LRU + disk) cache of model-service results.
+
+    Entries are dicts with ``category``, ``confidence``, ``text``,
+    ``probabilities``, ``heatmap`` and ``overlay`` (PNG bytes, or None for
+    classification-only results). The disk tier stores a JSON metadata file
+    (the small heatmap inlined as base64) and the overlay next to it and
+    evicts least recently used entries once ``max_disk_bytes`` is exceeded.
+    """
+
+    def __init__(self, cache_dir, model_version, max_memory_entries=128, max_disk_bytes=512 * 1024 * 1024):
+        self.cache_dir = str(cache_dir)
+        self.model_version = model_version
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+
+    def key_for_image(self, image_path):
+        version = hashlib.sha256(self.model_version.encode()).hexdigest()[:12]
+        return f"{version}-{image_content_hash(image_path)}"
+
+    def get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return dict(entry)
+
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._remember(key, entry)
+        return dict(entry)
+
+    def set(self, key, entry):
+        entry = {
+            'category': entry['category'],
+            'confidence': entry.get('confidence'),
+            'text': entry.get('text'),
+            'overlay': entry['overlay'],
+            'heatmap': entry.get('heatmap'),
+            'probabilities': entry.get('probabilities'),
+        }
+        with self._lock:
+            self._remember(key, entry)
+        try:
+            self._write_disk(key, entry)
+        except OSError as e:
+            logger.warning(f"Could not write analysis cache entry {key}: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'disk_bytes': self._disk_bytes,
+                'max_disk_bytes': self.max_disk_bytes,
+            }
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _paths(self, key):
+        directory = os.path.join(self.cache_dir, key[-2:])
+        return os.path.join(directory, f"{key}.json"), os.path.join(directory, f"{key}.png")
+
+    def _read_disk(self, key):
+        meta_path, overlay_path = self._paths(key)
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            # Bump access time so eviction stays least-recently-used.
+            os.utime(meta_path)
+        except (OSError, ValueError):
+            return None
+        meta['heatmap'] = base64.b64decode(meta['heatmap']) if meta.get('heatmap') else None
+        try:
+            with open(overlay_path, 'rb') as f:
+                meta['overlay'] = f.read()
+        except OSError:
+            meta['overlay'] = None
+        return meta
+
+    def _write_disk(self, key, entry):
+        meta_path, overlay_path = self._paths(key)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        meta = {k: v for k, v in entry.items() if k != 'overlay'}
+        if entry['heatmap']:
+            meta['heatmap'] = base64.b64encode(entry['heatmap']).decode()
+        meta = json.dumps(meta).encode()
+
+        previous = self._entry_size(meta_path, overlay_path)
+        writes = [(meta_path, meta)]
+        if entry['overlay']:
+            writes.insert(0, (overlay_path, entry['overlay']))
+        for path, data in writes:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+        with self._lock:
+            self._disk_bytes += self._entry_size(meta_path, overlay_path) - previous
+            over_budget = self._disk_bytes > self.max_disk_bytes
+        if over_budget:
+            self._evict_disk()
+
+    def _entry_size(self, meta_path, overlay_path):
+        size = 0
+        for path in (meta_path, overlay_path):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    def _disk_entries(self):
+        """Yield ``(key, size, last_used)`` for every entry on disk."""
+        for directory, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                key = name[:-len('.json')]
+                meta_path, overlay_path = self._paths(key)
+                try:
+                    last_used = os.path.getmtime(meta_path)
+                except OSError:
+                    continue
+                yield key, self._entry_size(meta_path, overlay_path), last_used
+
+    def _evict_disk(self):
+        entries = sorted(self._disk_entries(), key=lambda e: e[2])
+        # Evict down to 90% of the budget so we do not rescan on every write.
+        target = self.max_disk_bytes * 0.9
+        total = sum(size for _, size, _ in entries)
+        for key, size, _ in entries:
+            if total <= target:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+        with self._lock:
+            self._disk_bytes = total
+        logger.info(f"Evicted analysis cache down to {total} bytes")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_analysis_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = settings.ANALYSIS_CACHE
+                _cache = AnalysisResultCache(
+                    config['DIR'],
+                    settings.AI_MODEL_VERSION,
+                    max_memory_entries=config.get('MAX_MEMORY_ENTRIES', 128),
+                    max_disk_bytes=config.get('MAX_DISK_BYTES', 512 * 1024 * 1024),
+                )
+    return _cache
@@ -1,6 +1,10 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Doctor, OCTImage, AnalysisResult, Review
+from .authentication import PROFILE_CLAIM, profile_claim
+from .derivatives import derivative_url
+from .models import Doctor, OCTImage, AnalysisResult, AnalysisJob, Review
+from .overlays import overlay_url
+from .timing import TimedSerializerMixin
 from django.db.utils import IntegrityError
 from rest_framework.exceptions import ValidationError
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
@@ -10,19 +14,19 @@ from .models import OCTImage, AnalysisResult, Doctor
 
 
 # Keep all Doctor-related serializers exactly as they were
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'username', 'email', 'first_name', 'last_name')
         read_only_fields = ('id',)
 
-class DoctorProfileSerializer(serializers.ModelSerializer):
+class DoctorProfileSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Doctor
         fields = ('hospital', 'specialty', 'role', 'license_number', 'profile_picture', 'phone_number')
         read_only_fields = ()  # Explicitly empty to ensure all fields can be updated
 
-class DoctorSerializer(serializers.ModelSerializer):
+class DoctorSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     first_name = serializers.CharField(source='user.first_name', read_only=True)
     last_name = serializers.CharField(source='user.last_name', read_only=True)
 
@@ -51,7 +55,7 @@ class DoctorSignupSerializer(serializers.Serializer):
         except Exception as e:
             raise ValidationError({"error": str(e)})
 
-class DoctorCompleteSerializer(serializers.ModelSerializer):
+class DoctorCompleteSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user = UserSerializer()
     
     class Meta:
@@ -59,10 +63,21 @@ class DoctorCompleteSerializer(serializers.ModelSerializer):
         fields = ('user', 'hospital', 'specialty', 'role', 'license_number', 'profile_picture', 'phone_number')
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        # Lets DoctorJWTAuthentication build request.user and its doctor without a query
+        try:
+            doctor = user.doctor
+        except Doctor.DoesNotExist:
+            doctor = None
+        token[PROFILE_CLAIM] = profile_claim(user, doctor)
+        return token
+
     def validate(self, attrs):
         data = super().validate(attrs)
         user = self.user
-        doctor = Doctor.objects.get(user=user)
+        doctor = user.doctor
         data['user'] = {
             'id': user.id,
             'username': user.username,
@@ -79,13 +94,52 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
             }
         }
         return data
-class OCTImageSerializer(serializers.ModelSerializer):
+class DerivativeImageField(serializers.ReadOnlyField):
+    """URL of a downscaled variant (see api/derivatives.py) of the image field ``source``."""
+
+    def __init__(self, variant, **kwargs):
+        self.variant = variant
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        url = derivative_url(value, self.variant)
+        request = self.context.get('request', None)
+        if url is not None and request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
+class AnalysisOverlayField(serializers.ReadOnlyField):
+    """URL of a result's overlay, or of its ``variant``: rendered from the stored heatmap
+    (see api/overlays.py), or for older results the stored ``analysis_image``."""
+
+    def __init__(self, variant=None, **kwargs):
+        self.variant = variant
+        super().__init__(source='*', **kwargs)
+
+    def to_representation(self, analysis_result):
+        if analysis_result.heatmap:
+            url = overlay_url(analysis_result, self.variant)
+        elif self.variant is not None:
+            url = derivative_url(analysis_result.analysis_image, self.variant)
+        else:
+            url = analysis_result.analysis_image.url if analysis_result.analysis_image else None
+        request = self.context.get('request', None)
+        if url is not None and request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
+class OCTImageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    image_thumbnail = DerivativeImageField('thumb', source='image_file')
+    image_preview = DerivativeImageField('preview', source='image_file')
+
     class Meta:
         model = OCTImage
-        fields = ('id', 'doctor', 'image_file', 'upload_date', 'custom_id')
+        fields = ('id', 'doctor', 'image_file', 'image_thumbnail', 'image_preview', 'upload_date', 'custom_id')
         read_only_fields = ('id', 'upload_date')
 
-class OCTImageCreateSerializer(serializers.ModelSerializer):
+class OCTImageCreateSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = OCTImage
         fields = ('image_file', 'custom_id')
@@ -96,39 +150,80 @@ class OCTImageCreateSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class AnalysisResultSerializer(serializers.ModelSerializer):
+class AnalysisResultListSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """List rows: the structured result without the findings text (see api/findings.py)."""
+    analysis_image = AnalysisOverlayField()
+    analysis_thumbnail = AnalysisOverlayField('thumb')
+    analysis_preview = AnalysisOverlayField('preview')
+
+    class Meta:
+        model = AnalysisResult
+        fields = ('id', 'oct_image', 'classification', 'confidence', 'probabilities', 'analysis_image',
+                  'analysis_thumbnail', 'analysis_preview', 'analysis_date')
+        read_only_fields = fields
+
+
+class AnalysisResultSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    findings = serializers.CharField(source='findings_text', read_only=True)
+    analysis_image = AnalysisOverlayField()
+    analysis_thumbnail = AnalysisOverlayField('thumb')
+    analysis_preview = AnalysisOverlayField('preview')
+
     class Meta:
         model = AnalysisResult
-        fields = ('id', 'oct_image', 'classification', 'findings', 'analysis_image', 'analysis_date')
+        fields = ('id', 'oct_image', 'classification', 'confidence', 'findings', 'probabilities', 'analysis_image',
+                  'analysis_thumbnail', 'analysis_preview', 'analysis_date')
         read_only_fields = ('id', 'analysis_date')
 
-class OCTImageDetailSerializer(serializers.ModelSerializer):
+class OCTImageDetailSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     doctor = DoctorCompleteSerializer(read_only=True)
     analysis_result = AnalysisResultSerializer(read_only=True)
+    image_thumbnail = DerivativeImageField('thumb', source='image_file')
+    image_preview = DerivativeImageField('preview', source='image_file')
     
     class Meta:
         model = OCTImage
-        fields = ('id', 'doctor', 'image_file', 'upload_date', 'custom_id', 'analysis_result')
+        fields = ('id', 'doctor', 'image_file', 'image_thumbnail', 'image_preview', 'upload_date', 'custom_id',
+                  'analysis_result')
         read_only_fields = ('id', 'upload_date', 'doctor')
 
-class OCTImageCreateSerializer(serializers.ModelSerializer):
+class OCTImageCreateSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = OCTImage
         fields = ('id', 'custom_id', 'image_file', 'upload_date')
         read_only_fields = ('id', 'upload_date')
 
 
-class AnalysisResultDetailSerializer(serializers.ModelSerializer):
+class AnalysisResultDetailSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     oct_image = OCTImageDetailSerializer(read_only=True)
+    findings = serializers.CharField(source='findings_text', read_only=True)
+    analysis_image = AnalysisOverlayField()
+    analysis_thumbnail = AnalysisOverlayField('thumb')
+    analysis_preview = AnalysisOverlayField('preview')
     
     class Meta:
         model = AnalysisResult
-        fields = ('id', 'oct_image', 'classification', 'findings', 'analysis_image', 'analysis_date')
+        fields = ('id', 'oct_image', 'classification', 'confidence', 'findings', 'probabilities', 'analysis_image',
+                  'analysis_thumbnail', 'analysis_preview', 'analysis_date')
         read_only_fields = ('id', 'analysis_date', 'oct_image')
 
+class AnalysisJobSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    analysis_result = serializers.SerializerMethodField()
+
+    class Meta:
+        model = AnalysisJob
+        fields = ('id', 'oct_image', 'status', 'attempts', 'max_attempts', 'error', 'created_at', 'updated_at', 'analysis_result')
+        read_only_fields = fields
+
+    def get_analysis_result(self, obj):
+        if obj.status != AnalysisJob.STATUS_DONE:
+            return None
+        analysis = AnalysisResult.objects.filter(oct_image_id=obj.oct_image_id).values_list('id', flat=True).first()
+        return analysis
+
 # serializers.py
 
-class ReviewCreateSerializer(serializers.ModelSerializer):
+class ReviewCreateSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Review
         fields = ('analysis_result', 'rating', 'comments')
@@ -144,7 +239,7 @@ class ReviewCreateSerializer(serializers.ModelSerializer):
         validated_data['doctor'] = doctor
         return super().create(validated_data)
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     doctor = DoctorSerializer(read_only=True)
     is_owner = serializers.SerializerMethodField()
 
@@ -158,7 +253,7 @@ class ReviewSerializer(serializers.ModelSerializer):
         return request and request.user.is_authenticated and obj.doctor.user == request.user
 
 
-class PublicReviewSerializer(serializers.ModelSerializer):
+class PublicReviewSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     doctor = serializers.SerializerMethodField()
 
     class Meta:
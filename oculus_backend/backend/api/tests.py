@@ -1,3 +1,924 @@
-from django.test import TestCase
+import base64
+import csv
+import io
+import json
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+import requests
+from PIL import Image
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .analysis import (
+    ANALYSIS_CONTENT_TYPE, decode_analysis_frame, decode_analysis_frames, run_ai_analysis, run_ai_analysis_batch,
+)
+from .authentication import DoctorJWTAuthentication, get_profile_cache
+from .derivatives import derivative_name, generate_derivatives, known_derivatives
+from . import jobs
+from .findings import CURRENT_VERSION, compact_findings, render_findings
+from .model_client import CircuitBreaker, ModelServiceClient, ModelServiceUnavailable
+from .models import AnalysisJob, AnalysisResult, Doctor, OCTImage, Review
+from .overlays import get_overlay_cache
+from .pagination import RecordCursorPagination
+from .result_cache import AnalysisResultCache
+from .serializers import CustomTokenObtainPairSerializer
+from .timing import get_timing_aggregate
+
+# Rows per list in the query-count suite. The query count of every endpoint
+# must not grow with the number of rows it serializes.
+ROW_COUNTS = (1, 100, 1000)
+PAGE_SIZE = RecordCursorPagination.page_size
+
+
+class QueryCountTests(TestCase):
+    """Upper bounds on the queries each endpoint runs, for 1, 100 and 1000 rows.
+
+    Authentication is forced, so the bounds cover only the view itself.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('doctor', password='secret', first_name='Ada', last_name='Lovelace')
+        self.doctor = Doctor.objects.create(user=self.user, hospital='General')
+        # Reviews come from several doctors, so is_owner and the nested doctor vary per row.
+        self.reviewers = [self.doctor] + [
+            Doctor.objects.create(user=User.objects.create_user(f'reviewer{i}')) for i in range(3)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_rows(self, count):
+        OCTImage.objects.all().delete()
+        oct_images = OCTImage.objects.bulk_create([
+            OCTImage(doctor=self.doctor, image_file=f'oct_images/scan_{i}.png', custom_id=f'P{i}')
+            for i in range(count)
+        ])
+        analysis_results = AnalysisResult.objects.bulk_create([
+            AnalysisResult(
+                oct_image=oct_image,
+                classification='Drusen',
+                findings='Predicted Condition: Drusen (Confidence: 90.00%)',
+                analysis_image=f'analysis_images/processed_{oct_image.id}.png',
+            )
+            for oct_image in oct_images
+        ])
+        Review.objects.bulk_create([
+            Review(
+                analysis_result=analysis_result,
+                doctor=self.reviewers[i % len(self.reviewers)],
+                rating=5,
+                comments='ok',
+            )
+            for i, analysis_result in enumerate(analysis_results)
+        ])
+        return oct_images, analysis_results
+
+    def assertMaxQueries(self, limit, url, expected_rows=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content[:200])
+        if expected_rows is not None:
+            data = response.json()
+            self.assertEqual(len(data['results'] if isinstance(data, dict) else data), expected_rows)
+        self.assertLessEqual(
+            len(queries), limit,
+            f"GET {url} ran {len(queries)} queries:\n" + "\n".join(q['sql'] for q in queries.captured_queries),
+        )
+
+    def test_oct_image_list(self):
+        for count in ROW_COUNTS:
+            with self.subTest(rows=count):
+                self.create_rows(count)
+                self.assertMaxQueries(1, '/api/oct-images/', min(count, PAGE_SIZE))
+
+    def test_analysis_result_list(self):
+        for count in ROW_COUNTS:
+            with self.subTest(rows=count):
+                self.create_rows(count)
+                self.assertMaxQueries(1, '/api/analysis-results/', min(count, PAGE_SIZE))
+
+    def test_review_list(self):
+        for count in ROW_COUNTS:
+            with self.subTest(rows=count):
+                self.create_rows(count)
+                self.assertMaxQueries(1, '/api/reviews/', min(count, PAGE_SIZE))
+
+    def test_doctor_list(self):
+        for count in ROW_COUNTS:
+            with self.subTest(rows=count):
+                User.objects.filter(username__startswith='listed').delete()
+                users = User.objects.bulk_create([User(username=f'listed{i}') for i in range(count)])
+                Doctor.objects.bulk_create([Doctor(user=user) for user in users])
+                self.assertMaxQueries(1, '/api/doctors/', count + len(self.reviewers))
+
+    def test_detail_endpoints(self):
+        oct_images, analysis_results = self.create_rows(100)
+        oct_image, analysis_result = oct_images[0], analysis_results[0]
+        self.assertMaxQueries(1, f'/api/oct-images/{oct_image.id}/')
+        self.assertMaxQueries(1, f'/api/analysis-results/{analysis_result.id}/')
+        self.assertMaxQueries(1, f'/api/analysis-results/by-image/{oct_image.id}/')
+        self.assertMaxQueries(1, f'/api/reviews/{analysis_result.reviews.get().id}/')
+        self.assertMaxQueries(1, f'/api/doctors/{self.doctor.id}/')
+
+    def test_deep_pages(self):
+        self.create_rows(1000)
+        seen = set()
+        url = '/api/oct-images/'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                data = self.client.get(url).json()
+            self.assertLessEqual(len(queries), 1)
+            seen.update(row['id'] for row in data['results'])
+            url = data['next']
+        self.assertEqual(len(seen), 1000)
+
+
+class ListingTests(TestCase):
+    """Server-side search, filters and ordering the frontend pages with."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('doctor')
+        self.doctor = Doctor.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.results = [
+            AnalysisResult.objects.create(
+                oct_image=OCTImage.objects.create(doctor=self.doctor, image_file=f'oct_images/scan_{i}.png',
+                                                  custom_id=f'P{i}'),
+                classification='Drusen', confidence=confidence, findings='',
+            )
+            for i, confidence in enumerate([70.0, None, 95.5, None, 80.0])
+        ]
+
+    def test_filter_by_oct_image(self):
+        target = self.results[2]
+        rows = self.client.get('/api/analysis-results/', {'oct_image': str(target.oct_image_id)}).json()['results']
+        self.assertEqual([row['id'] for row in rows], [str(target.id)])
+
+    def test_search_by_custom_id_or_image_id(self):
+        oct_image = self.results[3].oct_image
+        for term in ('P3', str(oct_image.id)[:8]):
+            with self.subTest(term=term):
+                rows = self.client.get('/api/oct-images/', {'search': term}).json()['results']
+                self.assertEqual([row['id'] for row in rows], [str(oct_image.id)])
+
+    def test_confidence_ordering_pages_past_null_confidence(self):
+        seen = []
+        url, params = '/api/analysis-results/', {'ordering': '-confidence_rank', 'page_size': 1}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200, response.content[:200])
+            data = response.json()
+            seen.extend(row['confidence'] for row in data['results'])
+            url, params = data['next'], None
+        self.assertEqual(seen, [95.5, 80.0, 70.0, None, None])
+
+
+class StubResponse:
+    def __init__(self, url, status_code=200):
+        self.url = url
+        self.status_code = status_code
+
+
+class StubSession:
+    """Stands in for ``requests.Session``: each replica URL maps to a function that answers or raises."""
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        replica = url.split('/predict')[0]
+        self.calls.append(replica)
+        return self.handlers[replica](url)
+
+    def close(self):
+        pass
+
+
+def refuse_connection(url):
+    raise requests.ConnectionError('refused')
+
+
+class ModelClientTests(SimpleTestCase):
+    """Ejection, hedging and the circuit breaker, against a stubbed session."""
+
+    def make_client(self, handlers, **kwargs):
+        client = ModelServiceClient(list(handlers), health_check_interval=0, **kwargs)
+        self.addCleanup(client.close)
+        client.session = StubSession(handlers)
+        # Keep replica b busier, so the first attempt always goes to replica a
+        client.replicas[1].outstanding = 1
+        return client
+
+    def test_failing_replica_is_ejected(self):
+        client = self.make_client({'http://a': refuse_connection, 'http://b': StubResponse},
+                                  eject_after_failures=2)
+        for _ in range(4):
+            self.assertEqual(client.post('/predict', hedge=False).url, 'http://b/predict')
+        self.assertEqual(client.session.calls.count('http://a'), 2)
+        replica_a = client.stats()['replicas'][0]
+        self.assertTrue(replica_a['ejected'])
+        self.assertEqual(client.stats()['circuit'], CircuitBreaker.CLOSED)
+
+    def test_slow_request_is_hedged(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def stalled(url):
+            release.wait(5)
+            return StubResponse(url)
+
+        client = self.make_client({'http://a': stalled, 'http://b': StubResponse}, hedge_after=0.05)
+        start = time.monotonic()
+        self.assertEqual(client.post('/predict').url, 'http://b/predict')
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(client.session.calls, ['http://a', 'http://b'])
+
+    def test_circuit_breaker_opens_and_recovers(self):
+        handlers = {'http://a': refuse_connection, 'http://b': refuse_connection}
+        client = self.make_client(handlers, hedge_after=0.05, eject_after_failures=100,
+                                  breaker_failure_threshold=2, breaker_reset_timeout=0.05)
+        for _ in range(2):
+            with self.assertRaises(ModelServiceUnavailable):
+                client.post('/predict')
+        self.assertEqual(client.breaker.state, CircuitBreaker.OPEN)
+        calls = len(client.session.calls)
+        with self.assertRaises(ModelServiceUnavailable):
+            client.post('/predict')
+        self.assertEqual(len(client.session.calls), calls)
+
+        # A half-open trial that fails with something other than a replica error still reopens the circuit
+        time.sleep(0.06)
+        handlers['http://a'] = handlers['http://b'] = lambda url: 1 / 0
+        with self.assertRaises(ZeroDivisionError):
+            client.post('/predict')
+        self.assertEqual(client.breaker.state, CircuitBreaker.OPEN)
+
+        time.sleep(0.06)
+        handlers['http://a'] = handlers['http://b'] = StubResponse
+        client.post('/predict')
+        self.assertEqual(client.breaker.state, CircuitBreaker.CLOSED)
+
+
+class AuthenticationTests(TestCase):
+    """request.user and its doctor come from the token or the profile cache, not a query per request."""
+
+    def setUp(self):
+        get_profile_cache().clear()
+        self.user = User.objects.create_user('doctor', password='secret', first_name='Ada')
+        self.doctor = Doctor.objects.create(user=self.user, hospital='General')
+        self.client = APIClient()
+        self.token = CustomTokenObtainPairSerializer.get_token(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def test_profile_from_token_claims(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/doctors/me/')
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(response.json()['hospital'], 'General')
+        self.assertEqual(response.json()['user']['first_name'], 'Ada')
+
+    def test_claim_built_user_is_read_only(self):
+        authentication = DoctorJWTAuthentication()
+        # Built from the claim, then copied out of the profile cache
+        for user in (authentication.get_user(self.token), authentication.get_user(self.token)):
+            self.assertEqual(user.doctor.hospital, 'General')
+            for instance in (user, user.doctor):
+                with self.assertRaises(NotImplementedError):
+                    instance.save()
+                with self.assertRaises(NotImplementedError):
+                    instance.delete()
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('secret'))
+
+    def test_update_profile_invalidates(self):
+        response = self.client.patch(
+            '/api/doctors/update_profile/', {'first_name': 'Grace', 'doctor': {'hospital': 'Eye Clinic'}}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        data = self.client.get('/api/doctors/me/').json()
+        self.assertEqual((data['user']['first_name'], data['hospital']), ('Grace', 'Eye Clinic'))
+        # Only the listed fields are written, the password survives
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('secret'))
+
+
+class RequestTimingTests(TestCase):
+    def setUp(self):
+        get_timing_aggregate().clear()
+        self.user = User.objects.create_user('doctor', password='secret')
+        self.doctor = Doctor.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_server_timing_header(self):
+        OCTImage.objects.create(doctor=self.doctor, image_file='oct_images/scan.png')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/oct-images/', HTTP_ORIGIN='http://localhost:3000')
+        # Readable by the frontend on another origin
+        self.assertEqual(response['Timing-Allow-Origin'], 'http://localhost:3000')
+        self.assertIn('Server-Timing', response['Access-Control-Expose-Headers'])
+        metrics = dict(metric.split(';', 1) for metric in response['Server-Timing'].split(', '))
+        self.assertIn(f'desc="{len(queries)} calls"', metrics['db'])
+        self.assertIn('serialize', metrics)
+        self.assertIn('total', metrics)
+
+    def test_anonymous_requests_see_only_the_total(self):
+        response = APIClient().get('/api/reviews/', HTTP_ORIGIN='http://evil.example')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[0-9.]+$')
+        self.assertFalse(response.has_header('Timing-Allow-Origin'))
+
+    def test_aggregate_is_staff_only(self):
+        self.client.get('/api/oct-images/')
+        self.assertEqual(self.client.get('/api/analysis-results/request-timing/').status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        routes = self.client.get('/api/analysis-results/request-timing/').json()['routes']
+        self.assertEqual(routes['GET /api/oct-images/']['requests'], 1)
+
+
+class FindingsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('doctor')
+        self.doctor = Doctor.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_result(self, classification, confidence, text):
+        findings, findings_version = compact_findings(classification, confidence, text)
+        return AnalysisResult.objects.create(
+            oct_image=OCTImage.objects.create(doctor=self.doctor, image_file='oct_images/scan.png'),
+            classification=classification, confidence=confidence, findings=findings,
+            findings_version=findings_version, analysis_image='analysis_images/processed.png',
+        )
+
+    def test_templated_findings_are_rendered(self):
+        text = render_findings('Drusen', 91.234)
+        templated = self.create_result('Drusen', 91.234, text)
+        self.assertEqual((templated.findings, templated.findings_version), ('', CURRENT_VERSION))
+        self.assertEqual(self.client.get(f'/api/analysis-results/{templated.id}/').json()['findings'], text)
+        # Text no template reproduces is kept as is
+        edited = self.create_result('Normal', 60.0, render_findings('Normal', 60.0) + ' Reviewed.')
+        self.assertIsNone(edited.findings_version)
+        self.assertTrue(self.client.get(f'/api/analysis-results/{edited.id}/').json()['findings'].endswith('Reviewed.'))
+
+    def test_list_rows_are_structured(self):
+        self.create_result('Drusen', 91.2, render_findings('Drusen', 91.2))
+        self.create_result('Normal', 55.0, render_findings('Normal', 55.0))
+        rows = self.client.get('/api/analysis-results/', {'confidence__gte': 90}).json()['results']
+        self.assertEqual([(row['classification'], row['confidence']) for row in rows], [('Drusen', 91.2)])
+        self.assertNotIn('findings', rows[0])
+
+
+def png_bytes(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def encode_frame(header, image_bytes):
+    """The model service's ``protocol.encode_analysis_frame``, byte for byte."""
+    header_bytes = json.dumps(dict(header, image_length=len(image_bytes))).encode('utf-8')
+    return struct.pack('>I', len(header_bytes)) + header_bytes + image_bytes
+
+
+class StubModelServiceResponse:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.headers = {'Content-Type': 'application/json'}
+        self._data = data
+        self.text = json.dumps(data)
+        self.content = self.text.encode()
+
+    @classmethod
+    def frames(cls, results):
+        response = cls(200, None)
+        response.headers = {'Content-Type': ANALYSIS_CONTENT_TYPE}
+        response.content = b''.join(encode_frame(result, b'') for result in results)
+        response.text = ''
+        return response
+
+    def json(self):
+        return self._data
+
+
+class StubModelService:
+    """Stands in for the model-service client, answering ``/predict`` and ``/predict_batch``.
+
+    Scans whose file name starts with ``unreadable`` get a per-item error, and
+    ``status_code`` other than 200 fails the whole request. Answers in JSON,
+    or in binary frames when ``binary`` is set.
+    """
+    timeout = (2.0, 60.0)
+
+    def __init__(self):
+        self.calls = []
+        self.status_code = 200
+        self.binary = False
+
+    def result(self, name, explain):
+        if name.startswith('unreadable'):
+            return {'category': 'error', 'text': 'Could not decode image', 'analyzed_image': None}
+        result = {'category': 'Drusen', 'confidence': 91.2, 'probabilities': {'Drusen': 0.912, 'Normal': 0.088}}
+        if explain:
+            result['region'] = 'middle central'
+            heatmap = png_bytes(Image.linear_gradient('L').resize((7, 7)))
+            result['heatmap'] = base64.b64encode(heatmap).decode()
+        return result
+
+    def post(self, path, params=None, **kwargs):
+        explain = (params or {}).get('explain') != '0'
+        if path == '/predict_batch':
+            names = [name for _, (name, _, _) in kwargs['files']]
+        else:
+            names = ['scan']
+        self.calls.append((path, names, explain))
+        if self.status_code != 200:
+            return StubModelServiceResponse(self.status_code, {'category': 'error', 'text': 'Model unavailable'})
+        results = [self.result(name, explain) for name in names]
+        if self.binary:
+            return StubModelServiceResponse.frames(results)
+        return StubModelServiceResponse(200, {'results': results} if path == '/predict_batch' else results[0])
+
+
+class AnalysisTestCase(TestCase):
+    """Temporary media and result cache, with the model service replaced by ``StubModelService``."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root))
+        self.model_service = StubModelService()
+        self.enterContext(mock.patch('api.analysis.get_model_client', return_value=self.model_service))
+        self.analysis_cache = AnalysisResultCache(tempfile.mkdtemp(dir=self.media_root), 'test-model')
+        self.enterContext(mock.patch('api.analysis.get_analysis_cache', return_value=self.analysis_cache))
+        get_overlay_cache().clear()
+        known_derivatives.clear()
+        self.user = User.objects.create_user('doctor', password='secret')
+        self.doctor = Doctor.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def scan_file(self, name, shade=90):
+        return SimpleUploadedFile(name, png_bytes(Image.new('L', (64, 48), shade)), content_type='image/png')
+
+
+class BulkUploadTests(AnalysisTestCase):
+    def upload(self, files):
+        return self.client.post('/api/oct-images/bulk/', {'image_files': files, 'custom_ids': ['P1', 'P2', 'P3']},
+                                format='multipart')
+
+    def test_all_analysed(self):
+        response = self.upload([self.scan_file('a.png', 10), self.scan_file('b.png', 20)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([item['status'] for item in response.json()['results']], ['done', 'done'])
+        self.assertEqual(len(self.model_service.calls), 1)
+        # The model service sends no prose; the findings come from the current template
+        self.assertEqual(AnalysisResult.objects.filter(
+            classification='Drusen', findings='', findings_version=CURRENT_VERSION).count(), 2)
+
+    def test_partial_failure(self):
+        invalid = SimpleUploadedFile('notes.png', b'not an image', content_type='image/png')
+        response = self.upload([self.scan_file('a.png'), invalid, self.scan_file('unreadable.png', 30)])
+        self.assertEqual(response.status_code, 207)
+        done, rejected, failed = response.json()['results']
+        self.assertEqual((done['status'], done['oct_image']['custom_id']), ('done', 'P1'))
+        self.assertEqual(rejected['status'], 'invalid')
+        self.assertIn('image_file', rejected['errors'])
+        self.assertEqual(failed['status'], 'failed')
+        self.assertEqual(failed['errors'], {'analysis': 'Could not decode image'})
+        # Only the valid files were stored, and the failure is kept with its scan
+        self.assertEqual(OCTImage.objects.count(), 2)
+        self.assertEqual(AnalysisResult.objects.get(oct_image__custom_id='P3').classification, 'error')
+
+    def test_model_service_failure(self):
+        self.model_service.status_code = 503
+        with self.assertLogs('api.analysis', 'ERROR'):
+            response = self.upload([self.scan_file('a.png', 10), self.scan_file('b.png', 20)])
+        self.assertEqual(response.status_code, 207)
+        for item in response.json()['results']:
+            self.assertEqual(item['status'], 'failed')
+            self.assertIn('503', item['errors']['analysis'])
+
+    def test_single_image_failures_are_logged_like_a_batch(self):
+        path = os.path.join(self.media_root, 'a.png')
+        Image.new('L', (64, 48), 10).save(path)
+        self.model_service.status_code = 503
+        with self.assertLogs('api.analysis', 'ERROR') as logs:
+            self.assertEqual(run_ai_analysis(path)['category'], 'error')
+        self.assertTrue(logs.output[0].startswith('ERROR:api.analysis:API failed: 503'))
+        with self.assertLogs('api.analysis', 'ERROR') as logs:
+            self.assertEqual(run_ai_analysis(os.path.join(self.media_root, 'missing.png'))['category'], 'error')
+        self.assertIn('Traceback', logs.output[0])
+
+
+class FrameProtocolTests(AnalysisTestCase):
+    """Binary ``application/x-oculus-analysis`` responses, as the model service writes them."""
+
+    def test_single_frame_round_trip(self):
+        overlay = png_bytes(Image.new('RGB', (8, 6), (200, 30, 30)))
+        header = {'category': 'Drusen', 'confidence': 91.2, 'region': 'upper left'}
+        frame = encode_frame(header, overlay)
+        decoded, image, end = decode_analysis_frame(frame)
+        self.assertEqual(decoded, dict(header, image_length=len(overlay)))
+        self.assertEqual(image, overlay)
+        self.assertEqual(end, len(frame))
+
+    def test_batch_round_trip(self):
+        items = [
+            ({'category': 'Drusen', 'confidence': 91.2}, png_bytes(Image.new('RGB', (8, 6), (200, 30, 30)))),
+            ({'category': 'error', 'text': 'Could not decode image'}, b''),
+            ({'category': 'Normal', 'confidence': 60.0}, png_bytes(Image.new('L', (5, 5), 7))),
+        ]
+        frames = decode_analysis_frames(b''.join(encode_frame(header, image) for header, image in items))
+        self.assertEqual(frames, [(dict(header, image_length=len(image)), image) for header, image in items])
+
+    def test_analysis_reads_binary_responses(self):
+        self.model_service.binary = True
+        path = os.path.join(self.media_root, 'scan.png')
+        Image.new('L', (64, 48), 10).save(path)
+        result = run_ai_analysis(path)
+        self.assertEqual((result['category'], result['confidence']), ('Drusen', 91.2))
+        self.assertTrue(result['heatmap'].startswith(b'\x89PNG'))
+        unreadable = os.path.join(self.media_root, 'unreadable.png')
+        shutil.copy(path, unreadable)
+        with self.assertLogs('api.analysis', 'WARNING'):
+            batch = run_ai_analysis_batch([path, unreadable], explain=False)
+        self.assertEqual([item['category'] for item in batch], ['Drusen', 'error'])
+        self.assertIsNone(batch[0]['heatmap'])
+
+
+@override_settings(ANALYSIS_JOBS={'MAX_ATTEMPTS': 2, 'VISIBILITY_TIMEOUT': 120, 'RETRY_BACKOFF': 5})
+class AnalysisJobTests(AnalysisTestCase):
+    def enqueue(self, custom_id):
+        oct_image = OCTImage(doctor=self.doctor, custom_id=custom_id)
+        oct_image.image_file.save('scan.png', ContentFile(png_bytes(Image.new('L', (64, 48), 90))), save=True)
+        return jobs.enqueue_analysis(oct_image)
+
+    def make_claimable(self, job):
+        AnalysisJob.objects.filter(id=job.id).update(available_at=timezone.now())
+
+    def test_claim_oldest_first(self):
+        first, second = self.enqueue('P1'), self.enqueue('P2')
+        claimed = jobs.claim_next_job('worker-a')
+        self.assertEqual((claimed.id, claimed.status, claimed.attempts, claimed.locked_by),
+                         (first.id, AnalysisJob.STATUS_RUNNING, 1, 'worker-a'))
+        self.assertGreater(claimed.available_at, timezone.now() + timedelta(seconds=110))
+        self.assertEqual(jobs.claim_next_job('worker-b').id, second.id)
+        self.assertIsNone(jobs.claim_next_job('worker-c'))
+
+        jobs.run_job(claimed)
+        claimed.refresh_from_db()
+        self.assertEqual(claimed.status, AnalysisJob.STATUS_DONE)
+        self.assertEqual(claimed.oct_image.analysis_result.classification, 'Drusen')
+
+    def test_retry_with_backoff_then_fail(self):
+        job = self.enqueue('P1')
+        self.model_service.status_code = 503
+        with self.assertLogs('api.jobs', 'WARNING'):
+            jobs.run_job(jobs.claim_next_job('worker-a'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (AnalysisJob.STATUS_QUEUED, 1))
+        self.assertIn('503', job.error)
+        self.assertAlmostEqual((job.available_at - timezone.now()).total_seconds(), 5, delta=1)
+        # Failed attempts before the last store nothing, and the backoff hides the job
+        self.assertFalse(AnalysisResult.objects.exists())
+        self.assertIsNone(jobs.claim_next_job('worker-a'))
+
+        self.make_claimable(job)
+        with self.assertLogs('api.jobs', 'ERROR'):
+            jobs.run_job(jobs.claim_next_job('worker-a'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (AnalysisJob.STATUS_FAILED, 2))
+        result = AnalysisResult.objects.get(oct_image=job.oct_image)
+        self.assertEqual((result.classification, result.findings_version), ('error', None))
+        self.assertIn('503', result.findings)
+
+    def test_expired_lease_is_reclaimed(self):
+        job = self.enqueue('P1')
+        stale = jobs.claim_next_job('worker-a')
+        self.assertTrue(jobs.extend_lease(stale))
+        self.assertIsNone(jobs.claim_next_job('worker-b'))
+
+        # worker-a stopped heartbeating: once the timeout passes, worker-b takes over
+        self.make_claimable(job)
+        current = jobs.claim_next_job('worker-b')
+        self.assertEqual((current.id, current.attempts, current.locked_by), (job.id, 2, 'worker-b'))
+        self.assertFalse(jobs.extend_lease(stale))
+        jobs.run_job(stale)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), (AnalysisJob.STATUS_RUNNING, 'worker-b'))
+
+        # Lost more often than it may be attempted
+        self.make_claimable(job)
+        with self.assertLogs('api.jobs', 'ERROR'):
+            jobs.run_job(jobs.claim_next_job('worker-c'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, AnalysisJob.STATUS_FAILED)
+        self.assertIn('visibility timeout', job.oct_image.analysis_result.findings)
+
+    def test_heartbeat_extends_the_lease(self):
+        self.enqueue('P1')
+        job = jobs.claim_next_job('worker-a', visibility_timeout=0.3)
+        with mock.patch('api.jobs.extend_lease', return_value=True) as extend:
+            with jobs.lease_heartbeat(job, visibility_timeout=0.3):
+                time.sleep(0.35)
+        self.assertGreaterEqual(extend.call_count, 2)
+        extend.assert_called_with(job, 0.3)
+
+
+@override_settings(ANALYSIS_JOBS={'ASYNC': False})
+class ResultCacheTests(AnalysisTestCase):
+    def write_scan(self, name, image, **save_options):
+        path = os.path.join(self.media_root, name)
+        image.save(path, **save_options)
+        return path
+
+    def entry(self, category='Drusen'):
+        return {'category': category, 'confidence': 91.2, 'text': None, 'probabilities': {category: 0.912},
+                'heatmap': b'heatmap-png', 'overlay': b'overlay-png'}
+
+    def test_key_follows_decoded_pixels_and_model_version(self):
+        image = Image.linear_gradient('L').resize((64, 48))
+        original = self.write_scan('a.png', image)
+        # Same pixels under another name and compression level
+        reencoded = self.write_scan('b.png', image, compress_level=0)
+        changed = self.write_scan('c.png', image.point(lambda value: 255 - value))
+        key = self.analysis_cache.key_for_image(original)
+        self.assertEqual(self.analysis_cache.key_for_image(reencoded), key)
+        self.assertNotEqual(self.analysis_cache.key_for_image(changed), key)
+        retrained = AnalysisResultCache(self.analysis_cache.cache_dir, 'retrained-model')
+        self.assertNotEqual(retrained.key_for_image(original), key)
+
+    def test_memory_and_disk_tiers(self):
+        cache = AnalysisResultCache(tempfile.mkdtemp(dir=self.media_root), 'test-model', max_memory_entries=1)
+        cache.set('first', self.entry('Drusen'))
+        cache.set('second', self.entry('Normal'))
+        self.assertEqual(cache.get('second')['category'], 'Normal')
+        # Pushed out of memory, still on disk
+        self.assertEqual(cache.get('first'), self.entry('Drusen'))
+        self.assertEqual((cache.memory_hits, cache.disk_hits), (1, 1))
+        # A new process reads the disk tier
+        reopened = AnalysisResultCache(cache.cache_dir, 'test-model')
+        self.assertEqual(reopened.get('second'), self.entry('Normal'))
+        self.assertIsNone(reopened.get('missing'))
+
+    def test_disk_tier_evicts_least_recently_used(self):
+        cache = AnalysisResultCache(tempfile.mkdtemp(dir=self.media_root), 'test-model', max_memory_entries=1)
+        cache.set('old', self.entry())
+        entry_bytes = cache.stats()['disk_bytes']
+        cache.max_disk_bytes = int(entry_bytes * 2.5)
+        os.utime(cache._paths('old')[0], (0, 0))
+        cache.set('newer', self.entry())
+        cache.set('newest', self.entry())
+        reopened = AnalysisResultCache(cache.cache_dir, 'test-model')
+        self.assertIsNone(reopened.get('old'))
+        self.assertIsNotNone(reopened.get('newest'))
+        self.assertLessEqual(reopened.stats()['disk_bytes'], cache.max_disk_bytes)
+
+    def test_reupload_skips_the_model_service(self):
+        image = Image.linear_gradient('L').resize((64, 48))
+        for name, options in (('first.png', {}), ('renamed.png', {'compress_level': 0})):
+            buffer = io.BytesIO()
+            image.save(buffer, format='PNG', **options)
+            upload = SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+            response = self.client.post('/api/oct-images/', {'image_file': upload}, format='multipart')
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(self.model_service.calls), 1)
+        self.assertEqual(AnalysisResult.objects.filter(classification='Drusen').count(), 2)
+
+        self.assertEqual(self.client.get('/api/analysis-results/cache-stats/').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        with mock.patch('api.views.get_analysis_cache', return_value=self.analysis_cache):
+            stats = self.client.get('/api/analysis-results/cache-stats/').json()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+
+@override_settings(ANALYSIS_EXPLAIN_ON_UPLOAD=False, ANALYSIS_JOBS={'ASYNC': False})
+class LazyExplanationTests(AnalysisTestCase):
+    def upload(self, shade=90):
+        response = self.client.post('/api/oct-images/', {'image_file': self.scan_file('scan.png', shade)},
+                                    format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return OCTImage.objects.get(id=response.json()['id'])
+
+    def test_upload_stores_only_the_classification(self):
+        oct_image = self.upload()
+        self.assertEqual(self.model_service.calls, [('/predict', ['scan'], False)])
+        analysis = oct_image.analysis_result
+        self.assertEqual(analysis.classification, 'Drusen')
+        self.assertFalse(analysis.heatmap)
+        self.assertFalse(analysis.analysis_image)
+
+    def test_first_view_generates_the_explanation(self):
+        oct_image = self.upload()
+        data = self.client.get(f'/api/oct-images/{oct_image.id}/').json()
+        self.assertEqual(self.model_service.calls[-1], ('/predict', ['scan'], True))
+        self.assertIn('/overlay/', data['analysis_result']['analysis_image'])
+        self.assertTrue(AnalysisResult.objects.get(oct_image=oct_image).heatmap)
+        # Kept, so later views do not call the model service again
+        self.client.get(f'/api/analysis-results/{oct_image.analysis_result.id}/')
+        self.client.get(f'/api/analysis-results/by-image/{oct_image.id}/')
+        self.assertEqual(len(self.model_service.calls), 2)
+
+    def test_explain_action(self):
+        analysis = self.upload().analysis_result
+        response = self.client.post(f'/api/analysis-results/{analysis.id}/explain/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('/overlay/', response.json()['analysis_image'])
+        analysis.refresh_from_db()
+        self.assertTrue(analysis.heatmap)
+
+    def test_unavailable_model_service_retries_on_next_view(self):
+        analysis = self.upload().analysis_result
+        self.model_service.status_code = 503
+        with self.assertLogs('api.analysis', 'WARNING'):
+            response = self.client.get(f'/api/analysis-results/{analysis.id}/')
+        self.assertEqual((response.status_code, response.json()['analysis_image']), (200, None))
+        self.model_service.status_code = 200
+        self.assertIn('/overlay/', self.client.get(f'/api/analysis-results/{analysis.id}/').json()['analysis_image'])
+
+    def test_cache_entry_is_upgraded_with_the_heatmap(self):
+        oct_image = self.upload()
+        key = self.analysis_cache.key_for_image(oct_image.image_file.path)
+        self.assertIsNone(self.analysis_cache.get(key)['heatmap'])
+        # A re-upload of the same scan reuses the classification-only entry
+        self.upload()
+        self.assertEqual(len(self.model_service.calls), 1)
+
+        self.client.post(f'/api/analysis-results/{oct_image.analysis_result.id}/explain/')
+        self.assertTrue(self.analysis_cache.get(key)['heatmap'])
+        # Explained uploads of the same scan are now served from the cache
+        with override_settings(ANALYSIS_EXPLAIN_ON_UPLOAD=True):
+            self.assertTrue(self.upload().analysis_result.heatmap)
+        self.assertEqual(len(self.model_service.calls), 2)
+
+
+class DerivativeTests(AnalysisTestCase):
+    def create_scan(self, image):
+        oct_image = OCTImage(doctor=self.doctor)
+        oct_image.image_file.save('scan.png', ContentFile(png_bytes(image)), save=True)
+        return oct_image
+
+    def test_listing_never_generates_variants(self):
+        oct_image = self.create_scan(Image.new('L', (800, 600), 90))
+        storage, name = oct_image.image_file.storage, oct_image.image_file.name
+        row = self.client.get('/api/oct-images/').json()['results'][0]
+        # Missing variants fall back to the original until the backfill writes them
+        self.assertTrue(row['image_thumbnail'].endswith(oct_image.image_file.url))
+        self.assertFalse(storage.exists(derivative_name(name, 'thumb')))
+
+        self.assertEqual(generate_derivatives(oct_image.image_file), 2)
+        row = self.client.get('/api/oct-images/').json()['results'][0]
+        self.assertTrue(row['image_thumbnail'].endswith(storage.url(derivative_name(name, 'thumb'))))
+        self.assertTrue(row['image_preview'].endswith('.preview.webp'))
+
+    def test_16_bit_scans_are_scaled(self):
+        oct_image = self.create_scan(Image.new('I;16', (320, 240), 40000))
+        generate_derivatives(oct_image.image_file)
+        storage = oct_image.image_file.storage
+        with storage.open(derivative_name(oct_image.image_file.name, 'thumb')) as f, Image.open(f) as thumb:
+            self.assertEqual(thumb.size, (160, 120))
+            # 40000 / 256, not clipped to white
+            self.assertAlmostEqual(thumb.convert('L').getpixel((80, 60)), 156, delta=2)
+
+
+class OverlayTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root))
+        get_overlay_cache().clear()
+        self.user = User.objects.create_user('doctor', password='secret')
+        self.doctor = Doctor.objects.create(user=self.user)
+        oct_image = OCTImage(doctor=self.doctor)
+        oct_image.image_file.save('scan.png', ContentFile(png_bytes(Image.new('L', (300, 200), 90))), save=True)
+        self.analysis = AnalysisResult.objects.create(
+            oct_image=oct_image,
+            classification='Drusen',
+            findings='Predicted Condition: Drusen (Confidence: 90.00%)',
+            heatmap=png_bytes(Image.linear_gradient('L').resize((7, 7))),
+            probabilities={'Drusen': 0.9, 'Normal': 0.1},
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_signed_overlay_url(self):
+        data = self.client.get(f'/api/analysis-results/{self.analysis.id}/').json()
+        self.assertEqual(data['probabilities'], {'Drusen': 0.9, 'Normal': 0.1})
+        # <img> tags send no token; the signature in the URL stands in for it
+        anonymous = APIClient()
+        response = anonymous.get(data['analysis_image'])
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'image/png'))
+        self.assertEqual(Image.open(io.BytesIO(response.content)).size, (300, 200))
+
+        response = anonymous.get(data['analysis_thumbnail'])
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(Image.open(io.BytesIO(response.content)).size, (160, 107))
+
+        url = f'/api/analysis-results/{self.analysis.id}/overlay/'
+        self.assertEqual(anonymous.get(url).status_code, 401)
+        self.assertEqual(anonymous.get(url, {'sig': 'forged'}).status_code, 401)
+        # Signed URLs expire; the signature alone is not a lasting credential
+        with mock.patch('time.time', return_value=time.time() + 2 * 3600):
+            self.assertEqual(anonymous.get(data['analysis_image']).status_code, 401)
+        # Nor does it open another result
+        other = AnalysisResult.objects.create(oct_image=OCTImage.objects.create(doctor=self.doctor, image_file='x.png'),
+                                              classification='Normal', heatmap=self.analysis.heatmap)
+        signature = data['analysis_image'].split('sig=')[1]
+        self.assertEqual(anonymous.get(f'/api/analysis-results/{other.id}/overlay/?sig={signature}').status_code, 401)
+
+    def test_render_options_and_cache(self):
+        url = f'/api/analysis-results/{self.analysis.id}/overlay/'
+        params = {'alpha': 0.7, 'colormap': 'viridis', 'image_format': 'jpeg', 'quality': 60, 'size': 150}
+        first = self.client.get(url, params)
+        self.assertEqual((first.status_code, first['Content-Type']), (200, 'image/jpeg'))
+        self.assertEqual(Image.open(io.BytesIO(first.content)).size, (150, 100))
+        second = self.client.get(url, params)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(get_overlay_cache().stats()['hits'], 1)
+        self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        self.assertEqual(self.client.get(url, {'colormap': 'rainbow'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'alpha': 2}).status_code, 400)
+        other = User.objects.create_user('other')
+        Doctor.objects.create(user=other)
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root))
+        self.user = User.objects.create_user('doctor')
+        self.doctor = Doctor.objects.create(user=self.user)
+        self.analysed = self.create_record(self.doctor, 'P1')
+        self.analysis = AnalysisResult.objects.create(
+            oct_image=self.analysed, classification='Drusen', confidence=91.2,
+            probabilities={'Drusen': 0.912, 'Normal': 0.088}, findings='', findings_version=CURRENT_VERSION,
+            heatmap=png_bytes(Image.linear_gradient('L').resize((7, 7))),
+        )
+        self.pending = self.create_record(self.doctor, 'P2')
+        self.create_record(Doctor.objects.create(user=User.objects.create_user('other')), 'X1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_record(self, doctor, custom_id):
+        oct_image = OCTImage(doctor=doctor, custom_id=custom_id)
+        oct_image.image_file.save('scan.png', ContentFile(png_bytes(Image.new('L', (64, 48), 90))), save=True)
+        return oct_image
+
+    def export(self, **params):
+        response = self.client.get('/api/oct-images/export/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv_and_ndjson(self):
+        rows = list(csv.DictReader(io.StringIO(self.export().decode())))
+        self.assertEqual([row['custom_id'] for row in rows], ['P1', 'P2'])
+        self.assertEqual(rows[0]['findings'], render_findings('Drusen', 91.2))
+        self.assertEqual(json.loads(rows[0]['probabilities']), {'Drusen': 0.912, 'Normal': 0.088})
+        self.assertEqual(rows[1]['classification'], '')
+
+        records = [json.loads(line) for line in self.export(export_format='ndjson').splitlines()]
+        self.assertEqual((records[0]['analysis_id'], records[0]['confidence']), (str(self.analysis.id), 91.2))
+        self.assertIsNone(records[1]['analysis_id'])
+
+    def test_zip_with_images(self):
+        archive = zipfile.ZipFile(io.BytesIO(self.export(export_format='zip')))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(sorted(archive.namelist()), sorted([
+            f'images/{self.analysed.id}.png', f'images/{self.pending.id}.png', f'overlays/{self.analysed.id}.png',
+            'records.csv',
+        ]))
+        self.assertEqual(Image.open(archive.open(f'overlays/{self.analysed.id}.png')).size, (64, 48))
+        self.assertNotIn('overlays/', ''.join(
+            zipfile.ZipFile(io.BytesIO(self.export(export_format='zip', overlays=0))).namelist()))
+
+    def test_other_doctors_need_staff(self):
+        other = Doctor.objects.get(user__username='other')
+        self.assertEqual(self.client.get('/api/oct-images/export/', {'doctor': other.id}).status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        rows = list(csv.DictReader(io.StringIO(self.export(doctor=other.id).decode())))
+        self.assertEqual([row['custom_id'] for row in rows], ['X1'])
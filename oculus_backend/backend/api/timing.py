@@ -0,0 +1,248 @@
+"""Per-request time breakdown, sent as ``Server-Timing`` and aggregated per route.
+
+``RequestTimingMiddleware`` opens a ``RequestTiming`` for every request.
+Database queries, model service calls, media storage I/O and serialization
+each add to their phase. Phases are exclusive: a query that runs while a
+serializer walks a relation counts as ``db``, not ``serialize``. Whatever no
+phase claims is reported as ``app``. Work done outside a request (analysis
+jobs, management commands) is not timed.
+
+The phases reveal internals such as cache hits, so only authenticated
+requests get them; anonymous ones see ``total`` alone. The React frontend
+runs on another origin: requests from one of ``ALLOW_ORIGINS`` (by default
+``CORS_ALLOWED_ORIGINS``) get ``Timing-Allow-Origin`` for the browser's
+resource timing API, and ``Server-Timing`` is listed in
+``CORS_EXPOSE_HEADERS`` so scripts can read it.
+
+Staff can read the rolling per-route aggregate at
+``/api/analysis-results/request-timing/``.
+"""
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+
+# ``derivatives`` is thumbnail/preview encoding (api/derivatives.py), minus its storage writes
+PHASES = ('db', 'model', 'storage', 'derivatives', 'serialize')
+
+_current = ContextVar('request_timing', default=None)
+
+
+def timing_settings():
+    return {
+        'ENABLED': True,
+        'WINDOW': 500,
+        'ALLOW_ORIGINS': getattr(settings, 'CORS_ALLOWED_ORIGINS', []),
+        **getattr(settings, 'REQUEST_TIMING', {}),
+    }
+
+
+class RequestTiming:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.total = None
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.counts = dict.fromkeys(PHASES, 0)
+        # Open phases, innermost last: [phase, start, seconds claimed by nested phases]
+        self._stack = []
+
+    def enter(self, phase):
+        if any(open_phase[0] == phase for open_phase in self._stack):
+            # Already inside this phase (storage.save calling exists, nested serializers)
+            return False
+        self._stack.append([phase, time.perf_counter(), 0.0])
+        return True
+
+    def exit(self):
+        phase, start, nested = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        self.seconds[phase] += elapsed - nested
+        self.counts[phase] += 1
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def add(self, phase, seconds):
+        """Record time measured elsewhere (a render callback) as a top-level phase."""
+        self.seconds[phase] += seconds
+        self.counts[phase] += 1
+
+    def finish(self):
+        self.total = time.perf_counter() - self.start
+
+    @property
+    def app(self):
+        return max(self.total - sum(self.seconds.values()), 0.0)
+
+    def header(self, phases=True):
+        metrics = []
+        if phases:
+            for phase in PHASES:
+                if self.counts[phase]:
+                    metrics.append(f'{phase};dur={self.seconds[phase] * 1000:.1f};desc="{self.counts[phase]} calls"')
+            metrics.append(f'app;dur={self.app * 1000:.1f}')
+        metrics.append(f'total;dur={self.total * 1000:.1f}')
+        return ', '.join(metrics)
+
+
+@contextmanager
+def timed(phase):
+    """Count the enclosed block towards ``phase`` of the current request, if any."""
+    timing = _current.get()
+    if timing is None or not timing.enter(phase):
+        yield
+        return
+    try:
+        yield
+    finally:
+        timing.exit()
+
+
+def _time_query(execute, sql, params, many, context):
+    with timed('db'):
+        return execute(sql, params, many, context)
+
+
+class TimedFileSystemStorage(FileSystemStorage):
+    """``FileSystemStorage`` that counts its I/O towards the ``storage`` phase.
+
+    ``open`` is timed until the file object is returned; reading it happens
+    in the caller.
+    """
+
+    def _save(self, name, content):
+        with timed('storage'):
+            return super()._save(name, content)
+
+    def _open(self, name, mode='rb'):
+        with timed('storage'):
+            return super()._open(name, mode)
+
+    def delete(self, name):
+        with timed('storage'):
+            return super().delete(name)
+
+    def exists(self, name):
+        with timed('storage'):
+            return super().exists(name)
+
+    def size(self, name):
+        with timed('storage'):
+            return super().size(name)
+
+
+class TimedSerializerMixin:
+    """Counts ``to_representation`` towards the ``serialize`` phase."""
+
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super().to_representation(instance)
+
+
+class TimingAggregate:
+    """The last ``window`` timings of each route, summarised on demand."""
+
+    def __init__(self, window=500):
+        self.window = window
+        self._routes = defaultdict(lambda: deque(maxlen=self.window))
+        self._lock = threading.Lock()
+
+    def record(self, route, timing):
+        sample = (timing.total, timing.app, tuple(timing.seconds[p] for p in PHASES),
+                  tuple(timing.counts[p] for p in PHASES))
+        with self._lock:
+            self._routes[route].append(sample)
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+    def stats(self):
+        with self._lock:
+            routes = {route: list(samples) for route, samples in self._routes.items()}
+        summary = {}
+        for route, samples in sorted(routes.items()):
+            n = len(samples)
+            totals = sorted(sample[0] for sample in samples)
+            phases = {
+                phase: {
+                    'mean_ms': sum(sample[2][i] for sample in samples) / n * 1000,
+                    'mean_count': sum(sample[3][i] for sample in samples) / n,
+                }
+                for i, phase in enumerate(PHASES)
+            }
+            phases['app'] = {'mean_ms': sum(sample[1] for sample in samples) / n * 1000}
+            summary[route] = {
+                'requests': n,
+                'mean_ms': sum(totals) / n * 1000,
+                'p50_ms': totals[n // 2] * 1000,
+                'p95_ms': totals[min(int(n * 0.95), n - 1)] * 1000,
+                'phases': phases,
+            }
+        return {'window': self.window, 'routes': summary}
+
+
+_aggregate = None
+_aggregate_lock = threading.Lock()
+
+
+def get_timing_aggregate():
+    global _aggregate
+    if _aggregate is None:
+        with _aggregate_lock:
+            if _aggregate is None:
+                _aggregate = TimingAggregate(timing_settings()['WINDOW'])
+    return _aggregate
+
+
+def _route(request):
+    match = request.resolver_match
+    # Router routes are regexes; drop their anchors
+    route = match.route.replace('^', '').replace('$', '') if match else '<unresolved>'
+    return f"{request.method} /{route}"
+
+
+class RequestTimingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = timing_settings()
+        self.enabled = config['ENABLED']
+        self.allow_origins = set(config['ALLOW_ORIGINS'])
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        timing = RequestTiming()
+        token = _current.set(timing)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_time_query))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        timing.finish()
+        # DRF copies the token-authenticated user back onto the Django request
+        user = getattr(request, 'user', None)
+        response['Server-Timing'] = timing.header(phases=bool(user and user.is_authenticated))
+        origin = request.headers.get('Origin')
+        if origin in self.allow_origins:
+            response['Timing-Allow-Origin'] = origin
+            patch_vary_headers(response, ['Origin'])
+        get_timing_aggregate().record(_route(request), timing)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered to JSON after the view returns
+        timing = _current.get()
+        if timing is not None:
+            start = time.perf_counter()
+            response.add_post_render_callback(lambda _: timing.add('serialize', time.perf_counter() - start))
+        return response
@@ -1,8 +1,9 @@
-import requests
-import base64
-from tempfile import NamedTemporaryFile 
-from django.core.files import File
 # Django + DRF
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils import timezone
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import User
 
@@ -15,16 +16,24 @@ from django_filters.rest_framework import DjangoFilterBackend
 
 # Simple JWT
 from rest_framework_simplejwt.views import TokenObtainPairView
-from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 
 # Your App Models and Serializers
-from .models import Doctor, OCTImage, AnalysisResult, Review
+from .models import Doctor, OCTImage, AnalysisResult, AnalysisJob, Review
+from .authentication import get_profile_cache
+from .analysis import analyze_oct_image, analyze_oct_images, ensure_explanation
+from .export import EXPORT_FORMATS, export_rows, stream_csv, stream_ndjson, stream_zip
+from .jobs import enqueue_analysis, job_settings
+from .model_client import get_model_client
+from .overlays import get_rendered_overlay, has_valid_signature, overlay_options
+from .pagination import RecordCursorPagination
+from .result_cache import get_analysis_cache
+from .timing import get_timing_aggregate
 from .serializers import (
     DoctorSignupSerializer, DoctorProfileSerializer, DoctorCompleteSerializer,
     CustomTokenObtainPairSerializer, OCTImageSerializer, OCTImageCreateSerializer,
-    OCTImageDetailSerializer, AnalysisResultSerializer, AnalysisResultDetailSerializer,
-    ReviewSerializer, ReviewCreateSerializer, PublicReviewSerializer
+    OCTImageDetailSerializer, AnalysisResultSerializer, AnalysisResultListSerializer, AnalysisResultDetailSerializer,
+    ReviewSerializer, ReviewCreateSerializer, PublicReviewSerializer, AnalysisJobSerializer
 )
 
 
@@ -44,7 +53,7 @@ class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
 
 class DoctorViewSet(viewsets.ModelViewSet):
-    queryset = Doctor.objects.all()
+    queryset = Doctor.objects.select_related('user')
     parser_classes = (JSONParser, MultiPartParser, FormParser)
     
     def get_permissions(self):
@@ -66,8 +75,8 @@ class DoctorViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
-        refresh = RefreshToken.for_user(user)
-        doctor = Doctor.objects.get(user=user)
+        refresh = CustomTokenObtainPairSerializer.get_token(user)
+        doctor = user.doctor
         profile_picture_url = doctor.profile_picture.url if doctor.profile_picture else None
         return Response({
             'refresh': str(refresh),
@@ -91,15 +100,15 @@ class DoctorViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def me(self, request):
-        doctor = Doctor.objects.get(user=request.user)
-        serializer = DoctorCompleteSerializer(doctor)
+        serializer = DoctorCompleteSerializer(request.user.doctor)
         return Response(serializer.data)
     
     @action(detail=False, methods=['put', 'patch'], permission_classes=[IsAuthenticated])
     def update_profile(self, request):
-        user = request.user
         try:
-            doctor = Doctor.objects.get(user=user)
+            # Saved back below, so load the full rows rather than the token-built request.user
+            doctor = Doctor.objects.select_related('user').get(user_id=request.user.id)
+            user = doctor.user
             
             # Print received data for debugging
             print("Received data:", request.data)
@@ -119,13 +128,12 @@ class DoctorViewSet(viewsets.ModelViewSet):
             serializer.save()
             
             # Update user fields if present
-            if 'first_name' in request.data:
-                user.first_name = request.data['first_name']
-            if 'last_name' in request.data:
-                user.last_name = request.data['last_name'] 
-            if 'email' in request.data:
-                user.email = request.data['email']
-            user.save()
+            user_fields = [field for field in ('first_name', 'last_name', 'email') if field in request.data]
+            for field in user_fields:
+                setattr(user, field, request.data[field])
+            if user_fields:
+                user.save(update_fields=user_fields)
+            get_profile_cache().invalidate(user.id)
             
             # Return complete updated data
             return Response(DoctorCompleteSerializer(doctor).data)
@@ -139,62 +147,17 @@ class DoctorViewSet(viewsets.ModelViewSet):
 
 
 
-def run_ai_analysis(image_path):
-    try:
-        api_url = "http://localhost:5000/predict"
-        with open(image_path, "rb") as img_file:
-            img_data = base64.b64encode(img_file.read()).decode('utf-8')
-
-        payload = {"image_data": img_data}
-        response = requests.post(api_url, json=payload)
-
-        if response.status_code == 200:
-            result = response.json()
-            if not result.get("analyzed_image"):
-                print("Flask response missing analyzed image:", result)
-                return {
-                    'category': 'error',
-                    'text': result.get('text', 'No analyzed image returned'),
-                    'image_path': image_path
-                }
-
-            analyzed_img_data = base64.b64decode(result["analyzed_image"])
-            temp_img = NamedTemporaryFile(delete=False, suffix='.png')
-            temp_img.write(analyzed_img_data)
-            temp_img.flush()
-            temp_img.close()
-
-            return {
-                'category': result["category"],
-                'text': result["text"],
-                'image_path': temp_img.name
-            }
-
-        print(f"API failed: {response.status_code}, {response.text}")
-        return {
-            'category': 'error',
-            'text': f'API returned error {response.status_code}: {response.text}',
-            'image_path': image_path
-        }
-
-    except Exception as e:
-        print(f"Exception in run_ai_analysis: {str(e)}")
-        return {
-            'category': 'error',
-            'text': f'Exception: {str(e)}',
-            'image_path': image_path
-        }
-
-
 class OCTImageViewSet(viewsets.ModelViewSet):
     queryset = OCTImage.objects.all()
     parser_classes = (MultiPartParser, FormParser, JSONParser)
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['custom_id']
+    search_fields = ['custom_id', 'id']
     ordering_fields = ['upload_date']
+    ordering = ['-upload_date']
+    pagination_class = RecordCursorPagination
     
     def get_permissions(self):
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'export']:
             return [permissions.IsAuthenticated()]
         return [permissions.IsAuthenticated(), IsOwnerOrReadOnly()]
     
@@ -207,79 +170,243 @@ class OCTImageViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         if self.request.user.is_authenticated:
-            doctor = Doctor.objects.get(user=self.request.user)
-            return OCTImage.objects.filter(doctor=doctor)
+            queryset = OCTImage.objects.filter(doctor__user=self.request.user)
+            if self.action == 'list':
+                return queryset
+            # Detail serializer and IsOwnerOrReadOnly walk doctor -> user and the analysis result
+            return queryset.select_related('doctor__user', 'analysis_result')
         return OCTImage.objects.none()
 
+    def retrieve(self, request, *args, **kwargs):
+        oct_image = self.get_object()
+        analysis_result = getattr(oct_image, 'analysis_result', None)
+        if analysis_result is not None:
+            # Opening a scan in detail is what pays for its Grad-CAM overlay
+            ensure_explanation(analysis_result)
+        return Response(self.get_serializer(oct_image).data)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        if self.job is None:
+            return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+        # Analysis runs in the background; poll the job for its outcome
+        data = dict(serializer.data)
+        data['job'] = AnalysisJobSerializer(self.job).data
+        return Response(data, status=status.HTTP_202_ACCEPTED, headers=headers)
+
     def perform_create(self, serializer):
-        doctor = Doctor.objects.get(user=self.request.user)
-        oct_image = serializer.save(doctor=doctor)
-        
-        # Call AI model for analysis and create AnalysisResult
-        ai_result = run_ai_analysis(oct_image.image_file.path)
-        analysis_result = AnalysisResult.objects.create(
-            oct_image=oct_image,
-            
-            classification=ai_result['category'],
-            findings=ai_result['text'],
-        )
+        oct_image = serializer.save(doctor=self.request.user.doctor)
 
-        if ai_result.get('image_path'):
-            # Open the file explicitly and save it
-            with open(ai_result['image_path'], 'rb') as f:
-                analysis_result.analysis_image.save(
-                    f"processed_{oct_image.id}.png",
-                    File(f),
-                    save=True
-                )
-            
-            # Clean up temporary file if it was created by us
-            if ai_result['image_path'] != oct_image.image_file.path:
-                try:
-                    os.remove(ai_result['image_path'])
-                except:
-                    pass
+        self.job = None
+        if job_settings()['ASYNC']:
+            self.job = enqueue_analysis(oct_image)
+        else:
+            analyze_oct_image(oct_image)
 
         # Ensure the response contains `id`
         self.response = OCTImageDetailSerializer(oct_image).data
 
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        """Upload a session of B-scans (repeated ``image_files`` fields, optional
+        parallel ``custom_ids``) and analyse them as one batch."""
+        files = request.FILES.getlist('image_files')
+        if not files:
+            return Response({'error': 'No image_files uploaded.'}, status=status.HTTP_400_BAD_REQUEST)
+        custom_ids = request.data.getlist('custom_ids') if hasattr(request.data, 'getlist') else []
+
+        doctor = request.user.doctor
+        items = []
+        oct_images = []
+        for index, image_file in enumerate(files):
+            item = {'index': index, 'file_name': image_file.name}
+            items.append(item)
+            data = {'image_file': image_file}
+            if index < len(custom_ids) and custom_ids[index]:
+                data['custom_id'] = custom_ids[index]
+            serializer = OCTImageCreateSerializer(data=data)
+            if not serializer.is_valid():
+                item.update(status='invalid', errors=serializer.errors)
+                continue
+            oct_image = OCTImage(doctor=doctor, **serializer.validated_data)
+            item['oct_image'] = oct_image
+            oct_images.append(oct_image)
+
+        if oct_images:
+            with transaction.atomic():
+                OCTImage.objects.bulk_create(oct_images)
+            analyses = dict(zip((o.id for o in oct_images), analyze_oct_images(oct_images)))
+
+        for item in items:
+            oct_image = item.pop('oct_image', None)
+            if oct_image is None:
+                continue
+            analysis_result, ai_result = analyses[oct_image.id]
+            item['oct_image'] = OCTImageSerializer(oct_image, context={'request': request}).data
+            item['analysis_result'] = AnalysisResultSerializer(analysis_result, context={'request': request}).data
+            if ai_result['category'] == 'error':
+                item.update(status='failed', errors={'analysis': ai_result['text']})
+            else:
+                item['status'] = 'done'
+
+        all_done = all(item['status'] == 'done' for item in items)
+        return Response(
+            {'results': items},
+            status=status.HTTP_201_CREATED if all_done else status.HTTP_207_MULTI_STATUS
+        )
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream every record with its analysis as ``?export_format=`` csv, ndjson or zip (scans and
+        overlays included; ``overlays=0`` leaves the overlays out). Staff may pass ``doctor=<id>``."""
+        export_format = request.query_params.get('export_format', 'csv').lower()
+        if export_format not in EXPORT_FORMATS:
+            return Response({'error': f"export_format must be one of {', '.join(EXPORT_FORMATS)}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        doctor_id = request.query_params.get('doctor')
+        if doctor_id:
+            if not request.user.is_staff:
+                return Response({'error': 'Only staff can export another doctor\'s records.'},
+                                status=status.HTTP_403_FORBIDDEN)
+            if not doctor_id.isdigit():
+                return Response({'error': 'doctor must be a doctor id.'}, status=status.HTTP_400_BAD_REQUEST)
+            doctor = get_object_or_404(Doctor.objects.select_related('user'), pk=doctor_id)
+        else:
+            doctor = request.user.doctor
+
+        if export_format == 'zip':
+            include_overlays = request.query_params.get('overlays', '1').lower() not in ('0', 'false', 'no')
+            storage = OCTImage._meta.get_field('image_file').storage
+            body = stream_zip(doctor, storage, include_overlays=include_overlays)
+        else:
+            body = (stream_csv if export_format == 'csv' else stream_ndjson)(export_rows(doctor))
+        response = StreamingHttpResponse(body, content_type=EXPORT_FORMATS[export_format])
+        filename = f"oculus-records-{doctor.user.username}-{timezone.now():%Y%m%d}.{export_format}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
 class AnalysisResultViewSet(viewsets.ModelViewSet):
     queryset = AnalysisResult.objects.all()
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filterset_fields = {'oct_image': ['exact'], 'classification': ['exact'], 'confidence': ['gte', 'lte']}
     search_fields = ['classification']
-    ordering_fields = ['analysis_date']
+    # Sort by confidence with ?ordering=-confidence_rank: the cursor needs a
+    # non-null position, so results without a confidence rank as -1.
+    ordering_fields = ['analysis_date', 'confidence_rank', 'id']
+    ordering = ['-analysis_date', '-id']
+    pagination_class = RecordCursorPagination
     
     def get_permissions(self):
-        if self.action in ['list', 'retrieve', 'by_image']:
+        if self.action in ['cache_stats', 'model_service_stats', 'request_timing']:
+            # The action's IsAdminUser would otherwise be replaced below
+            return [permissions.IsAuthenticated(), IsAdminUser()]
+        if self.action == 'overlay':
+            # Signed URLs stand in for the token, since <img> tags cannot send one
+            return [AllowAny()]
+        if self.action in ['list', 'retrieve', 'by_image', 'job_status', 'explain']:
             return [permissions.IsAuthenticated()]
         return [permissions.IsAuthenticated(), IsOwnerOrReadOnly()]
     
     def get_serializer_class(self):
-        if self.action == 'retrieve' or self.action == 'by_image':
+        if self.action in ['retrieve', 'by_image', 'explain']:
             return AnalysisResultDetailSerializer
+        if self.action == 'list':
+            return AnalysisResultListSerializer
         return AnalysisResultSerializer
 
     def get_queryset(self):
         if self.request.user.is_authenticated:
-            doctor = Doctor.objects.get(user=self.request.user)
-            return AnalysisResult.objects.filter(oct_image__doctor=doctor)
+            queryset = AnalysisResult.objects.filter(oct_image__doctor__user=self.request.user).annotate(
+                confidence_rank=Coalesce('confidence', Value(-1.0)))
+            if self.action == 'list':
+                return queryset
+            # The detail serializer nests oct_image -> doctor -> user; select_related
+            # also fills oct_image.analysis_result back in, so nothing is re-fetched.
+            return queryset.select_related('oct_image__doctor__user')
         return AnalysisResult.objects.none()
 
+    def retrieve(self, request, *args, **kwargs):
+        analysis = ensure_explanation(self.get_object())
+        return Response(self.get_serializer(analysis).data)
+
+    @action(detail=True, methods=['post'])
+    def explain(self, request, pk=None):
+        """Generate the Grad-CAM overlay of a classification-only result now."""
+        analysis = ensure_explanation(self.get_object())
+        return Response(self.get_serializer(analysis).data)
+
+    @action(detail=True, methods=['get'])
+    def overlay(self, request, pk=None):
+        """Render the Grad-CAM overlay from the stored heatmap.
+
+        Takes ``alpha``, ``colormap``, ``image_format`` (png, webp, jpeg),
+        ``quality`` and ``size`` (longest side); see api/overlays.py. Open to
+        the owner, or to anyone with the ``sig`` the serializers put in the URL
+        until it expires (``URL_MAX_AGE``).
+        """
+        signature = request.query_params.get('sig')
+        if signature and has_valid_signature(pk, signature):
+            analysis = get_object_or_404(AnalysisResult.objects.select_related('oct_image'), pk=pk)
+        elif request.user.is_authenticated:
+            analysis = self.get_object()
+        else:
+            return Response({'error': 'Authentication or an unexpired signed overlay URL is required.'},
+                            status=status.HTTP_401_UNAUTHORIZED)
+        if not analysis.heatmap:
+            return Response({'error': 'No heatmap is stored for this result; see analysis_image.'}, status=404)
+        try:
+            options = overlay_options(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+
+        data, content_type, etag = get_rendered_overlay(analysis, options)
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(data, content_type=content_type)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=86400'
+        return response
+
     @action(detail=False, methods=['get'], url_path='by-image/(?P<oct_image_id>[0-9a-f-]+)', permission_classes=[IsAuthenticated])
     def by_image(self, request, oct_image_id=None):
-        doctor = Doctor.objects.get(user=request.user)
         try:
-            analysis = AnalysisResult.objects.get(oct_image__id=oct_image_id, oct_image__doctor=doctor)
+            analysis = self.get_queryset().get(oct_image__id=oct_image_id)
+            ensure_explanation(analysis)
             serializer = self.get_serializer(analysis)
             return Response(serializer.data)
         except AnalysisResult.DoesNotExist:
             return Response({'error': 'Analysis result not found for this image.'}, status=404)
+
+    @action(detail=False, methods=['get'], url_path='jobs/(?P<job_id>[0-9a-f-]+)', permission_classes=[IsAuthenticated])
+    def job_status(self, request, job_id=None):
+        job = get_object_or_404(AnalysisJob, id=job_id, oct_image__doctor=request.user.doctor)
+        return Response(AnalysisJobSerializer(job).data)
+
+    @action(detail=False, methods=['get'], url_path='cache-stats', permission_classes=[IsAdminUser])
+    def cache_stats(self, request):
+        return Response(get_analysis_cache().stats())
+
+    @action(detail=False, methods=['get'], url_path='model-service-stats', permission_classes=[IsAdminUser])
+    def model_service_stats(self, request):
+        return Response(get_model_client().stats())
+
+    @action(detail=False, methods=['get'], url_path='request-timing', permission_classes=[IsAdminUser])
+    def request_timing(self, request):
+        return Response(get_timing_aggregate().stats())
         
 class ReviewViewSet(viewsets.ModelViewSet):
-    queryset = Review.objects.all().order_by('-review_date')
+    # ReviewSerializer and IsOwnerOrReadOnly both read doctor.user
+    queryset = Review.objects.select_related('doctor__user')
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['analysis_result']
     ordering_fields = ['review_date', 'rating']
+    ordering = ['-review_date']
+    pagination_class = RecordCursorPagination
     permission_classes = [IsOwnerOrReadOnly]
 
     def get_serializer_class(self):
@@ -22,6 +22,12 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+STORAGES = {
+    # Media I/O shows up as the `storage` phase of Server-Timing (api/timing.py)
+    'default': {'BACKEND': 'api.timing.TimedFileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
 
 # Application definition
 
@@ -47,7 +53,8 @@ AUTH_USER_MODEL = 'auth.User'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # Resolves request.user and its doctor from the token claims or a short-lived cache
+        'api.authentication.DoctorJWTAuthentication',
     ),
     # NEW: Add parser classes to handle different types of request data
     'DEFAULT_PARSER_CLASSES': [
@@ -93,7 +100,7 @@ SIMPLE_JWT = {
 # Add these comprehensive CORS settings
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
-CORS_EXPOSE_HEADERS = ['Content-Type', 'X-CSRFToken']
+CORS_EXPOSE_HEADERS = ['Content-Type', 'X-CSRFToken', 'Server-Timing']
 CORS_ALLOW_HEADERS = [
     'accept',
     'accept-encoding',
@@ -125,6 +132,8 @@ SESSION_COOKIE_HTTPONLY = False                     # Prevent JavaScript access
 SESSION_COOKIE_SAMESITE = 'Lax'
 
 MIDDLEWARE = [
+    # First, so its Server-Timing total covers the rest of the stack
+    'api.timing.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # Move this line up
@@ -207,3 +216,78 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# AI model service
+# Bump AI_MODEL_VERSION whenever retinal_model.h5 changes so cached results are not reused.
+AI_MODEL_VERSION = os.environ.get('AI_MODEL_VERSION', 'retinal_model.h5')
+
+# Model service replicas, comma separated in AI_MODEL_SERVICE_URLS
+AI_MODEL_SERVICE = {
+    'URLS': os.environ.get('AI_MODEL_SERVICE_URLS', 'http://localhost:5000').split(','),
+    'CONNECT_TIMEOUT': 2.0,
+    'READ_TIMEOUT': 60.0,
+    'BATCH_READ_TIMEOUT': 300.0,
+    'POOL_SIZE': 10,                  # keep-alive connections per replica
+    'HEALTH_CHECK_INTERVAL': 5.0,     # seconds between /health probes
+    'EJECT_AFTER_FAILURES': 3,        # consecutive failures before a replica is ejected
+    'EJECT_SECONDS': 30.0,
+    'HEDGE_AFTER': 5.0,               # seconds before a duplicate goes to another replica
+    'MAX_HEDGES': 1,
+    'BREAKER_FAILURE_THRESHOLD': 5,   # consecutive failed requests before failing fast
+    'BREAKER_RESET_TIMEOUT': 30.0,
+}
+
+# Content-addressed cache of model results for re-uploaded scans
+ANALYSIS_CACHE = {
+    'DIR': BASE_DIR / 'analysis_cache',
+    'MAX_MEMORY_ENTRIES': 128,
+    'MAX_DISK_BYTES': 512 * 1024 * 1024,
+}
+
+# Background analysis jobs (run workers with `python manage.py run_analysis_workers`)
+ANALYSIS_JOBS = {
+    'ASYNC': True,              # False analyses inside the upload request, as before
+    'MAX_ATTEMPTS': 3,
+    'VISIBILITY_TIMEOUT': 120,  # seconds a claimed job stays hidden; its worker's heartbeat extends it
+    'RETRY_BACKOFF': 5,         # seconds, doubled on every retry
+    'POLL_INTERVAL': 0.5,
+}
+
+# False stores only the classification on upload (forward pass only); the Grad-CAM
+# overlay is generated the first time the result is opened, then kept.
+ANALYSIS_EXPLAIN_ON_UPLOAD = os.environ.get('ANALYSIS_EXPLAIN_ON_UPLOAD', 'true').lower() != 'false'
+
+# Request-scoped user/doctor resolution (api.authentication.DoctorJWTAuthentication)
+AUTH_PROFILE_CACHE = {
+    'CACHE_TTL': 60.0,       # seconds a resolved user/doctor pair is reused by a process
+    'CLAIMS_MAX_AGE': 300,   # seconds after issue the token's profile claim is trusted; also how long
+                             # deactivation or staff revocation can take to reach issued tokens
+}
+
+# Downscaled variants of scans and overlays, stored next to the originals (api/derivatives.py)
+IMAGE_DERIVATIVES = {
+    'FORMAT': 'WEBP',                           # or 'JPEG'
+    'QUALITY': 80,
+    'SIZES': {'thumb': 160, 'preview': 640},    # longest side in pixels
+}
+
+# Overlays rendered from stored Grad-CAM heatmaps (api/overlays.py); query parameters override per request
+ANALYSIS_OVERLAYS = {
+    'ALPHA': 0.4,
+    'COLORMAP': 'jet',                  # jet, hot, viridis, inferno, gray
+    'FORMAT': 'png',                    # png, webp, jpeg (?image_format=)
+    'QUALITY': 85,
+    'SIZE': 1024,                       # longest side in pixels
+    'MAX_SIZE': 2048,
+    'CACHE_MAX_BYTES': 64 * 1024 * 1024,
+    'URL_MAX_AGE': 3600,                # seconds a signed overlay URL (?sig=) stays valid
+}
+
+# Server-Timing headers and the staff-only /api/analysis-results/request-timing/ aggregate
+REQUEST_TIMING = {
+    'ENABLED': True,
+    'WINDOW': 500,      # most recent requests kept per route
+    # Origins sent Timing-Allow-Origin, so the cross-origin frontend sees the breakdown
+    'ALLOW_ORIGINS': CORS_ALLOWED_ORIGINS,
+}
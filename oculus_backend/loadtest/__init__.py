@@ -0,0 +1,17 @@
+"""Offline end-to-end load test of the Django API and the model service.
+
+Run from ``oculus_backend/``::
+
+    python -m loadtest --users 16 --duration 120
+    python -m loadtest --model-service real --model-path /path/to/retinal_model.h5
+    python -m loadtest --api-url http://staging:8000 --users 32 --max-error-rate 0.01 --max-p95-ms 800
+
+By default the harness starts everything itself in a scratch directory: a
+deterministic stub of the model service (``stub.py``), the Django API on a
+fresh SQLite database (``settings.py``) and, unless ``--sync-analysis``, an
+analysis worker pool. Virtual users then sign up and loop over a weighted
+mix of login, upload, record listing, analysis lookup and review traffic.
+The report gives throughput, latency percentiles and error rates per
+operation; the ``--max-*``/``--min-*`` gates make the exit status non-zero
+when a release regresses. Nothing touches the network beyond localhost.
+"""
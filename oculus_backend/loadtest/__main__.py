@@ -0,0 +1,177 @@
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+import time
+
+from . import __doc__ as USAGE
+from .stack import Stack, free_port, start_django, start_model_service, start_stub
+from .workload import ANALYSIS_WAIT, REQUEST_NAMES, Recorder, VirtualUser, parse_mix
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m loadtest', description=USAGE,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_argument_group('stack under test')
+    target.add_argument('--api-url', help="Test a running API instead of starting one (e.g. http://127.0.0.1:8000)")
+    target.add_argument('--model-service', choices=('stub', 'real'), default='stub',
+                        help="Model service to start next to the API (default: the deterministic stub)")
+    target.add_argument('--model-url', help="Use a running model service instead of starting one")
+    target.add_argument('--model-path', help="Model file for --model-service real (serve.py's default otherwise)")
+    target.add_argument('--model-workers', type=int, default=1, help="serve.py workers for --model-service real")
+    target.add_argument('--stub-latency-ms', type=float, default=150.0)
+    target.add_argument('--stub-classify-latency-ms', type=float, default=40.0)
+    target.add_argument('--stub-slots', type=int, default=1, help="Images the stub processes concurrently")
+    target.add_argument('--sync-analysis', action='store_true',
+                        help="Analyse inside the upload request (ANALYSIS_JOBS['ASYNC'] = False)")
+    target.add_argument('--analysis-workers', type=int, default=1)
+    target.add_argument('--keep', action='store_true', help="Keep the run directory (database, media, logs)")
+
+    load = parser.add_argument_group('load')
+    load.add_argument('--users', type=int, default=8, help="Concurrent virtual users")
+    load.add_argument('--duration', type=float, default=60.0, help="Seconds of traffic after ramp-up starts")
+    load.add_argument('--ramp-up', type=float, default=5.0, help="Seconds over which users start")
+    load.add_argument('--think-time', type=float, default=0.0,
+                      help="Mean seconds a user waits between operations (0 = closed loop, as fast as possible)")
+    load.add_argument('--mix', help="Operation weights, e.g. 'upload=20,list_records=50'")
+    load.add_argument('--image-size', default='768x496', help="Uploaded scan size, WIDTHxHEIGHT")
+    load.add_argument('--seed', type=int, default=0)
+
+    report = parser.add_argument_group('report and release gates')
+    report.add_argument('--json', help="Also write the report to this file")
+    report.add_argument('--max-error-rate', type=float, help="Fail if more than this fraction of requests fail")
+    report.add_argument('--max-p95-ms', type=float, help="Fail if the p95 over all requests exceeds this")
+    report.add_argument('--min-rps', type=float, help="Fail if throughput falls below this many requests/s")
+    return parser.parse_args(argv)
+
+
+def percentile_ms(sorted_seconds, q):
+    if not sorted_seconds:
+        return 0.0
+    return sorted_seconds[min(int(len(sorted_seconds) * q / 100), len(sorted_seconds) - 1)] * 1000
+
+
+def summarize(samples, statuses, elapsed):
+    latencies = sorted(seconds for seconds, _ in samples)
+    errors = sum(1 for _, ok in samples if not ok)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': errors / len(samples) if samples else 0.0,
+        'rps': len(samples) / elapsed,
+        'p50_ms': percentile_ms(latencies, 50),
+        'p90_ms': percentile_ms(latencies, 90),
+        'p95_ms': percentile_ms(latencies, 95),
+        'p99_ms': percentile_ms(latencies, 99),
+        'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+        'statuses': {str(status): count for status, count in statuses.items()},
+    }
+
+
+def build_report(recorder, elapsed, args):
+    operations = {
+        name: summarize(recorder.samples[name], recorder.statuses[name], elapsed)
+        for name in (*REQUEST_NAMES, ANALYSIS_WAIT) if recorder.samples[name]
+    }
+    all_requests = [sample for name in REQUEST_NAMES for sample in recorder.samples[name]]
+    all_statuses = {}
+    for name in REQUEST_NAMES:
+        for status, count in recorder.statuses[name].items():
+            all_statuses[status] = all_statuses.get(status, 0) + count
+    return {
+        'config': {key: value for key, value in vars(args).items() if not key.startswith(('json', 'max_', 'min_'))},
+        'elapsed_seconds': elapsed,
+        'total': summarize(all_requests, all_statuses, elapsed),
+        'operations': operations,
+    }
+
+
+def print_report(report):
+    print(f"\n{report['config']['users']} users, {report['elapsed_seconds']:.1f}s")
+    print(f"{'operation':<16} {'requests':>8} {'rps':>7} {'errors':>7} {'p50_ms':>8} {'p90_ms':>8} "
+          f"{'p95_ms':>8} {'p99_ms':>8} {'max_ms':>8}")
+    rows = [*report['operations'].items(), ('total', report['total'])]
+    for name, row in rows:
+        if name == ANALYSIS_WAIT:
+            # Not a request; listed after the total
+            continue
+        print(_row(name, row))
+    if ANALYSIS_WAIT in report['operations']:
+        print(_row(ANALYSIS_WAIT, report['operations'][ANALYSIS_WAIT]))
+    failed = {status: count for status, count in report['total']['statuses'].items()
+              if not status.startswith('2')}
+    if failed:
+        print(f"non-2xx: {failed}")
+
+
+def _row(name, row):
+    return (f"{name:<16} {row['requests']:>8} {row['rps']:>7.1f} {row['error_rate']:>6.1%} {row['p50_ms']:>8.1f} "
+            f"{row['p90_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['max_ms']:>8.1f}")
+
+
+def check_gates(report, args):
+    total = report['total']
+    failures = []
+    if args.max_error_rate is not None and total['error_rate'] > args.max_error_rate:
+        failures.append(f"error rate {total['error_rate']:.2%} > {args.max_error_rate:.2%}")
+    if args.max_p95_ms is not None and total['p95_ms'] > args.max_p95_ms:
+        failures.append(f"p95 {total['p95_ms']:.1f} ms > {args.max_p95_ms:.1f} ms")
+    if args.min_rps is not None and total['rps'] < args.min_rps:
+        failures.append(f"throughput {total['rps']:.1f} req/s < {args.min_rps:.1f} req/s")
+    return failures
+
+
+def run_load(args, api_url):
+    width, height = (int(side) for side in args.image_size.lower().split('x'))
+    recorder = Recorder()
+    start = time.monotonic()
+    deadline = start + args.duration
+    users = []
+    for index in range(args.users):
+        user = VirtualUser(index, api_url, parse_mix(args.mix), recorder, deadline, (width, height),
+                           seed=args.seed + index, think_time=args.think_time)
+        user.start()
+        users.append(user)
+        if args.users > 1:
+            time.sleep(args.ramp_up / args.users)
+    for user in users:
+        # A user finishes the operation it is in; uploads wait at most for their analysis timeout
+        user.join()
+    return build_report(recorder, time.monotonic() - start, args)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    run_dir = tempfile.mkdtemp(prefix='oculus-loadtest-')
+    stack = Stack(run_dir)
+    try:
+        api_url = args.api_url
+        if api_url is None:
+            model_urls = args.model_url
+            if model_urls is None:
+                model_port = free_port()
+                (start_stub if args.model_service == 'stub' else start_model_service)(stack, model_port, args)
+                model_urls = f"http://127.0.0.1:{model_port}"
+            api_port = free_port()
+            start_django(stack, api_port, model_urls, args)
+            api_url = f"http://127.0.0.1:{api_port}"
+        print(f"Load testing {api_url} with {args.users} users for {args.duration:.0f}s (run dir {run_dir})")
+        report = run_load(args, api_url)
+    finally:
+        stack.stop()
+        if not args.keep:
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    failures = check_gates(report, args)
+    for failure in failures:
+        print(f"GATE FAILED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
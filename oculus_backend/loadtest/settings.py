@@ -0,0 +1,30 @@
+"""Django settings for a load-test run: the project settings on a scratch database and media root.
+
+``LOADTEST_DIR`` holds everything the run writes; ``LOADTEST_MODEL_URLS``
+points the API at the model service under test.
+"""
+import os
+
+from backend.settings import *  # noqa: F401,F403
+from backend.settings import AI_MODEL_SERVICE, ANALYSIS_CACHE, ANALYSIS_JOBS
+
+_run_dir = os.environ['LOADTEST_DIR']
+
+DEBUG = False
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(_run_dir, 'db.sqlite3'),
+        # Concurrent writers (API threads and analysis workers) wait for the lock instead of failing
+        'OPTIONS': {'timeout': 30},
+    }
+}
+
+MEDIA_ROOT = os.path.join(_run_dir, 'media')
+
+ANALYSIS_CACHE = {**ANALYSIS_CACHE, 'DIR': os.path.join(_run_dir, 'analysis_cache')}
+
+AI_MODEL_SERVICE = {**AI_MODEL_SERVICE, 'URLS': os.environ['LOADTEST_MODEL_URLS'].split(',')}
+
+ANALYSIS_JOBS = {**ANALYSIS_JOBS, 'ASYNC': os.environ.get('LOADTEST_ASYNC_ANALYSIS', '1') == '1'}
@@ -0,0 +1,105 @@
+"""Start and stop the services under test as child processes."""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+
+OCULUS_BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DJANGO_DIR = os.path.join(OCULUS_BACKEND, "backend")
+MODEL_SERVICE_DIR = os.path.join(OCULUS_BACKEND, "ai_model_service")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Stack:
+    """The processes of one run. Logs go to ``<run_dir>/<name>.log``."""
+
+    def __init__(self, run_dir):
+        self.run_dir = run_dir
+        self.processes = []
+
+    def start(self, name, command, cwd, env=None):
+        log = open(os.path.join(self.run_dir, f"{name}.log"), "wb")
+        process = subprocess.Popen(
+            command, cwd=cwd, env={**os.environ, **(env or {})}, stdout=log, stderr=subprocess.STDOUT,
+            # Own process group, so stopping also reaches forked workers
+            start_new_session=True,
+        )
+        self.processes.append((name, process, log))
+        return process
+
+    def wait_until_up(self, name, url, timeout=180.0):
+        """Poll ``url`` until it answers at all (any status), or fail with the process log."""
+        process = next(p for n, p, _ in self.processes if n == name)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{name} exited with {process.returncode}:\n{self.tail_log(name)}")
+            try:
+                requests.get(url, timeout=2)
+                return
+            except (requests.ConnectionError, requests.Timeout):
+                # serve.py binds its socket before the workers have loaded the model
+                time.sleep(0.25)
+        raise RuntimeError(f"{name} did not come up within {timeout:.0f}s:\n{self.tail_log(name)}")
+
+    def tail_log(self, name, lines=30):
+        with open(os.path.join(self.run_dir, f"{name}.log"), "rb") as f:
+            return b"\n".join(f.read().splitlines()[-lines:]).decode("utf-8", "replace")
+
+    def stop(self):
+        for _, process, _ in reversed(self.processes):
+            if process.poll() is None:
+                os.killpg(process.pid, signal.SIGTERM)
+        for _, process, log in reversed(self.processes):
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+            log.close()
+        self.processes = []
+
+
+def start_stub(stack, port, args):
+    stack.start("model_service", [
+        sys.executable, "-m", "loadtest.stub", "--port", str(port),
+        "--latency-ms", str(args.stub_latency_ms), "--classify-latency-ms", str(args.stub_classify_latency_ms),
+        "--slots", str(args.stub_slots),
+    ], cwd=OCULUS_BACKEND)
+    stack.wait_until_up("model_service", f"http://127.0.0.1:{port}/health")
+
+
+def start_model_service(stack, port, args):
+    command = [sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(args.model_workers)]
+    if args.model_path:
+        command += ["--model", args.model_path]
+    stack.start("model_service", command, cwd=MODEL_SERVICE_DIR)
+    stack.wait_until_up("model_service", f"http://127.0.0.1:{port}/health", timeout=600)
+
+
+def start_django(stack, port, model_urls, args):
+    env = {
+        "DJANGO_SETTINGS_MODULE": "loadtest.settings",
+        "PYTHONPATH": os.pathsep.join(filter(None, [OCULUS_BACKEND, os.environ.get("PYTHONPATH")])),
+        "LOADTEST_DIR": stack.run_dir,
+        "LOADTEST_MODEL_URLS": model_urls,
+        "LOADTEST_ASYNC_ANALYSIS": "0" if args.sync_analysis else "1",
+    }
+    manage = [sys.executable, "manage.py"]
+    subprocess.run(manage + ["migrate", "--noinput"], cwd=DJANGO_DIR, env={**os.environ, **env}, check=True,
+                   stdout=subprocess.DEVNULL)
+    stack.start("django", manage + ["runserver", f"127.0.0.1:{port}", "--noreload"], cwd=DJANGO_DIR, env=env)
+    if not args.sync_analysis:
+        stack.start("analysis_workers", manage + ["run_analysis_workers", "--workers", str(args.analysis_workers)],
+                    cwd=DJANGO_DIR, env=env)
+    stack.wait_until_up("django", f"http://127.0.0.1:{port}/api/")
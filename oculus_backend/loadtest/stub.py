@@ -0,0 +1,135 @@
+"""Deterministic stand-in for the model service.
+
+Speaks the real wire protocol (``ai_model_service/protocol.py``) on
+``/health``, ``/predict`` and ``/predict_batch``. Each image gets a
+class, confidence and latency derived from a hash of its bytes, so two runs
+over the same images behave identically. ``--slots`` bounds how many images
+are "on the GPU" at once, so the stub saturates the way one model worker
+does instead of scaling without limit.
+
+    python -m loadtest.stub --port 5000 --latency-ms 150 --classify-latency-ms 40 --slots 1
+"""
+import argparse
+import base64
+import hashlib
+import io
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from flask import Flask, Response, jsonify, request
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai_model_service"))
+
+from protocol import (  # noqa: E402
+    ANALYSIS_CONTENT_TYPE, encode_analysis_frame, read_request_image, read_request_images, wants_binary,
+    wants_explanation, wants_overlay,
+)
+
+CLASSES = ("CNV (Choroidal Neovascularization)", "DME (Diabetic Macular Edema)", "Drusen", "Normal")
+
+
+def stub_overlay(size=224):
+    """A 224x224 RGB PNG with noise, so it weighs about as much as a real Grad-CAM overlay."""
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, size=(size, size, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def stub_heatmap(size=7):
+    """A base64 8-bit grayscale PNG Grad-CAM map at the real model's resolution."""
+    rows, columns = np.mgrid[0:size, 0:size]
+    peak = np.exp(-((rows - size / 2) ** 2 + (columns - size / 2) ** 2) / size)
+    buffer = io.BytesIO()
+    Image.fromarray(np.uint8(255 * peak / peak.max())).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+class StubModel:
+    def __init__(self, latency_ms=150.0, classify_latency_ms=40.0, jitter=0.2, slots=1):
+        self.latency = latency_ms / 1000
+        self.classify_latency = classify_latency_ms / 1000
+        self.jitter = jitter
+        self.overlay = stub_overlay()
+        self.heatmap = stub_heatmap()
+        self._slots = threading.BoundedSemaphore(slots)
+
+    def analyse(self, img_bytes, explain, overlay=True):
+        digest = hashlib.sha256(img_bytes).digest()
+        # Separate hash bytes pick the class, the confidence and the latency jitter
+        category = CLASSES[digest[0] % len(CLASSES)]
+        confidence = 50.0 + (int.from_bytes(digest[1:3], "big") / 65535) * 49.99
+        jitter = 1 + self.jitter * (int.from_bytes(digest[3:5], "big") / 32767.5 - 1)
+        with self._slots:
+            time.sleep((self.latency if explain else self.classify_latency) * jitter)
+        others = (1 - confidence / 100) / (len(CLASSES) - 1)
+        result = {
+            "category": category,
+            "confidence": confidence,
+            "probabilities": {name: confidence / 100 if name == category else others for name in CLASSES},
+        }
+        if not explain:
+            return result, b""
+        result["region"] = "middle central"
+        result["heatmap"] = self.heatmap
+        return result, self.overlay if overlay else b""
+
+
+def create_app(model):
+    app = Flask(__name__)
+
+    @app.route("/health", methods=["GET"])
+    def health():
+        return jsonify({"status": "ready", "backend": "stub", "model": "stub"})
+
+    @app.route("/predict", methods=["POST"])
+    def predict():
+        img_bytes = read_request_image(request)
+        if not img_bytes:
+            return jsonify({"category": "error", "text": "No image data received", "analyzed_image": None}), 400
+        result, overlay = model.analyse(img_bytes, wants_explanation(request), wants_overlay(request))
+        if wants_binary(request):
+            return Response(encode_analysis_frame(result, overlay), mimetype=ANALYSIS_CONTENT_TYPE)
+        return jsonify(dict(result, analyzed_image=_base64(overlay)))
+
+    @app.route("/predict_batch", methods=["POST"])
+    def predict_batch():
+        images = read_request_images(request)
+        if not images:
+            return jsonify({"error": "No images received"}), 400
+        explain = wants_explanation(request)
+        overlay = wants_overlay(request)
+        analyses = [model.analyse(img_bytes, explain, overlay) for img_bytes in images]
+        if wants_binary(request):
+            body = b"".join(encode_analysis_frame(result, overlay) for result, overlay in analyses)
+            return Response(body, mimetype=ANALYSIS_CONTENT_TYPE)
+        return jsonify({"results": [dict(result, analyzed_image=_base64(overlay)) for result, overlay in analyses]})
+
+    return app
+
+
+def _base64(overlay):
+    return base64.b64encode(overlay).decode("utf-8") if overlay else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Deterministic stub of the model service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="Per-image latency with Grad-CAM")
+    parser.add_argument("--classify-latency-ms", type=float, default=40.0, help="Per-image latency with ?explain=0")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency spread, as a fraction of the latency")
+    parser.add_argument("--slots", type=int, default=1, help="Images processed concurrently")
+    args = parser.parse_args(argv)
+
+    model = StubModel(args.latency_ms, args.classify_latency_ms, args.jitter, args.slots)
+    create_app(model).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Virtual users and the traffic mix they generate."""
+import io
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import numpy as np
+import requests
+from PIL import Image
+
+# Relative weights of what a signed-in doctor does next, roughly the frontend's usage:
+# mostly browsing records and results, some uploads and reviews, occasional re-login.
+DEFAULT_MIX = {
+    'login': 5,
+    'upload': 10,
+    'list_records': 30,
+    'view_record': 30,
+    'review': 10,
+    'list_reviews': 15,
+}
+
+# Requests that are part of an operation but not operations of their own
+REQUEST_NAMES = ('signup', 'login', 'upload', 'job_poll', 'list_records', 'image_detail', 'analysis_lookup',
+                 'review', 'list_reviews')
+# Upload until the analysis is stored; spans several requests, so it is not counted as one
+ANALYSIS_WAIT = 'analysis_wait'
+
+PASSWORD = 'load-test-password'
+
+
+def parse_mix(text):
+    """``"upload=20,list_records=50"`` -> weights, unlisted operations keep their default."""
+    mix = dict(DEFAULT_MIX)
+    for item in filter(None, (part.strip() for part in (text or '').split(','))):
+        name, _, weight = item.partition('=')
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Unknown operation {name!r}; expected one of {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight)
+    return mix
+
+
+class Recorder:
+    """Latency and outcome of every request, by name. Thread-safe."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, status, ok):
+        with self._lock:
+            self.samples[name].append((seconds, ok))
+            self.statuses[name][status] += 1
+
+
+def synthetic_scan(rng, width, height):
+    """A B-scan look-alike: bright bands under speckle, so it compresses like a real scan."""
+    rows = np.linspace(0, 1, height)[:, None]
+    surface = 0.35 + 0.05 * np.sin(np.linspace(0, 3 * np.pi, width))[None, :]
+    layers = sum(np.exp(-((rows - surface - offset) ** 2) / 0.008) * weight
+                 for offset, weight in ((0.0, 0.9), (0.06, 0.5), (0.12, 0.7)))
+    speckle = rng.gamma(2.0, 0.5, size=(height, width))
+    return np.clip(layers * speckle * 160 + 8, 0, 255).astype(np.uint8)
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, index, base_url, mix, recorder, deadline, image_size, seed, think_time=0.0,
+                 poll_interval=0.25, analysis_timeout=120.0):
+        super().__init__(name=f'vu-{index}', daemon=True)
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.deadline = deadline
+        self.think_time = think_time
+        self.poll_interval = poll_interval
+        self.analysis_timeout = analysis_timeout
+        self.rng = random.Random(seed)
+        self.operations = [name for name, weight in mix.items() if weight > 0]
+        self.weights = [mix[name] for name in self.operations]
+        self.username = f'load-{index}-{uuid.uuid4().hex[:8]}'
+        self.session = requests.Session()
+        # One scan per user; every upload perturbs it, so the analysis cache never answers
+        self.scan = synthetic_scan(np.random.default_rng(seed), *image_size)
+        self.uploads = 0
+        self.oct_images = []
+        self.analysis_results = {}
+
+    def run(self):
+        if not self.signup():
+            return
+        while time.monotonic() < self.deadline:
+            getattr(self, self.rng.choices(self.operations, self.weights)[0])()
+            if self.think_time:
+                time.sleep(self.rng.expovariate(1 / self.think_time))
+
+    def request(self, name, method, path, expected=(200,), **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, f'{self.base_url}{path}', timeout=120, **kwargs)
+        except requests.RequestException as e:
+            self.recorder.record(name, time.perf_counter() - start, type(e).__name__, False)
+            return None
+        ok = response.status_code in expected
+        self.recorder.record(name, time.perf_counter() - start, response.status_code, ok)
+        return response if ok else None
+
+    def authenticate(self, response):
+        if response is not None:
+            self.session.headers['Authorization'] = f"Bearer {response.json()['access']}"
+        return response is not None
+
+    def signup(self):
+        return self.authenticate(self.request('signup', 'POST', '/api/doctors/signup/', expected=(201,), json={
+            'username': self.username, 'email': f'{self.username}@example.com', 'password': PASSWORD,
+            'first_name': 'Load', 'last_name': 'Test',
+        }))
+
+    def login(self):
+        self.authenticate(self.request('login', 'POST', '/api/token/', json={
+            'username': self.username, 'password': PASSWORD,
+        }))
+
+    def next_image(self):
+        self.uploads += 1
+        scan = self.scan.copy()
+        scan[0, :64] = np.frombuffer(self.uploads.to_bytes(8, 'big') * 8, dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(scan).save(buffer, format='JPEG', quality=90)
+        return buffer.getvalue()
+
+    def upload(self):
+        start = time.perf_counter()
+        response = self.request('upload', 'POST', '/api/oct-images/', expected=(201, 202), files={
+            'image_file': (f'scan_{self.uploads}.jpg', self.next_image(), 'image/jpeg'),
+        }, data={'custom_id': f'{self.username}-{self.uploads}'})
+        if response is None:
+            return
+        data = response.json()
+        self.oct_images.append(data['id'])
+        job = data.get('job')
+        if job is None:
+            # Analysed inside the upload request
+            self.recorder.record(ANALYSIS_WAIT, time.perf_counter() - start, response.status_code, True)
+            return
+
+        # The frontend polls the job until the analysis is stored
+        while time.perf_counter() - start < self.analysis_timeout:
+            time.sleep(self.poll_interval)
+            poll = self.request('job_poll', 'GET', f"/api/analysis-results/jobs/{job['id']}/")
+            if poll is None:
+                continue
+            job = poll.json()
+            if job['status'] in ('done', 'failed'):
+                ok = job['status'] == 'done'
+                if ok:
+                    self.analysis_results[data['id']] = job['analysis_result']
+                self.recorder.record(ANALYSIS_WAIT, time.perf_counter() - start, job['status'], ok)
+                return
+        self.recorder.record(ANALYSIS_WAIT, time.perf_counter() - start, 'timeout', False)
+
+    def list_records(self):
+        self.request('list_records', 'GET', '/api/oct-images/')
+
+    def view_record(self):
+        if not self.oct_images:
+            return self.upload()
+        oct_image = self.rng.choice(self.oct_images)
+        self.request('image_detail', 'GET', f'/api/oct-images/{oct_image}/')
+        response = self.request('analysis_lookup', 'GET', '/api/analysis-results/', params={'oct_image': oct_image})
+        if response is not None and response.json()['results']:
+            self.analysis_results[oct_image] = response.json()['results'][0]['id']
+
+    def review(self):
+        if not self.analysis_results:
+            return self.view_record()
+        analysis_result = self.rng.choice(list(self.analysis_results.values()))
+        self.request('review', 'POST', '/api/reviews/', expected=(201,), json={
+            'analysis_result': analysis_result, 'rating': self.rng.randint(1, 5), 'comments': 'Load test review',
+        })
+
+    def list_reviews(self):
+        if not self.analysis_results:
+            return self.request('list_reviews', 'GET', '/api/reviews/')
+        analysis_result = self.rng.choice(list(self.analysis_results.values()))
+        self.request('list_reviews', 'GET', '/api/reviews/', params={'analysis_result': analysis_result})